@@ -10,12 +10,15 @@ It can also make use of the global route planner to follow a specifed route
 """
 
 import carla
+import numpy as np
 from enum import Enum
 from shapely.geometry import Polygon
 
 from agents.navigation.local_planner import LocalPlanner
-from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner import get_global_route_planner
 from agents.tools.misc import get_speed, is_within_distance, get_trafficlight_trigger_location, compute_distance
+from agents.tools.world_state import ActorGroup, get_world_state_cache
+from agents.tools.traffic_light_index import get_traffic_light_index
 
 
 class BasicAgent(object):
@@ -49,6 +52,9 @@ class BasicAgent(object):
         self._base_tlight_threshold = 5.0  # meters
         self._base_vehicle_threshold = 5.0  # meters
         self._max_brake = 0.5
+        self._graph_cache_dir = None
+        self._planner_heuristic = 'euclidean'
+        self._use_waypoint_index = False
 
         # Change parameters according to the dictionary
         opt_dict['target_speed'] = target_speed
@@ -66,10 +72,28 @@ class BasicAgent(object):
             self._base_vehicle_threshold = opt_dict['base_vehicle_threshold']
         if 'max_brake' in opt_dict:
             self._max_brake = opt_dict['max_brake']
+        if 'graph_cache_dir' in opt_dict:
+            self._graph_cache_dir = opt_dict['graph_cache_dir']
+        if 'planner_heuristic' in opt_dict:
+            self._planner_heuristic = opt_dict['planner_heuristic']
+        if 'use_waypoint_index' in opt_dict:
+            self._use_waypoint_index = opt_dict['use_waypoint_index']
 
         # Initialize the planners
         self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict)
-        self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+        # The global planner is shared by all the agents using the same map and sampling resolution
+        self._global_planner = get_global_route_planner(
+            self._map, self._sampling_resolution, self._graph_cache_dir, self._planner_heuristic,
+            self._use_waypoint_index)
+
+        # Client-side lane lookups, instead of calling the map for every actor on every tick
+        self._waypoint_index = self._global_planner.get_waypoint_index() if self._use_waypoint_index else None
+
+        # Actors of the world, fetched once per frame for all the agents
+        self._world_state = get_world_state_cache(self._world)
+
+        # Trigger waypoints of the traffic lights, built on the first check and shared by all the agents
+        self._traffic_light_index = None
 
     def add_emergency_stop(self, control):
         """
@@ -106,6 +130,14 @@ class BasicAgent(object):
         """Get method for protected member local planner"""
         return self._global_planner
 
+    def get_vehicle(self):
+        """Get method for protected member vehicle"""
+        return self._vehicle
+
+    def get_world_state(self):
+        """Get method for protected member world state cache"""
+        return self._world_state
+
     def set_destination(self, end_location, start_location=None):
         """
         This method creates a list of waypoints between a starting and ending location,
@@ -155,13 +187,16 @@ class BasicAgent(object):
         return self._global_planner.trace_route(start_location, end_location)
 
     def run_step(self):
-        """Execute one step of navigation."""
+        """
+        Execute one step of navigation.
+        While the agent is in a FleetController, the throttle, brake and steer of the returned control
+        not set by the agent are only filled in at the end of the step of the fleet.
+        """
         hazard_detected = False
 
         # Retrieve all relevant actors
-        actor_list = self._world.get_actors()
-        vehicle_list = actor_list.filter("*vehicle*")
-        lights_list = actor_list.filter("*traffic_light*")
+        vehicle_list = self._world_state.vehicles()
+        lights_list = self._world_state.traffic_lights()
 
         vehicle_speed = get_speed(self._vehicle) / 3.6
 
@@ -199,6 +234,21 @@ class BasicAgent(object):
         """(De)activates the checks for stop signs"""
         self._ignore_vehicles = active
 
+    def _get_waypoint(self, location, lane_type=carla.LaneType.Driving):
+        """
+        Returns the waypoint of the lane closest to a location, from the waypoint index if enabled,
+        or from the map otherwise. The index only has driving lanes, so for other lane types
+        the map is used when the location is off the driving lanes.
+
+            :param location (carla.Location): location to localize
+            :param lane_type (carla.LaneType): lane types to consider
+        """
+        if self._waypoint_index is not None:
+            waypoint = self._waypoint_index.get_waypoint(location)
+            if lane_type == carla.LaneType.Driving or waypoint.distance <= waypoint.lane_width / 2.0:
+                return waypoint
+        return self._map.get_waypoint(location, lane_type=lane_type)
+
     def _affected_by_traffic_light(self, lights_list=None, max_distance=None):
         """
         Method to check if there is a red light affecting the vehicle.
@@ -212,7 +262,7 @@ class BasicAgent(object):
             return (False, None)
 
         if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
+            lights_list = self._world_state.traffic_lights()
 
         if not max_distance:
             max_distance = self._base_tlight_threshold
@@ -224,18 +274,12 @@ class BasicAgent(object):
                 return (True, self._last_traffic_light)
 
         ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        ego_vehicle_waypoint = self._get_waypoint(ego_vehicle_location)
+        ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
 
-        for traffic_light in lights_list:
-            object_location = get_trafficlight_trigger_location(traffic_light)
-            object_waypoint = self._map.get_waypoint(object_location)
-
-            if object_waypoint.road_id != ego_vehicle_waypoint.road_id:
-                continue
-
-            ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
-            wp_dir = object_waypoint.transform.get_forward_vector()
-            dot_ve_wp = ve_dir.x * wp_dir.x + ve_dir.y * wp_dir.y + ve_dir.z * wp_dir.z
+        for traffic_light, object_waypoint, wp_dir in self._traffic_lights_on_road(
+                lights_list, ego_vehicle_waypoint.road_id):
+            dot_ve_wp = ve_dir.x * wp_dir[0] + ve_dir.y * wp_dir[1] + ve_dir.z * wp_dir[2]
 
             if dot_ve_wp < 0:
                 continue
@@ -249,12 +293,58 @@ class BasicAgent(object):
 
         return (False, None)
 
+    def _traffic_lights_on_road(self, lights_list, road_id):
+        """
+        Returns the traffic lights of lights_list whose trigger volume is on a road, in the order of
+        lights_list, as (traffic light, trigger waypoint, trigger forward vector as (x, y, z)).
+        The trigger waypoints come from the shared traffic light index.
+
+            :param lights_list (list of carla.TrafficLight): list containing TrafficLight objects
+            :param road_id (int): id of the road
+        """
+        if self._traffic_light_index is None:
+            self._traffic_light_index = get_traffic_light_index(
+                self._world, self._map, self._world_state.traffic_lights())
+
+        # All the lights of the world, already in the order of the index
+        if lights_list is self._world_state.traffic_lights():
+            return self._traffic_light_index.lights_on_road(road_id)
+
+        positions = {}
+        for position, traffic_light in enumerate(lights_list):
+            if traffic_light.id not in self._traffic_light_index:
+                # Not indexed, e.g. a list from another world, compute the trigger waypoints
+                return self._traffic_lights_on_road_from_map(lights_list, road_id)
+            positions[traffic_light.id] = (position, traffic_light)
+
+        on_road = []
+        for entry in self._traffic_light_index.lights_on_road(road_id):
+            if entry.traffic_light.id in positions:
+                position, traffic_light = positions[entry.traffic_light.id]
+                on_road.append((position, traffic_light, entry.waypoint, entry.forward))
+        on_road.sort(key=lambda light: light[0])
+        return [light[1:] for light in on_road]
+
+    def _traffic_lights_on_road_from_map(self, lights_list, road_id):
+        """
+        Version of _traffic_lights_on_road computing the trigger waypoints of each traffic light
+        """
+        on_road = []
+        for traffic_light in lights_list:
+            object_location = get_trafficlight_trigger_location(traffic_light)
+            object_waypoint = self._get_waypoint(object_location)
+            if object_waypoint.road_id != road_id:
+                continue
+            wp_dir = object_waypoint.transform.get_forward_vector()
+            on_road.append((traffic_light, object_waypoint, (wp_dir.x, wp_dir.y, wp_dir.z)))
+        return on_road
+
     def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0, lane_offset=0):
         """
         Method to check if there is a vehicle in front of the agent blocking its path.
 
-            :param vehicle_list (list of carla.Vehicle): list contatining vehicle objects.
-                If None, all vehicle in the scene are used
+            :param vehicle_list (list of carla.Vehicle): list contatining vehicle objects, or an ActorGroup
+                of the world state cache. If None, all vehicle in the scene are used
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
         """
@@ -262,94 +352,194 @@ class BasicAgent(object):
             return (False, None, -1)
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            vehicle_list = self._world_state.vehicles()
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
         ego_transform = self._vehicle.get_transform()
-        ego_wpt = self._map.get_waypoint(self._vehicle.get_location())
+        ego_wpt = self._get_waypoint(self._vehicle.get_location())
 
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
             lane_offset *= -1
 
-        # Get the transform of the front of the ego
+        # Get the transform of the front of the ego. Distances to the targets are measured from it
         ego_forward_vector = ego_transform.get_forward_vector()
         ego_extent = self._vehicle.bounding_box.extent.x
-        ego_front_transform = ego_transform
-        ego_front_transform.location += carla.Location(
+        ego_front_transform = carla.Transform(ego_transform.location + carla.Location(
             x=ego_extent * ego_forward_vector.x,
             y=ego_extent * ego_forward_vector.y,
-        )
+        ), ego_transform.rotation)
+
+        # Pull the transforms and extents of all the targets once
+        if not isinstance(vehicle_list, ActorGroup):
+            vehicle_list = list(vehicle_list)
+        targets = _TargetArrays(vehicle_list)
+
+        # Targets whose rear can be within the distance and angle thresholds. The margins keep the
+        # prefilter conservative, the survivors go through the exact per vehicle check below
+        front = np.array([ego_front_transform.location.x, ego_front_transform.location.y])
+        target_vector = targets.rear_xy - front
+        norm_target = np.sqrt(np.einsum('ij,ij->i', target_vector, target_vector))
+        forward = np.array([ego_forward_vector.x, ego_forward_vector.y])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = np.dot(target_vector, forward) / norm_target
+        angle = np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+        in_front = (angle > low_angle_th - _ANGLE_MARGIN) & (angle < up_angle_th + _ANGLE_MARGIN)
+        candidates = (norm_target < _DISTANCE_MARGIN) | \
+            ((norm_target <= max_distance + _DISTANCE_MARGIN) & in_front)
+
+        # Outside junctions only the candidates can be obstacles, inside a junction
+        # the first target also inside a junction falls back to the route check
+        if ego_wpt.is_junction:
+            target_indices = range(len(vehicle_list))
+        else:
+            target_indices = np.flatnonzero(candidates).tolist()
+        target_wpts = self._get_waypoints(
+            [targets.transforms[i].location for i in target_indices], lane_type=carla.LaneType.Any)
 
-        for target_vehicle in vehicle_list:
-            target_transform = target_vehicle.get_transform()
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+        next_wpt = None
+        for i, target_wpt in zip(target_indices, target_wpts):
+            target_vehicle = vehicle_list[i]
 
             # Simplified version for outside junctions
             if not ego_wpt.is_junction or not target_wpt.is_junction:
+                if not candidates[i]:
+                    continue
 
                 if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id  + lane_offset:
-                    next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
+                    if next_wpt is None:
+                        next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
                     if not next_wpt:
                         continue
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
                         continue
 
+                target_transform = targets.transforms[i]
                 target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
-                target_rear_transform = target_transform
-                target_rear_transform.location -= carla.Location(
+                target_extent = targets.extents[i, 0]
+                target_rear_transform = carla.Transform(target_transform.location - carla.Location(
                     x=target_extent * target_forward_vector.x,
                     y=target_extent * target_forward_vector.y,
-                )
+                ), target_transform.rotation)
 
                 if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
-                    return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
+                    return (True, target_vehicle, compute_distance(target_rear_transform.location, ego_front_transform.location))
 
             # Waypoints aren't reliable, check the proximity of the vehicle to the route
             else:
-                route_bb = []
-                ego_location = ego_transform.location
-                extent_y = self._vehicle.bounding_box.extent.y
-                r_vec = ego_transform.get_right_vector()
-                p1 = ego_location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                p2 = ego_location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                route_bb.append([p1.x, p1.y, p1.z])
-                route_bb.append([p2.x, p2.y, p2.z])
-
-                for wp, _ in self._local_planner.get_plan():
-                    if ego_location.distance(wp.transform.location) > max_distance:
-                        break
-
-                    r_vec = wp.transform.get_right_vector()
-                    p1 = wp.transform.location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
-                    p2 = wp.transform.location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
-                    route_bb.append([p1.x, p1.y, p1.z])
-                    route_bb.append([p2.x, p2.y, p2.z])
-
-                if len(route_bb) < 3:
-                    # 2 points don't create a polygon, nothing to check
-                    return (False, None, -1)
-                ego_polygon = Polygon(route_bb)
-
-                # Compare the two polygons
-                for target_vehicle in vehicle_list:
-                    target_extent = target_vehicle.bounding_box.extent.x
-                    if target_vehicle.id == self._vehicle.id:
-                        continue
-                    if ego_location.distance(target_vehicle.get_location()) > max_distance:
-                        continue
+                return self._route_obstacle_detected(vehicle_list, targets, ego_transform, ego_front_transform, max_distance)
 
-                    target_bb = target_vehicle.bounding_box
-                    target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                    target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                    target_polygon = Polygon(target_list)
+        return (False, None, -1)
+
+    def _route_obstacle_detected(self, vehicle_list, targets, ego_transform, ego_front_transform, max_distance):
+        """
+        Checks if any of the vehicles intersects the polygon covering the route of the agent
+        up to max_distance. Used inside junctions, where the waypoints aren't reliable.
+        """
+        route_bb = []
+        ego_location = ego_front_transform.location
+        extent_y = self._vehicle.bounding_box.extent.y
+        r_vec = ego_transform.get_right_vector()
+        p1 = ego_location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
+        p2 = ego_location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
+        route_bb.append([p1.x, p1.y, p1.z])
+        route_bb.append([p2.x, p2.y, p2.z])
+
+        for wp, _ in self._local_planner.get_plan():
+            if ego_location.distance(wp.transform.location) > max_distance:
+                break
+
+            r_vec = wp.transform.get_right_vector()
+            p1 = wp.transform.location + carla.Location(extent_y * r_vec.x, extent_y * r_vec.y)
+            p2 = wp.transform.location + carla.Location(-extent_y * r_vec.x, -extent_y * r_vec.y)
+            route_bb.append([p1.x, p1.y, p1.z])
+            route_bb.append([p2.x, p2.y, p2.z])
+
+        if len(route_bb) < 3:
+            # 2 points don't create a polygon, nothing to check
+            return (False, None, -1)
+        ego_polygon = Polygon(route_bb)
+
+        # Only the vehicles within max_distance whose bounding circle touches
+        # the bounds of the route polygon can intersect it
+        route_bounds = np.array(route_bb)
+        min_xy, max_xy = route_bounds[:, :2].min(axis=0), route_bounds[:, :2].max(axis=0)
+        ego_xyz = np.array([ego_location.x, ego_location.y, ego_location.z])
+        center_distance = np.linalg.norm(targets.location_xyz - ego_xyz, axis=1)
+        radius = targets.radius + _DISTANCE_MARGIN
+        candidates = (center_distance <= max_distance + _DISTANCE_MARGIN) & \
+            np.all(targets.location_xyz[:, :2] + radius[:, np.newaxis] >= min_xy, axis=1) & \
+            np.all(targets.location_xyz[:, :2] - radius[:, np.newaxis] <= max_xy, axis=1)
+
+        # Compare the two polygons
+        for i in np.flatnonzero(candidates).tolist():
+            target_vehicle = vehicle_list[i]
+            if target_vehicle.id == self._vehicle.id:
+                continue
+            target_location = targets.transforms[i].location
+            if ego_location.distance(target_location) > max_distance:
+                continue
 
-                    if ego_polygon.intersects(target_polygon):
-                        return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+            target_bb = target_vehicle.bounding_box
+            target_vertices = target_bb.get_world_vertices(targets.transforms[i])
+            target_list = [[v.x, v.y, v.z] for v in target_vertices]
+            target_polygon = Polygon(target_list)
 
-                return (False, None, -1)
+            if ego_polygon.intersects(target_polygon):
+                return (True, target_vehicle, compute_distance(target_location, ego_location))
 
         return (False, None, -1)
+
+    def _get_waypoints(self, locations, lane_type=carla.LaneType.Driving):
+        """
+        Batched version of _get_waypoint. Without the waypoint index the map is
+        queried lazily, as the waypoints are consumed
+        """
+        if self._waypoint_index is None:
+            return (self._map.get_waypoint(location, lane_type=lane_type) for location in locations)
+
+        waypoints = self._waypoint_index.get_waypoints(locations)
+        if lane_type != carla.LaneType.Driving:
+            for i, waypoint in enumerate(waypoints):
+                if waypoint.distance > waypoint.lane_width / 2.0:
+                    waypoints[i] = self._map.get_waypoint(locations[i], lane_type=lane_type)
+        return waypoints
+
+
+# Margins of the NumPy prefilters of the obstacle checks, so that they never discard
+# a target that passes the exact check
+_DISTANCE_MARGIN = 0.1  # meters
+_ANGLE_MARGIN = 1.0  # degrees
+
+
+class _TargetArrays(object):
+    """
+    Transforms and bounding boxes of a list of actors, read once, plus their NumPy arrays.
+    The transforms of an ActorGroup are taken from the world state cache
+    """
+
+    def __init__(self, actors):
+        if isinstance(actors, ActorGroup):
+            self.transforms = actors.transforms
+        else:
+            self.transforms = [actor.get_transform() for actor in actors]
+        bounding_boxes = [actor.bounding_box for actor in actors]
+
+        count = len(actors)
+        self.location_xyz = np.array(
+            [[t.location.x, t.location.y, t.location.z] for t in self.transforms], dtype=np.float64).reshape(count, 3)
+        rotation = np.radians(np.array(
+            [[t.rotation.pitch, t.rotation.yaw] for t in self.transforms], dtype=np.float64).reshape(count, 2))
+        self.extents = np.array(
+            [[bb.extent.x, bb.extent.y] for bb in bounding_boxes], dtype=np.float64).reshape(count, 2)
+        bb_offsets = np.array(
+            [[bb.location.x, bb.location.y] for bb in bounding_boxes], dtype=np.float64).reshape(count, 2)
+
+        # Rear of each actor, as in the exact check: location - extent.x * forward vector
+        forward_xy = np.cos(rotation[:, :1]) * np.stack([np.cos(rotation[:, 1]), np.sin(rotation[:, 1])], axis=1)
+        self.rear_xy = self.location_xyz[:, :2] - self.extents[:, :1] * forward_xy
+
+        # Radius of a circle around the actor location containing its bounding box
+        self.radius = np.linalg.norm(bb_offsets, axis=1) + np.linalg.norm(self.extents, axis=1)
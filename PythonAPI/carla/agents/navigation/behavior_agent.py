@@ -85,8 +85,7 @@ class BehaviorAgent(BasicAgent):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
+        lights_list = self._world_state.traffic_lights()
         affected, _ = self._affected_by_traffic_light(lights_list)
 
         return affected
@@ -141,9 +140,8 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        vehicle_list = self._world_state.vehicles().within_distance(
+            waypoint.transform.location, 45, exclude_id=self._vehicle.id)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
@@ -178,9 +176,7 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        walker_list = self._world_state.walkers().within_distance(waypoint.transform.location, 10)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
@@ -240,6 +236,8 @@ class BehaviorAgent(BasicAgent):
     def run_step(self, debug=False):
         """
         Execute one step of navigation.
+        While the agent is in a FleetController, the control is completed at the end of the step
+        of the fleet, see BasicAgent.run_step.
 
             :param debug: boolean for debugging
             :return control: carla.VehicleControl
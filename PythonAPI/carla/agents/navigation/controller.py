@@ -6,7 +6,6 @@
 """ This module contains PID controllers to perform lateral and longitudinal control. """
 
 from collections import deque
-import math
 import numpy as np
 import carla
 from agents.tools.misc import get_speed
@@ -215,30 +214,13 @@ class PIDLateralController():
         # Get the ego's location and forward vector
         ego_loc = vehicle_transform.location
         v_vec = vehicle_transform.get_forward_vector()
-        v_vec = np.array([v_vec.x, v_vec.y, 0.0])
-
-        # Get the vector vehicle-target_wp
-        if self._offset != 0:
-            # Displace the wp to the side
-            w_tran = waypoint.transform
-            r_vec = w_tran.get_right_vector()
-            w_loc = w_tran.location + carla.Location(x=self._offset*r_vec.x,
-                                                         y=self._offset*r_vec.y)
-        else:
-            w_loc = waypoint.transform.location
 
-        w_vec = np.array([w_loc.x - ego_loc.x,
-                          w_loc.y - ego_loc.y,
-                          0.0])
+        # Get the target location, displaced to the side by the offset
+        w_loc = _target_location(waypoint, self._offset)
 
-        wv_linalg = np.linalg.norm(w_vec) * np.linalg.norm(v_vec)
-        if wv_linalg == 0:
-            _dot = 1
-        else:
-            _dot = math.acos(np.clip(np.dot(w_vec, v_vec) / (wv_linalg), -1.0, 1.0))
-        _cross = np.cross(v_vec, w_vec)
-        if _cross[2] < 0:
-            _dot *= -1.0
+        # Signed angle between the forward vector and the vector vehicle-target_wp
+        _dot = float(_heading_errors(np.array([[ego_loc.x, ego_loc.y]]), np.array([[v_vec.x, v_vec.y]]),
+                                     np.array([[w_loc.x, w_loc.y]]))[0])
 
         self._e_buffer.append(_dot)
         if len(self._e_buffer) >= 2:
@@ -255,4 +237,290 @@ class PIDLateralController():
         self._k_p = K_P
         self._k_i = K_I
         self._k_d = K_D
-        self._dt = dt
\ No newline at end of file
+        self._dt = dt
+
+
+class PIDControllerBank():
+    """
+    PIDControllerBank performs the low level control of N vehicles at once. It holds the
+    lateral and longitudinal PID parameters of each vehicle, and their error history in NumPy
+    ring buffers, and computes the throttle, brake and steer of all the vehicles in a single call,
+    with the same equations, and the same results, as N VehiclePIDController.
+
+    The core run_step only takes arrays, so it doesn't need the simulator.
+    """
+
+    BUFFER_SIZE = 10
+
+    def __init__(self, size, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
+                 max_steering=0.8, past_steering=0.0):
+        """
+        Constructor method. All the parameters, including the values of the dictionaries,
+        can be scalars, shared by all the vehicles, or arrays with a value per vehicle.
+
+            :param size: number of vehicles
+            :param args_lateral: dictionary of arguments of the lateral PID controllers (K_P, K_I, K_D, dt)
+            :param args_longitudinal: dictionary of arguments of the longitudinal PID controllers (K_P, K_I, K_D, dt)
+            :param offset: distance to the center line, see VehiclePIDController
+            :param max_throttle: maximum throttle
+            :param max_brake: maximum brake
+            :param max_steering: maximum steering
+            :param past_steering: steering of the vehicles before the first step
+        """
+        self.size = size
+        self.offset = self._per_vehicle(offset)
+        self.max_throt = self._per_vehicle(max_throttle)
+        self.max_brake = self._per_vehicle(max_brake)
+        self.max_steer = self._per_vehicle(max_steering)
+        self.past_steering = self._per_vehicle(past_steering)
+
+        self._lon = _PIDBankState(size, self.BUFFER_SIZE)
+        self._lat = _PIDBankState(size, self.BUFFER_SIZE)
+        self.change_longitudinal_PID(args_longitudinal)
+        self.change_lateral_PID(args_lateral)
+
+    def _per_vehicle(self, value):
+        return np.array(np.broadcast_to(np.asarray(value, dtype=np.float64), (self.size,)))
+
+    def change_longitudinal_PID(self, args_longitudinal, indices=None):
+        """Changes the parameters of the longitudinal PID controllers, of all the vehicles or only of indices"""
+        self._lon.change_parameters(indices, **args_longitudinal)
+
+    def change_lateral_PID(self, args_lateral, indices=None):
+        """Changes the parameters of the lateral PID controllers, of all the vehicles or only of indices"""
+        self._lat.change_parameters(indices, **args_lateral)
+
+    def reset(self, indices=None, past_steering=0.0):
+        """
+        Clears the error history of all the vehicles or only of indices, e.g. when a vehicle is respawned
+        """
+        rows = self._rows(indices)
+        self._lon.reset(rows)
+        self._lat.reset(rows)
+        self.past_steering[rows] = past_steering
+
+    def resize(self, size):
+        """
+        Changes the number of vehicles of the bank. The vehicles kept don't change, the new ones
+        have the default parameters of VehiclePIDController and no error history, see load_controller.
+        """
+        kept = min(size, self.size)
+        for name, default in (('offset', 0.0), ('max_throt', 0.75), ('max_brake', 0.3),
+                              ('max_steer', 0.8), ('past_steering', 0.0)):
+            values = np.full(size, default)
+            values[:kept] = getattr(self, name)[:kept]
+            setattr(self, name, values)
+        self._lon.resize(size)
+        self._lat.resize(size)
+        self.size = size
+
+    def load_controller(self, index, controller):
+        """
+        Copies the parameters and the error history of a VehiclePIDController to a vehicle of the bank,
+        so that the bank continues its control
+        """
+        self.offset[index] = controller._lat_controller._offset
+        self.max_throt[index] = controller.max_throt
+        self.max_brake[index] = controller.max_brake
+        self.max_steer[index] = controller.max_steer
+        self.past_steering[index] = controller.past_steering
+        self._lon.load(index, controller._lon_controller, controller._lon_controller._error_buffer)
+        self._lat.load(index, controller._lat_controller, controller._lat_controller._e_buffer)
+
+    def store_controller(self, index, controller):
+        """
+        Copies the state of a vehicle of the bank back to a VehiclePIDController, see load_controller
+        """
+        controller.past_steering = float(self.past_steering[index])
+        self._lon.store(index, controller._lon_controller._error_buffer)
+        self._lat.store(index, controller._lat_controller._e_buffer)
+
+    def _rows(self, indices):
+        return np.arange(self.size) if indices is None else np.asarray(indices, dtype=np.int64)
+
+    def run_step(self, target_speeds, current_speeds, locations, forward_vectors, target_locations, indices=None):
+        """
+        Execute one step of control of the vehicles, or only of those in indices,
+        to reach their target locations at the given target speeds.
+
+            :param target_speeds: (M,) desired vehicle speeds in Km/h
+            :param current_speeds: (M,) current vehicle speeds in Km/h
+            :param locations: (M, 2) x and y of the vehicles
+            :param forward_vectors: (M, 2) x and y of the forward vectors of the vehicles
+            :param target_locations: (M, 2) x and y of the targets, already displaced by the offset
+            :param indices: (M,) indices of the vehicles to control, all of them if None
+            :return: (M,) arrays of throttle, brake and steer
+        """
+        rows = self._rows(indices)
+
+        errors = np.asarray(target_speeds, dtype=np.float64) - np.asarray(current_speeds, dtype=np.float64)
+        acceleration = self._lon.pid_control(rows, errors)
+        current_steering = self._lat.pid_control(rows, _heading_errors(
+            np.asarray(locations, dtype=np.float64).reshape(-1, 2),
+            np.asarray(forward_vectors, dtype=np.float64).reshape(-1, 2),
+            np.asarray(target_locations, dtype=np.float64).reshape(-1, 2)))
+
+        positive = acceleration >= 0.0
+        throttle = np.where(positive, np.minimum(acceleration, self.max_throt[rows]), 0.0)
+        brake = np.where(positive, 0.0, np.minimum(np.abs(acceleration), self.max_brake[rows]))
+
+        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        past_steering = self.past_steering[rows]
+        current_steering = np.where(current_steering > past_steering + 0.1, past_steering + 0.1,
+                                    np.where(current_steering < past_steering - 0.1, past_steering - 0.1,
+                                             current_steering))
+        max_steer = self.max_steer[rows]
+        steering = np.where(current_steering >= 0, np.minimum(max_steer, current_steering),
+                            np.maximum(-max_steer, current_steering))
+        self.past_steering[rows] = steering
+
+        return throttle, brake, steering
+
+    def run_step_vehicles(self, vehicles, target_speeds, waypoints, indices=None):
+        """
+        Version of run_step reading the state of the vehicles and waypoints from the simulator.
+        Returns the (M,) arrays of throttle, brake and steer.
+
+            :param vehicles: list of M carla.Vehicle
+            :param target_speeds: (M,) desired vehicle speeds in Km/h
+            :param waypoints: list of M target carla.Waypoint
+            :param indices: (M,) indices of the vehicles in the bank, range(M) if None
+        """
+        rows = np.arange(len(vehicles)) if indices is None else np.asarray(indices, dtype=np.int64)
+        current_speeds, locations, forward_vectors, target_locations = [], [], [], []
+        for vehicle, waypoint, offset in zip(vehicles, waypoints, self.offset[rows].tolist()):
+            transform = vehicle.get_transform()
+            forward_vector = transform.get_forward_vector()
+            target_location = _target_location(waypoint, offset)
+            current_speeds.append(get_speed(vehicle))
+            locations.append((transform.location.x, transform.location.y))
+            forward_vectors.append((forward_vector.x, forward_vector.y))
+            target_locations.append((target_location.x, target_location.y))
+
+        return self.run_step(target_speeds, current_speeds, locations, forward_vectors, target_locations, rows)
+
+    def run_step_controls(self, vehicles, target_speeds, waypoints, indices=None):
+        """
+        Version of run_step_vehicles returning a carla.VehicleControl per vehicle
+        """
+        throttle, brake, steering = self.run_step_vehicles(vehicles, target_speeds, waypoints, indices)
+        controls = []
+        for vehicle_throttle, vehicle_brake, vehicle_steering in zip(
+                throttle.tolist(), brake.tolist(), steering.tolist()):
+            control = carla.VehicleControl()
+            control.throttle = vehicle_throttle
+            control.brake = vehicle_brake
+            control.steer = vehicle_steering
+            control.hand_brake = False
+            control.manual_gear_shift = False
+            controls.append(control)
+        return controls
+
+
+class _PIDBankState():
+    """
+    Parameters and ring buffers of the errors of one of the PID controllers of a PIDControllerBank
+    """
+
+    def __init__(self, size, buffer_size):
+        self.k_p = np.ones(size)
+        self.k_i = np.zeros(size)
+        self.k_d = np.zeros(size)
+        self.dt = np.full(size, 0.03)
+        self.errors = np.zeros((size, buffer_size))
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.heads = np.zeros(size, dtype=np.int64)
+
+    def change_parameters(self, indices, K_P=1.0, K_I=0.0, K_D=0.0, dt=0.03):
+        """Changes the PID parameters"""
+        rows = slice(None) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.k_p[rows] = K_P
+        self.k_i[rows] = K_I
+        self.k_d[rows] = K_D
+        self.dt[rows] = dt
+
+    def reset(self, rows):
+        """Clears the error history"""
+        self.counts[rows] = 0
+        self.heads[rows] = 0
+
+    def resize(self, size):
+        """Keeps the first rows, the new ones with the default parameters and without error history"""
+        resized = _PIDBankState(size, self.errors.shape[1])
+        kept = min(size, len(self.counts))
+        for name in ('k_p', 'k_i', 'k_d', 'dt', 'errors', 'counts', 'heads'):
+            getattr(resized, name)[:kept] = getattr(self, name)[:kept]
+            setattr(self, name, getattr(resized, name))
+
+    def load(self, index, controller, error_buffer):
+        """Copies the parameters and errors of a PID controller"""
+        self.change_parameters([index], controller._k_p, controller._k_i, controller._k_d, controller._dt)
+        errors = list(error_buffer)[-self.errors.shape[1]:]
+        self.errors[index, :len(errors)] = errors
+        self.counts[index] = len(errors)
+        self.heads[index] = len(errors) % self.errors.shape[1]
+
+    def store(self, index, error_buffer):
+        """Replaces the errors of a PID controller with those of a row"""
+        buffer_size = self.errors.shape[1]
+        count, head = int(self.counts[index]), int(self.heads[index])
+        error_buffer.clear()
+        error_buffer.extend(self.errors[index, (head - count + age) % buffer_size] for age in range(count))
+
+    def pid_control(self, rows, errors):
+        """
+        Appends the errors of the rows to their buffers and returns the output of the PID equations
+        """
+        buffer_size = self.errors.shape[1]
+        heads = self.heads[rows]
+        self.errors[rows, heads] = errors
+        heads = (heads + 1) % buffer_size
+        counts = np.minimum(self.counts[rows] + 1, buffer_size)
+        self.heads[rows] = heads
+        self.counts[rows] = counts
+
+        # Sum the buffer from the oldest error to the newest, in the same order as sum() of a deque
+        buffers = self.errors[rows]
+        starts = heads - counts
+        error_sum = np.zeros(len(rows))
+        for age in range(buffer_size):
+            column = buffers[np.arange(len(rows)), (starts + age) % buffer_size]
+            error_sum += np.where(age < counts, column, 0.0)
+
+        dt = self.dt[rows]
+        previous = buffers[np.arange(len(rows)), (heads - 2) % buffer_size]
+        with np.errstate(invalid='ignore'):
+            _de = np.where(counts >= 2, (errors - previous) / dt, 0.0)
+        _ie = np.where(counts >= 2, error_sum * dt, 0.0)
+
+        return np.clip((self.k_p[rows] * errors) + (self.k_d[rows] * _de) + (self.k_i[rows] * _ie), -1.0, 1.0)
+
+
+def _target_location(waypoint, offset):
+    """
+    Location of a waypoint, displaced to its right by offset meters, as in PIDLateralController
+    """
+    if offset != 0:
+        # Displace the wp to the side
+        w_tran = waypoint.transform
+        r_vec = w_tran.get_right_vector()
+        return w_tran.location + carla.Location(x=offset*r_vec.x, y=offset*r_vec.y)
+    return waypoint.transform.location
+
+
+def _heading_errors(locations, forward_vectors, target_locations):
+    """
+    Signed angles, in radians, between the (N, 2) forward vectors of the vehicles and the vectors from
+    their (N, 2) locations to the (N, 2) target locations, positive when the target is to the right.
+    PIDLateralController calls it with a single vehicle, and each angle only depends on its own row,
+    so that the bank and the controllers of the vehicles give the same steering.
+    """
+    w_vec = target_locations - locations
+    wv_linalg = np.hypot(w_vec[:, 0], w_vec[:, 1]) * np.hypot(forward_vectors[:, 0], forward_vectors[:, 1])
+    dots = w_vec[:, 0] * forward_vectors[:, 0] + w_vec[:, 1] * forward_vectors[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angles = np.where(wv_linalg == 0, 1.0, np.arccos(np.clip(dots / wv_linalg, -1.0, 1.0)))
+
+    # z of the cross product of the forward vector and the vector vehicle-target_wp
+    cross = forward_vectors[:, 0] * w_vec[:, 1] - forward_vectors[:, 1] * w_vec[:, 0]
+    return np.where(cross < 0, -angles, angles)
@@ -0,0 +1,250 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module implements a controller that steps a fleet of agents together, instead of
+calling run_step and apply_control for each agent. The agents plan as usual, while the PID
+controls of all their vehicles are computed in a single PIDControllerBank step:
+
+    fleet = FleetController(client, [BehaviorAgent(vehicle) for vehicle in vehicles])
+    while True:
+        world.tick()
+        fleet.step()
+"""
+
+import time
+
+import carla
+from agents.navigation.controller import PIDControllerBank, VehiclePIDController
+
+# Phases of FleetController.step, each with its own timing
+STEP_PHASES = ('world_state', 'run_step', 'control', 'apply')
+
+# Fields of the controls computed by the PIDControllerBank
+_CONTROLLED_FIELDS = ('throttle', 'brake', 'steer')
+
+
+class _PendingVehicleControl(carla.VehicleControl):
+    """
+    carla.VehicleControl returned to an agent before the PIDControllerBank computes it. It starts as
+    a default control (no throttle, brake nor steer) and records the fields assigned by the agent,
+    e.g. by an emergency stop, which are kept when the control is completed.
+    """
+
+    def __init__(self):
+        self.__dict__['assigned'] = set()
+        super(_PendingVehicleControl, self).__init__()
+        self.assigned.clear()
+
+    def __setattr__(self, name, value):
+        self.assigned.add(name)
+        super(_PendingVehicleControl, self).__setattr__(name, value)
+
+    def complete(self, throttle, brake, steer):
+        """Sets the fields computed by the bank that the agent didn't assign"""
+        for name, value in zip(_CONTROLLED_FIELDS, (throttle, brake, steer)):
+            if name not in self.assigned:
+                super(_PendingVehicleControl, self).__setattr__(name, value)
+
+
+class _DeferredVehicleController(object):
+    """
+    Stands in for the VehiclePIDController of the local planner of an agent of the fleet.
+    Instead of computing the control, it records the target and returns a pending
+    carla.VehicleControl, completed by the PIDControllerBank of the fleet at the end of the step.
+    """
+
+    def __init__(self, controller):
+        """
+        :param controller (VehiclePIDController): controller replaced, restored when the agent leaves the fleet
+        """
+        self.controller = controller
+        self.requests = []
+
+    def run_step(self, target_speed, waypoint):
+        """Records the target of the controller and returns the pending control"""
+        control = _PendingVehicleControl()
+        self.requests.append((target_speed, waypoint, control))
+        return control
+
+
+class FleetController(object):
+    """
+    FleetController steps a list of agents (BasicAgent or BehaviorAgent) on every tick:
+    it refreshes the world state cache shared by the agents once, runs the step of each agent
+    on top of it, computes the PID controls of all the vehicles with one PIDControllerBank step
+    and submits them in a single client.apply_batch call. The controls are the same as those of
+    the agents stepped on their own. While in the fleet, the agents must only be stepped through it:
+    the controls returned by their run_step are only complete at the end of the fleet step.
+    The time spent in each phase is measured and reported by get_timing_stats.
+    """
+
+    def __init__(self, client, agents=None):
+        """
+        Constructor method.
+
+            :param client (carla.Client): client used to apply the controls
+            :param agents (list of BasicAgent): initial agents of the fleet
+        """
+        self._client = client
+        self._agents = []
+        self._bank = PIDControllerBank(0, {}, {})
+        self._rows = {}
+        self._free_rows = []
+        self._last_timing = dict.fromkeys(STEP_PHASES, 0.0)
+        self._timing_stats = None
+        self.reset_timing_stats()
+
+        for agent in agents or []:
+            self.add_agent(agent)
+
+    def add_agent(self, agent):
+        """
+        Adds an agent to the fleet. The PID controller of its local planner is moved to the
+        bank of the fleet, keeping its parameters and error history.
+
+            :param agent (BasicAgent): agent controlling its own vehicle
+        """
+        self._agents.append(agent)
+        local_planner = agent.get_local_planner()
+        controller = local_planner.get_vehicle_controller()
+        if not isinstance(controller, VehiclePIDController):
+            # Custom controllers run on their own
+            return
+
+        if not self._free_rows:
+            # Grow the bank geometrically, the new rows are free until used
+            size = self._bank.size
+            self._bank.resize(max(2 * size, 1))
+            self._free_rows = list(range(self._bank.size - 1, size - 1, -1))
+        row = self._free_rows.pop()
+        self._bank.load_controller(row, controller)
+        self._rows[id(agent)] = row
+        local_planner.set_vehicle_controller(_DeferredVehicleController(controller))
+
+    def remove_agent(self, agent):
+        """
+        Removes an agent from the fleet, giving back its PID controller
+
+            :param agent (BasicAgent): agent of the fleet
+        """
+        self._agents.remove(agent)
+        row = self._rows.pop(id(agent), None)
+        if row is None:
+            return
+
+        local_planner = agent.get_local_planner()
+        controller = local_planner.get_vehicle_controller().controller
+        self._bank.store_controller(row, controller)
+        local_planner.set_vehicle_controller(controller)
+        self._free_rows.append(row)
+
+    def get_agents(self):
+        """Returns the agents of the fleet"""
+        return list(self._agents)
+
+    def done(self):
+        """Returns whether all the agents have reached their destination"""
+        return all(agent.done() for agent in self._agents)
+
+    def step(self, apply=True):
+        """
+        Executes one step of all the agents and returns their controls, in the order of the agents.
+
+            :param apply (bool): whether to submit the controls to the simulator
+        """
+        start_time = time.time()
+
+        # Refresh the world state caches once, all the agents then read the same frame
+        world_states = []
+        for agent in self._agents:
+            world_state = agent.get_world_state()
+            if all(world_state is not other for other in world_states):
+                world_states.append(world_state)
+        for world_state in world_states:
+            world_state.vehicles()
+        world_state_time = time.time()
+
+        controls = [agent.run_step() for agent in self._agents]
+        run_step_time = time.time()
+
+        self._compute_controls()
+        control_time = time.time()
+
+        if apply and controls:
+            self._client.apply_batch([
+                carla.command.ApplyVehicleControl(agent.get_vehicle().id, control)
+                for agent, control in zip(self._agents, controls)])
+        apply_time = time.time()
+
+        self._add_timing({'world_state': world_state_time - start_time,
+                          'run_step': run_step_time - world_state_time,
+                          'control': control_time - run_step_time,
+                          'apply': apply_time - control_time})
+        return controls
+
+    def _compute_controls(self):
+        """
+        Completes the pending controls of the agents with the PIDControllerBank. An agent can
+        request several controls in a step, each round computes the next request of every agent.
+        """
+        pending = []
+        for agent in self._agents:
+            row = self._rows.get(id(agent))
+            if row is not None:
+                deferred = agent.get_local_planner().get_vehicle_controller()
+                if deferred.requests:
+                    pending.append((row, agent.get_vehicle(), deferred.requests))
+
+        while pending:
+            requests = [requests.pop(0) for _, _, requests in pending]
+            throttle, brake, steering = self._bank.run_step_vehicles(
+                [vehicle for _, vehicle, _ in pending],
+                [target_speed for target_speed, _, _ in requests],
+                [waypoint for _, waypoint, _ in requests],
+                [row for row, _, _ in pending])
+
+            for (_, _, control), vehicle_throttle, vehicle_brake, vehicle_steering in zip(
+                    requests, throttle.tolist(), brake.tolist(), steering.tolist()):
+                control.complete(vehicle_throttle, vehicle_brake, vehicle_steering)
+            pending = [entry for entry in pending if entry[2]]
+
+    def get_last_timing(self):
+        """
+        Returns the time, in seconds, spent in each phase of the last step
+        """
+        return dict(self._last_timing)
+
+    def get_timing_stats(self):
+        """
+        Returns the timing statistics of the fleet: amount of steps and agent steps, total and
+        maximum time of each phase and of the whole step, and the average time per step and per agent
+        """
+        stats = dict(self._timing_stats)
+        steps, agent_steps = stats['steps'], stats['agent_steps']
+        stats['step_time_mean'] = stats['step_time'] / steps if steps else 0.0
+        stats['run_step_time_per_agent'] = stats['run_step_time'] / agent_steps if agent_steps else 0.0
+        return stats
+
+    def reset_timing_stats(self):
+        """
+        Resets the timing statistics
+        """
+        self._timing_stats = {'steps': 0, 'agent_steps': 0, 'step_time': 0.0, 'step_time_max': 0.0}
+        for phase in STEP_PHASES:
+            self._timing_stats[phase + '_time'] = 0.0
+            self._timing_stats[phase + '_time_max'] = 0.0
+
+    def _add_timing(self, timing):
+        self._last_timing = timing
+        step_time = sum(timing.values())
+        stats = self._timing_stats
+        stats['steps'] += 1
+        stats['agent_steps'] += len(self._agents)
+        stats['step_time'] += step_time
+        stats['step_time_max'] = max(stats['step_time_max'], step_time)
+        for phase, elapsed in timing.items():
+            stats[phase + '_time'] += elapsed
+            stats[phase + '_time_max'] = max(stats[phase + '_time_max'], elapsed)
@@ -8,48 +8,356 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+import os
 import math
+import time
+import pickle
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
 import numpy as np
 import networkx as nx
 
 import carla
 from agents.navigation.local_planner import RoadOption
 from agents.tools.misc import vector
+from agents.tools.waypoint_index import WaypointIndex
+
+# Bump whenever the structure of the cached graph changes, so that old cache files are ignored
+GRAPH_CACHE_VERSION = 2
+
+# Default amount of (start edge, end edge) routes kept by each planner
+DEFAULT_ROUTE_CACHE_SIZE = 1024
+
+# Path search heuristics:
+# - euclidean: distance between the node positions
+# - landmarks: ALT lower bounds from the shortest path lengths to and from a set of landmark nodes
+# - all_pairs: exact shortest path lengths between all the nodes, only advisable for small towns
+HEURISTICS = ('euclidean', 'landmarks', 'all_pairs')
+DEFAULT_NUM_LANDMARKS = 8
+
+# Serializable reference to a waypoint, rehydrated through carla.Map.get_waypoint_xodr
+WaypointRef = namedtuple('WaypointRef', ['road_id', 'section_id', 'lane_id', 's'])
+
+# Distances, in increasing order, moved along the lane to rehydrate a waypoint at the boundary
+# of two lane sections or at the end of the road, where get_waypoint_xodr misses it
+SECTION_BOUNDARY_NUDGES = (1e-5, 1e-4, 1e-3)
+
+
+def _waypoint_to_ref(waypoint):
+    return WaypointRef(waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s)
+
+
+def _ref_to_waypoint(wmap, ref):
+    """
+    Returns the carla.Waypoint of a WaypointRef, or None if the map has no such waypoint.
+    At the s of the boundary of two lane sections get_waypoint_xodr can return the waypoint
+    of the other section, or none at the end of the road. The waypoint is then taken just inside
+    the section of the reference, at most SECTION_BOUNDARY_NUDGES[-1] meters away from it.
+    """
+    waypoint = wmap.get_waypoint_xodr(ref.road_id, ref.lane_id, ref.s)
+    if waypoint is not None and waypoint.section_id == ref.section_id:
+        return waypoint
+    for nudge in SECTION_BOUNDARY_NUDGES:
+        for s in (ref.s - nudge, ref.s + nudge):
+            waypoint = wmap.get_waypoint_xodr(ref.road_id, ref.lane_id, s)
+            if waypoint is not None and waypoint.section_id == ref.section_id:
+                return waypoint
+    return None
+
+
+def graph_cache_key(wmap, sampling_resolution):
+    """
+    Returns the name of the cache file of the graph of a map, built from the map name,
+    a hash of its OpenDRIVE description and the sampling resolution.
+
+        :param wmap (carla.Map): map of the graph
+        :param sampling_resolution (float): sampling resolution of the graph
+    """
+    map_name = os.path.basename(wmap.name)
+    xodr_hash = hashlib.sha1(wmap.to_opendrive().encode('utf-8')).hexdigest()[:16]
+    return 'route_graph_v{}_{}_{}_{:.3f}.pkl'.format(GRAPH_CACHE_VERSION, map_name, xodr_hash, sampling_resolution)
+
+
+# Planners shared by all the agents, see get_global_route_planner, and the locks serializing their construction
+_shared_planners = dict()
+_shared_planner_build_locks = dict()
+_shared_planners_lock = threading.Lock()
+
+
+def get_global_route_planner(wmap, sampling_resolution, cache_dir=None, heuristic='euclidean',
+                             use_waypoint_index=False):
+    """
+    Returns the GlobalRoutePlanner shared by all the callers using the same map, sampling
+    resolution and heuristic, building it on the first call. The planner keeps no state between
+    trace_route calls, so it can be used by many agents and threads at the same time.
+    The planners are looked up by map name, call clear_global_route_planners after loading a
+    different OpenDRIVE under the same name.
+
+        :param wmap (carla.Map): map of the world
+        :param sampling_resolution (float): distance between the waypoints of the graph edges
+        :param cache_dir (str): optional directory of the on-disk graph cache
+        :param heuristic (str): path search heuristic, one of HEURISTICS
+        :param use_waypoint_index (bool): localize the routes with a client-side WaypointIndex
+    """
+    key = (wmap.name, sampling_resolution, heuristic, use_waypoint_index)
+    with _shared_planners_lock:
+        planner = _shared_planners.get(key)
+        if planner is not None:
+            return planner
+        build_lock = _shared_planner_build_locks.setdefault(key, threading.Lock())
+
+    # The graph is built without holding the registry lock, the callers of other maps don't wait for it
+    with build_lock:
+        with _shared_planners_lock:
+            planner = _shared_planners.get(key)
+        if planner is None:
+            planner = GlobalRoutePlanner(wmap, sampling_resolution, cache_dir, heuristic=heuristic,
+                                         use_waypoint_index=use_waypoint_index)
+            with _shared_planners_lock:
+                _shared_planners[key] = planner
+    return planner
+
+
+def clear_global_route_planners():
+    """
+    Releases the shared planners, e.g. after loading a different map
+    """
+    with _shared_planners_lock:
+        _shared_planners.clear()
+        _shared_planner_build_locks.clear()
+
+
+class _RouteState(object):
+    """
+    Turn decision state of a single trace_route call
+    """
+    __slots__ = ('intersection_end_node', 'previous_decision')
+
+    def __init__(self):
+        self.intersection_end_node = -1
+        self.previous_decision = RoadOption.VOID
+
 
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
+    The graph isn't modified after the construction and the route state is kept
+    per trace_route call, so an instance can be shared between threads.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, cache_dir=None, route_cache_size=DEFAULT_ROUTE_CACHE_SIZE,
+                 heuristic='euclidean', num_landmarks=DEFAULT_NUM_LANDMARKS, use_waypoint_index=False):
+        """
+        :param wmap: carla.Map of the world
+        :param sampling_resolution: distance between the waypoints of the graph edges
+        :param cache_dir: if given, the graph is loaded from (or saved to) a cache file in this
+            directory instead of being rebuilt from the map topology on every instantiation.
+            The heuristic tables are cached in the same directory
+        :param route_cache_size: amount of routes, keyed by their (start edge, end edge),
+            kept in memory to skip the path search. Use 0 to disable the route cache
+        :param heuristic: path search heuristic, one of HEURISTICS. 'landmarks' and 'all_pairs'
+            are exact lower bounds of the edge lengths, so A* returns the shortest routes
+        :param num_landmarks: amount of landmarks of the 'landmarks' heuristic
+        :param use_waypoint_index: if True, the route origin and destination are localized with
+            a WaypointIndex built from the graph edges instead of carla.Map.get_waypoint
+        """
+        if heuristic not in HEURISTICS:
+            raise ValueError("Unknown heuristic '{}', expected one of {}".format(heuristic, HEURISTICS))
+
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
         self._topology = None
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
-
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
-
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        self._use_waypoint_index = use_waypoint_index
+        self._waypoint_index = None
+
+        # Node positions as a contiguous (N, 3) array, with the row of each node id
+        self._node_index = None
+        self._node_xyz = None
+
+        # Heuristic tables, rows indexed as self._node_xyz
+        self._heuristic = heuristic
+        self._num_landmarks = num_landmarks
+        self._landmarks = None
+        self._from_landmarks = None  # (L, N) lengths from each landmark to each node
+        self._to_landmarks = None  # (L, N) lengths from each node to each landmark
+        self._all_pairs = None  # (N, N) lengths from each node to each node
+
+        # LRU cache of {(search, start edge, end edge): (route, road options)}
+        self._route_cache = OrderedDict()
+        self._route_cache_size = route_cache_size
+        self._route_lock = threading.Lock()
+        self._route_stats = {'routes': 0, 'hits': 0, 'misses': 0, 'evictions': 0,
+                             'search_time': 0.0, 'trace_time': 0.0}
+
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, graph_cache_key(wmap, sampling_resolution))
+
+        if cache_path is None or not self._load_graph(cache_path):
+            # Build the graph
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+
+            if use_waypoint_index:
+                self._build_waypoint_index()
+            if cache_path is not None:
+                self._save_graph(cache_path)
+        elif use_waypoint_index and self._waypoint_index is None:
+            self._build_waypoint_index()
+
+        self._build_node_arrays()
+        if heuristic != 'euclidean':
+            tables_path = None
+            if cache_path is not None:
+                tables_path = '{}.{}{}.npz'.format(
+                    os.path.splitext(cache_path)[0], heuristic, num_landmarks if heuristic == 'landmarks' else '')
+            if tables_path is None or not self._load_heuristic_tables(tables_path):
+                self._build_heuristic_tables()
+                if tables_path is not None:
+                    self._save_heuristic_tables(tables_path)
 
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
         from origin to destination
         """
+        start_time = time.time()
+        start, end = self._localize(origin), self._localize(destination)
+        route, road_options = self._route_plan(start, end)
+        route_trace = self._expand_route(origin, destination, route, road_options)
+        self._add_trace_stats(1, time.time() - start_time)
+        return route_trace
+
+    def trace_routes(self, pairs):
+        """
+        This method returns, for each (origin, destination) pair of carla.Location,
+        the list of (carla.Waypoint, RoadOption) from origin to destination.
+        The routes not found in the route cache are searched with a single Dijkstra
+        search per start node, shared by all the destinations with the same origin.
+        These are the shortest routes by edge length, and are cached apart from the
+        A* routes of trace_route, which use a distance heuristic and may differ.
+        """
+        start_time = time.time()
+        localized = [(self._localize(origin), self._localize(destination)) for origin, destination in pairs]
+
+        # Group the routes missing from the cache by start node
+        plans = [self._cached_plan(('dijkstra', start, end)) for start, end in localized]
+        pending = dict()
+        for index, (start, end) in enumerate(localized):
+            if plans[index] is None:
+                pending.setdefault(start[0], []).append(index)
+
+        for source, indices in pending.items():
+            search_time = time.time()
+            _, paths = nx.single_source_dijkstra(self._graph, source, weight='length')
+            self._add_search_time(time.time() - search_time)
+            for index in indices:
+                start, end = localized[index]
+                if end[0] not in paths:
+                    raise nx.NetworkXNoPath("Node {} not reachable from {}".format(end[0], source))
+                plans[index] = self._make_plan(paths[end[0]] + [end[1]])
+                self._store_plan(('dijkstra', start, end), plans[index])
+
+        route_traces = []
+        for (origin, destination), (route, road_options) in zip(pairs, plans):
+            route_traces.append(self._expand_route(origin, destination, route, road_options))
+
+        self._add_trace_stats(len(pairs), time.time() - start_time)
+        return route_traces
+
+    def get_route_stats(self):
+        """
+        Returns the route statistics of the planner: amount of traced routes, route cache hits,
+        misses and evictions, time spent in the path search and in total, and the throughput
+        """
+        with self._route_lock:
+            stats = dict(self._route_stats)
+            stats['cached_routes'] = len(self._route_cache)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / float(lookups) if lookups else 0.0
+        stats['routes_per_second'] = stats['routes'] / stats['trace_time'] if stats['trace_time'] > 0 else 0.0
+        return stats
+
+    def clear_route_cache(self):
+        """
+        Empties the route cache and resets the route statistics
+        """
+        with self._route_lock:
+            self._route_cache.clear()
+            for key in self._route_stats:
+                self._route_stats[key] = type(self._route_stats[key])()
+
+    def _route_plan(self, start, end):
+        """
+        Returns the (route, road options) between two localized edges,
+        from the route cache or with an A* search
+        """
+        key = ('astar', start, end)
+        plan = self._cached_plan(key)
+        if plan is None:
+            search_time = time.time()
+            route = nx.astar_path(
+                self._graph, source=start[0], target=end[0],
+                heuristic=self._heuristic_to(end[0]), weight='length')
+            self._add_search_time(time.time() - search_time)
+            route.append(end[1])
+            plan = self._make_plan(route)
+            self._store_plan(key, plan)
+        return plan
+
+    def _make_plan(self, route):
+        """
+        Computes the road option of every edge of the route. These only depend
+        on the route nodes, so they are cached along with it
+        """
+        route_state = _RouteState()
+        road_options = tuple(self._turn_decision(i, route, route_state) for i in range(len(route) - 1))
+        return tuple(route), road_options
+
+    def _cached_plan(self, key):
+        with self._route_lock:
+            plan = self._route_cache.get(key)
+            if plan is not None:
+                self._route_cache.move_to_end(key)
+            self._route_stats['hits' if plan is not None else 'misses'] += 1
+        return plan
+
+    def _store_plan(self, key, plan):
+        if self._route_cache_size <= 0:
+            return
+        with self._route_lock:
+            self._route_cache[key] = plan
+            self._route_cache.move_to_end(key)
+            while len(self._route_cache) > self._route_cache_size:
+                self._route_cache.popitem(last=False)
+                self._route_stats['evictions'] += 1
+
+    def _add_search_time(self, elapsed):
+        with self._route_lock:
+            self._route_stats['search_time'] += elapsed
+
+    def _add_trace_stats(self, routes, elapsed):
+        with self._route_lock:
+            self._route_stats['routes'] += routes
+            self._route_stats['trace_time'] += elapsed
+
+    def _expand_route(self, origin, destination, route, road_options):
+        """
+        Turns a route of graph nodes into the list of (carla.Waypoint, RoadOption)
+        from origin to destination
+        """
         route_trace = []
-        route = self._path_search(origin, destination)
         current_waypoint = self._wmap.get_waypoint(origin)
         destination_waypoint = self._wmap.get_waypoint(destination)
 
         for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
+            road_option = road_options[i]
             edge = self._graph.edges[route[i], route[i+1]]
             path = []
 
@@ -256,12 +564,104 @@ class GlobalRoutePlanner(object):
                 if left_found and right_found:
                     break
 
+    def _save_graph(self, cache_path):
+        """
+        Serializes the graph, id_map and road_id_to_edge to the cache file. Waypoints
+        are stored as (road_id, section_id, lane_id, s) references, as carla.Waypoint can't be pickled.
+        """
+        edges = []
+        for n1, n2, data in self._graph.edges(data=True):
+            attributes = dict()
+            for key, value in data.items():
+                if key == 'path':
+                    value = [_waypoint_to_ref(waypoint) for waypoint in value]
+                elif key.endswith('waypoint'):
+                    value = _waypoint_to_ref(value)
+                attributes[key] = value
+            edges.append((n1, n2, attributes))
+
+        cache = {
+            'version': GRAPH_CACHE_VERSION,
+            'nodes': list(self._graph.nodes(data='vertex')),
+            'edges': edges,
+            'id_map': self._id_map,
+            'road_id_to_edge': self._road_id_to_edge,
+            'waypoint_index': self._waypoint_index.to_arrays() if self._waypoint_index is not None else None
+        }
+
+        # Write to a temporary file first, so that other processes never read a partial cache
+        if not os.path.isdir(os.path.dirname(cache_path) or '.'):
+            os.makedirs(os.path.dirname(cache_path))
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+    def _load_graph(self, cache_path):
+        """
+        Loads the graph from the cache file, rehydrating the edge waypoints through the map, so that
+        the graph isn't modified afterwards. Returns False if there is no valid cache for the map.
+        """
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                cache = pickle.load(cache_file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if cache.get('version') != GRAPH_CACHE_VERSION:
+            return False
+
+        graph = nx.DiGraph()
+        for node, vertex in cache['nodes']:
+            graph.add_node(node, vertex=vertex)
+        for n1, n2, cached_attributes in cache['edges']:
+            attributes = dict()
+            for key, value in cached_attributes.items():
+                if key == 'path':
+                    value = [_ref_to_waypoint(self._wmap, ref) for ref in value]
+                    if any(waypoint is None for waypoint in value):
+                        return False
+                elif key.endswith('waypoint'):
+                    value = _ref_to_waypoint(self._wmap, value)
+                    if value is None:
+                        return False
+                attributes[key] = value
+            graph.add_edge(n1, n2, **attributes)
+
+        self._graph = graph
+        self._id_map = cache['id_map']
+        self._road_id_to_edge = cache['road_id_to_edge']
+        if cache.get('waypoint_index') is not None:
+            self._waypoint_index = WaypointIndex(cache['waypoint_index'])
+        return True
+
+    def _build_waypoint_index(self):
+        """
+        Builds the WaypointIndex from the waypoints of the lane following edges
+        """
+        waypoint_lists = []
+        for _, _, edge in self._graph.edges(data=True):
+            if edge['type'] == RoadOption.LANEFOLLOW:
+                waypoint_lists.append([edge['entry_waypoint']] + list(edge['path']) + [edge['exit_waypoint']])
+        self._waypoint_index = WaypointIndex.from_waypoint_lists(waypoint_lists)
+
+    def get_waypoint_index(self):
+        """
+        Returns the WaypointIndex of the map lanes, building it the first time
+        """
+        if self._waypoint_index is None:
+            self._build_waypoint_index()
+        return self._waypoint_index
+
     def _localize(self, location):
         """
         This function finds the road segment that a given location
         is part of, returning the edge it belongs to
         """
-        waypoint = self._wmap.get_waypoint(location)
+        # The index is built after the graph, the lane change links are localized through the map
+        if self._use_waypoint_index and self._waypoint_index is not None:
+            waypoint = self._waypoint_index.get_waypoint(location)
+        else:
+            waypoint = self._wmap.get_waypoint(location)
         edge = None
         try:
             edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
@@ -274,9 +674,118 @@ class GlobalRoutePlanner(object):
         Distance heuristic calculator for path searching
         in self._graph
         """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1-l2)
+        xyz = self._node_xyz
+        return np.linalg.norm(xyz[self._node_index[n1]] - xyz[self._node_index[n2]])
+
+    def _heuristic_to(self, target):
+        """
+        Returns the A* heuristic function towards the target node. The heuristic
+        of every node is computed at once with NumPy, so each A* expansion is a lookup.
+        """
+        t = self._node_index[target]
+        if self._heuristic == 'all_pairs':
+            estimate = self._all_pairs[:, t]
+        elif self._heuristic == 'landmarks':
+            # Triangle inequality: d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+            with np.errstate(invalid='ignore'):
+                forward = self._from_landmarks[:, t, np.newaxis] - self._from_landmarks
+                backward = self._to_landmarks - self._to_landmarks[:, t, np.newaxis]
+            # Unreachable pairs (inf - inf) give no bound
+            estimate = np.fmax(np.fmax.reduce(forward, axis=0), np.fmax.reduce(backward, axis=0))
+            estimate = np.clip(np.nan_to_num(estimate, nan=0.0, posinf=0.0, neginf=0.0), 0.0, None)
+        else:
+            difference = self._node_xyz - self._node_xyz[t]
+            estimate = np.sqrt(np.sum(difference * difference, axis=1))
+
+        estimate = estimate.tolist()
+        node_index = self._node_index
+        return lambda node, _: estimate[node_index[node]]
+
+    def _build_node_arrays(self):
+        """
+        Stores the node positions in a contiguous array instead of the node attribute dicts
+        """
+        nodes = list(self._graph.nodes(data='vertex'))
+        self._node_index = {node: i for i, (node, _) in enumerate(nodes)}
+        self._node_xyz = np.ascontiguousarray([vertex for _, vertex in nodes], dtype=np.float64).reshape(-1, 3)
+
+    def _shortest_lengths(self, source, reverse=False):
+        """
+        Returns the shortest path lengths from the source node to every node
+        (to the source node, if reverse) as an array indexed as self._node_xyz
+        """
+        graph = self._graph.reverse(copy=False) if reverse else self._graph
+        lengths = np.full(len(self._node_index), np.inf)
+        for node, length in nx.single_source_dijkstra_path_length(graph, source, weight='length').items():
+            lengths[self._node_index[node]] = length
+        return lengths
+
+    def _build_heuristic_tables(self):
+        """
+        Computes the heuristic tables, once per map
+        """
+        nodes = list(self._node_index)
+        if self._heuristic == 'all_pairs':
+            self._all_pairs = np.stack([self._shortest_lengths(node) for node in nodes])
+            return
+
+        # Landmarks chosen by farthest point selection, starting from the node at a corner of the map
+        first = int(np.argmin(self._node_xyz[:, 0] + self._node_xyz[:, 1]))
+        landmarks = [first]
+        from_landmarks = [self._shortest_lengths(nodes[first])]
+        to_landmarks = [self._shortest_lengths(nodes[first], reverse=True)]
+        while len(landmarks) < min(self._num_landmarks, len(nodes)):
+            lengths = np.where(np.isfinite(from_landmarks), from_landmarks, np.nan)
+            with np.errstate(invalid='ignore'):
+                closest = np.nanmin(lengths, axis=0) if not np.all(np.isnan(lengths)) else np.zeros(len(nodes))
+            closest = np.nan_to_num(closest, nan=-1.0)
+            closest[landmarks] = -1.0
+            candidate = int(np.argmax(closest))
+            if closest[candidate] <= 0:
+                break
+            landmarks.append(candidate)
+            from_landmarks.append(self._shortest_lengths(nodes[candidate]))
+            to_landmarks.append(self._shortest_lengths(nodes[candidate], reverse=True))
+
+        self._landmarks = np.array([nodes[i] for i in landmarks], dtype=np.int64)
+        self._from_landmarks = np.stack(from_landmarks)
+        self._to_landmarks = np.stack(to_landmarks)
+
+    def _save_heuristic_tables(self, tables_path):
+        tables = {'nodes': np.array(list(self._node_index), dtype=np.int64)}
+        if self._heuristic == 'all_pairs':
+            tables['all_pairs'] = self._all_pairs
+        else:
+            tables['landmarks'] = self._landmarks
+            tables['from_landmarks'] = self._from_landmarks
+            tables['to_landmarks'] = self._to_landmarks
+
+        tmp_path = '{}.{}.tmp.npz'.format(tables_path, os.getpid())
+        np.savez(tmp_path, **tables)
+        os.replace(tmp_path, tables_path)
+
+    def _load_heuristic_tables(self, tables_path):
+        """
+        Loads the heuristic tables from the cache, returns False if there are no valid tables
+        """
+        try:
+            tables = np.load(tables_path)
+        except (IOError, OSError, ValueError):
+            return False
+        with tables:
+            # The tables are only valid for the same nodes, in the same order
+            if 'nodes' not in tables or not np.array_equal(tables['nodes'], list(self._node_index)):
+                return False
+            try:
+                if self._heuristic == 'all_pairs':
+                    self._all_pairs = tables['all_pairs']
+                else:
+                    self._landmarks = tables['landmarks']
+                    self._from_landmarks = tables['from_landmarks']
+                    self._to_landmarks = tables['to_landmarks']
+            except KeyError:
+                return False
+        return True
 
     def _path_search(self, origin, destination):
         """
@@ -288,12 +797,8 @@ class GlobalRoutePlanner(object):
         connecting origin and destination
         """
         start, end = self._localize(origin), self._localize(destination)
-
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
-        route.append(end[1])
-        return route
+        route, _ = self._route_plan(start, end)
+        return list(route)
 
     def _successive_last_intersection_edge(self, index, route):
         """
@@ -317,10 +822,10 @@ class GlobalRoutePlanner(object):
 
         return last_node, last_intersection_edge
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _turn_decision(self, index, route, route_state, threshold=math.radians(35)):
         """
         This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        around current index of route list, updating the route_state of the trace_route call
         """
 
         decision = None
@@ -329,20 +834,20 @@ class GlobalRoutePlanner(object):
         next_node = route[index+1]
         next_edge = self._graph.edges[current_node, next_node]
         if index > 0:
-            if self._previous_decision != RoadOption.VOID \
-                    and self._intersection_end_node > 0 \
-                    and self._intersection_end_node != previous_node \
+            if route_state.previous_decision != RoadOption.VOID \
+                    and route_state.intersection_end_node > 0 \
+                    and route_state.intersection_end_node != previous_node \
                     and next_edge['type'] == RoadOption.LANEFOLLOW \
                     and next_edge['intersection']:
-                decision = self._previous_decision
+                decision = route_state.previous_decision
             else:
-                self._intersection_end_node = -1
+                route_state.intersection_end_node = -1
                 current_edge = self._graph.edges[previous_node, current_node]
                 calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
                     'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
                 if calculate_turn:
                     last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
+                    route_state.intersection_end_node = last_node
                     if tail_edge is not None:
                         next_edge = tail_edge
                     cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
@@ -376,7 +881,7 @@ class GlobalRoutePlanner(object):
         else:
             decision = next_edge['type']
 
-        self._previous_decision = decision
+        route_state.previous_decision = decision
         return decision
 
     def _find_closest_in_list(self, current_waypoint, waypoint_list):
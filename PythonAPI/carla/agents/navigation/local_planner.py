@@ -6,8 +6,10 @@
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
 from enum import Enum
-from collections import deque
+from itertools import islice
+import math
 import random
+import numpy as np
 
 import carla
 from agents.navigation.controller import VehiclePIDController
@@ -62,7 +64,7 @@ class LocalPlanner(object):
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = _WaypointPlan(maxlen=10000)
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
 
@@ -158,8 +160,23 @@ class LocalPlanner(object):
         available_entries = self._waypoints_queue.maxlen - len(self._waypoints_queue)
         k = min(available_entries, k)
 
-        for _ in range(k):
+        while k > 0:
             last_waypoint = self._waypoints_queue[-1][0]
+
+            # Prefetch the chain of waypoints up to the end of the lane in a single call. All but the last one,
+            # placed at the end of the lane instead of at the sampling radius, are the same as calling next()
+            # one at a time, each of them being the only option of the previous one
+            try:
+                chain = last_waypoint.next_until_lane_end(self._sampling_radius)[:-1][:k]
+            except RuntimeError:
+                # Raised for waypoints right at the end of the lane
+                chain = []
+            if chain:
+                self._waypoints_queue.extend((waypoint, RoadOption.LANEFOLLOW) for waypoint in chain)
+                k -= len(chain)
+                continue
+
+            k -= 1
             next_waypoints = list(last_waypoint.next(self._sampling_radius))
 
             if len(next_waypoints) == 0:
@@ -192,16 +209,12 @@ class LocalPlanner(object):
         if clean_queue:
             self._waypoints_queue.clear()
 
-        # Remake the waypoints queue if the new plan has a higher length than the queue
+        # Enlarge the waypoints queue if the new plan has a higher length than the queue
         new_plan_length = len(current_plan) + len(self._waypoints_queue)
         if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
+            self._waypoints_queue.maxlen = new_plan_length
 
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        self._waypoints_queue.extend(current_plan)
 
         self._stop_waypoint_creation = stop_waypoint_creation
 
@@ -225,22 +238,8 @@ class LocalPlanner(object):
         vehicle_speed = get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + 0.5 *vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Don't remove the last waypoint until very close by
+        self._waypoints_queue.purge_reached(veh_location, self._min_distance, last_min_distance=1)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -279,6 +278,19 @@ class LocalPlanner(object):
         """Returns the current plan of the local planner"""
         return self._waypoints_queue
 
+    def get_vehicle_controller(self):
+        """Returns the controller following the plan, a VehiclePIDController by default"""
+        return self._vehicle_controller
+
+    def set_vehicle_controller(self, controller):
+        """
+        Replaces the controller following the plan, e.g. to compute the controls of many
+        vehicles together. It must have the run_step(target_speed, waypoint) of VehiclePIDController.
+
+        :param controller: new vehicle controller
+        """
+        self._vehicle_controller = controller
+
     def done(self):
         """
         Returns whether or not the planner has finished
@@ -288,6 +300,125 @@ class LocalPlanner(object):
         return len(self._waypoints_queue) == 0
 
 
+class _WaypointPlan(object):
+    """
+    Queue of (carla.Waypoint, RoadOption) followed by the LocalPlanner. It behaves as a bounded deque
+    (len, iteration, indexing, append, extend, popleft and clear), but the reached waypoints are skipped
+    by moving a cursor, and the locations of the waypoints are kept in a contiguous array so that
+    the waypoints reached by the vehicle are found with a vectorized search from the cursor.
+    """
+
+    # Amount of waypoints checked one at a time, and then at once, by purge_reached
+    SCALAR_CHECKS = 4
+    PURGE_WINDOW = 64
+
+    # The skipped waypoints are released once they are more than half of the stored ones
+    COMPACT_THRESHOLD = 1024
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._elements = []
+        self._positions = np.empty((64, 3), dtype=np.float64)
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self._elements) - self._cursor
+
+    def __iter__(self):
+        return islice(self._elements, self._cursor, None)
+
+    def __getitem__(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('plan index out of range')
+        return self._elements[self._cursor + index]
+
+    def append(self, element):
+        """Adds a (carla.Waypoint, RoadOption) at the end of the plan"""
+        self.extend([element])
+
+    def extend(self, elements):
+        """Adds (carla.Waypoint, RoadOption) pairs at the end of the plan, dropping the first ones if full"""
+        elements = list(elements)
+        if len(elements) >= self.maxlen:
+            self.clear()
+            elements = elements[len(elements) - self.maxlen:]
+        overflow = len(self) + len(elements) - self.maxlen
+        if overflow > 0:
+            self._cursor += overflow
+
+        start = len(self._elements)
+        self._elements.extend(elements)
+        if len(self._elements) > len(self._positions):
+            positions = np.empty((max(len(self._elements), 2 * len(self._positions)), 3), dtype=np.float64)
+            positions[:start] = self._positions[:start]
+            self._positions = positions
+        for i, (waypoint, _) in enumerate(elements, start):
+            location = waypoint.transform.location
+            self._positions[i] = (location.x, location.y, location.z)
+        self._compact()
+
+    def popleft(self):
+        """Removes and returns the first (carla.Waypoint, RoadOption) of the plan"""
+        element = self[0]
+        self._cursor += 1
+        self._compact()
+        return element
+
+    def clear(self):
+        """Removes all the waypoints of the plan"""
+        self._elements = []
+        self._cursor = 0
+
+    def purge_reached(self, location, min_distance, last_min_distance):
+        """
+        Removes the waypoints at the front of the plan closer than min_distance to a location,
+        using last_min_distance for the last waypoint of the plan. Returns the amount removed.
+
+        :param location: carla.Location of the vehicle
+        :param min_distance: distance under which a waypoint is considered reached
+        :param last_min_distance: distance under which the last waypoint is considered reached
+        """
+        end = len(self._elements)
+        position = self._cursor
+        x, y, z = location.x, location.y, location.z
+
+        # Only a few waypoints are reached on each step, check the first ones one at a time
+        for wx, wy, wz in self._positions[position:min(position + self.SCALAR_CHECKS, end)].tolist():
+            threshold = last_min_distance if position + 1 == end else min_distance
+            if math.sqrt((wx - x) ** 2 + (wy - y) ** 2 + (wz - z) ** 2) >= threshold:
+                break
+            position += 1
+        else:
+            point = np.array([x, y, z])
+            while position < end:
+                window_end = min(position + self.PURGE_WINDOW, end)
+                difference = self._positions[position:window_end] - point
+                distances = np.sqrt(np.einsum('ij,ij->i', difference, difference))
+                thresholds = np.full(window_end - position, float(min_distance))
+                if window_end == end:
+                    thresholds[-1] = last_min_distance
+                not_reached = np.flatnonzero(distances >= thresholds)
+                if len(not_reached) > 0:
+                    position += int(not_reached[0])
+                    break
+                position = window_end
+
+        removed = position - self._cursor
+        self._cursor = position
+        self._compact()
+        return removed
+
+    def _compact(self):
+        if self._cursor > self.COMPACT_THRESHOLD and 2 * self._cursor > len(self._elements):
+            size = len(self)
+            self._positions[:size] = self._positions[self._cursor:len(self._elements)]
+            self._elements = self._elements[self._cursor:]
+            self._cursor = 0
+
+
 def _retrieve_options(list_waypoints, current_waypoint):
     """
     Compute the type of connection between the current active waypoint and the multiple waypoints present in
@@ -0,0 +1,510 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides an in-process stand-in for the parts of carla.World, carla.Vehicle and
+carla.TrafficLight used by the navigation agents, to run them without a simulator: the vehicles
+follow a kinematic bicycle model, the lanes are those of a carla.Map built on the client from
+an OpenDRIVE file, and the traffic lights cycle on fixed timings.
+
+    world = KinematicWorld(load_opendrive_map('Town01.xodr'))
+    world.add_junction_traffic_lights()
+    vehicle = world.spawn_vehicle(generate_spawn_points(world.get_map())[0])
+    agent = BehaviorAgent(vehicle)
+    while not agent.done():
+        vehicle.apply_control(agent.run_step())
+        world.tick()
+"""
+
+import os
+import math
+import fnmatch
+import itertools
+import numpy as np
+
+import carla
+
+# Vehicle parameters of the kinematic model
+DEFAULT_EXTENT = (2.4, 1.0, 0.8)  # meters
+DEFAULT_WHEELBASE = 2.9  # meters
+DEFAULT_MAX_STEER_ANGLE = 70.0  # degrees, at steer 1
+DEFAULT_MAX_ACCELERATION = 4.0  # m/s2, at throttle 1
+DEFAULT_MAX_DECELERATION = 8.0  # m/s2, at brake 1
+DEFAULT_DRAG = 0.05  # m/s2 per m/s, decelerates the vehicle without throttle
+DEFAULT_SPEED_LIMIT = 30.0  # Km/h
+
+# Rows of the vehicle state arrays allocated at first, doubled when they run out
+INITIAL_VEHICLE_CAPACITY = 16
+
+# Traffic light cycle, in seconds
+DEFAULT_GREEN_TIME = 10.0
+DEFAULT_YELLOW_TIME = 3.0
+
+# Ids of the worlds, the caches shared by the agents are kept by world id
+_episode_ids = itertools.count(1)
+
+
+def load_opendrive_map(path, name=None):
+    """
+    Builds a carla.Map on the client from an OpenDRIVE file, without a simulator.
+    The OpenDRIVE of a running simulator can be saved with carla.Map.to_opendrive().
+
+        :param path (str): path of the .xodr file
+        :param name (str): name of the map, the file name by default
+    """
+    with open(path) as xodr_file:
+        xodr = xodr_file.read()
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    return carla.Map(name, xodr)
+
+
+def generate_spawn_points(wmap, distance=20.0, height=0.5):
+    """
+    Returns spawn transforms on the driving lanes of a map every distance meters, outside the junctions.
+    Maps built on the client have no recommended spawn points.
+
+        :param wmap (carla.Map): map of the spawn points
+        :param distance (float): distance between the spawn points of a lane
+        :param height (float): height of the spawn points over the lane
+    """
+    spawn_points = []
+    for waypoint in wmap.generate_waypoints(distance):
+        if waypoint.is_junction:
+            continue
+        location = waypoint.transform.location
+        spawn_points.append(carla.Transform(carla.Location(location.x, location.y, location.z + height),
+                                            waypoint.transform.rotation))
+    return spawn_points
+
+
+class ActorList(list):
+    """
+    List of actors with the filter and find methods of carla.ActorList
+    """
+
+    def filter(self, wildcard_pattern):
+        """Returns the actors whose type_id matches the pattern"""
+        return ActorList(actor for actor in self if fnmatch.fnmatch(actor.type_id, wildcard_pattern))
+
+    def find(self, actor_id):
+        """Returns the actor with the given id, or None"""
+        for actor in self:
+            if actor.id == actor_id:
+                return actor
+        return None
+
+
+class Timestamp(object):
+    """Time of a frame, as carla.Timestamp"""
+
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+
+
+class WorldSnapshot(object):
+    """
+    Snapshot of a KinematicWorld, as carla.WorldSnapshot. The actor snapshots are the
+    actors themselves, so they are only valid until the next tick.
+    """
+
+    def __init__(self, world, frame, timestamp):
+        self._world = world
+        self.id = world.id
+        self.frame = frame
+        self.timestamp = timestamp
+
+    def find(self, actor_id):
+        """Returns the snapshot of an actor, or None"""
+        return self._world.find_actor(actor_id)
+
+    def has_actor(self, actor_id):
+        return self._world.find_actor(actor_id) is not None
+
+    def __iter__(self):
+        return iter(self._world.get_actors())
+
+    def __len__(self):
+        return len(self._world.get_actors())
+
+
+class KinematicWorld(object):
+    """
+    KinematicWorld implements the part of the carla.World interface used by the navigation agents.
+    The state of all the vehicles is kept in NumPy arrays and advanced at once on every tick
+    with a kinematic bicycle model, driven by the last control applied to each vehicle.
+    """
+
+    def __init__(self, wmap, fixed_delta_seconds=0.05, episode_id=None):
+        """
+        Constructor method.
+
+            :param wmap (carla.Map): map of the world, see load_opendrive_map
+            :param fixed_delta_seconds (float): simulated time between ticks
+            :param episode_id (int): id of the world, which keys the agents' shared caches.
+                By default a new id, different from the ids of the other KinematicWorlds
+        """
+        self._map = wmap
+        self.id = next(_episode_ids) if episode_id is None else episode_id
+        self._dt = fixed_delta_seconds
+        self._frame = 0
+        self._elapsed_seconds = 0.0
+
+        self._actors = ActorList()
+        self._actors_by_id = {}
+        self._next_actor_id = 1
+
+        # State of the vehicles, one row per vehicle. The rows of destroyed vehicles are reused,
+        # and only the first _vehicle_rows rows have ever been used
+        self._vehicle_rows = 0
+        self._free_rows = []
+        self._state = np.zeros((INITIAL_VEHICLE_CAPACITY, 4))  # x, y, yaw (radians), speed (m/s)
+        self._z = np.zeros(INITIAL_VEHICLE_CAPACITY)
+        self._controls = np.zeros((INITIAL_VEHICLE_CAPACITY, 3))  # throttle, steer, brake
+        self._hand_brake = np.zeros(INITIAL_VEHICLE_CAPACITY, dtype=bool)
+        # wheelbase, max steer angle, max acceleration, max deceleration, drag
+        self._parameters = np.zeros((INITIAL_VEHICLE_CAPACITY, 5))
+        self._active = np.zeros(INITIAL_VEHICLE_CAPACITY, dtype=bool)
+
+    def get_map(self):
+        """Returns the map of the world"""
+        return self._map
+
+    def get_actors(self, actor_ids=None):
+        """Returns the ActorList of the actors of the world, or only of those with the given ids"""
+        if actor_ids is None:
+            return ActorList(self._actors)
+        return ActorList(self._actors_by_id[actor_id] for actor_id in actor_ids if actor_id in self._actors_by_id)
+
+    def get_actor(self, actor_id):
+        """Returns the actor with the given id, or None"""
+        return self._actors_by_id.get(actor_id)
+
+    def find_actor(self, actor_id):
+        return self._actors_by_id.get(actor_id)
+
+    def get_snapshot(self):
+        """Returns the WorldSnapshot of the current frame"""
+        return WorldSnapshot(self, self._frame, Timestamp(self._frame, self._elapsed_seconds, self._dt))
+
+    def get_elapsed_seconds(self):
+        """Returns the simulated time since the world was created"""
+        return self._elapsed_seconds
+
+    def spawn_vehicle(self, transform, extent=DEFAULT_EXTENT, speed_limit=DEFAULT_SPEED_LIMIT,
+                      type_id='vehicle.kinematic.car', wheelbase=DEFAULT_WHEELBASE,
+                      max_steer_angle=DEFAULT_MAX_STEER_ANGLE, max_acceleration=DEFAULT_MAX_ACCELERATION,
+                      max_deceleration=DEFAULT_MAX_DECELERATION, drag=DEFAULT_DRAG):
+        """
+        Spawns a KinematicVehicle, at rest, and returns it
+
+            :param transform (carla.Transform): initial transform, only the yaw of the rotation is used
+            :param extent (tuple): half length, width and height of the bounding box
+            :param speed_limit (float): speed limit reported to the agent, in Km/h
+            :param type_id (str): blueprint id, matched by the filters of get_actors
+        """
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            if self._vehicle_rows == len(self._active):
+                self._grow_vehicle_arrays()
+            row = self._vehicle_rows
+            self._vehicle_rows += 1
+        location = transform.location
+        self._state[row] = (location.x, location.y, math.radians(transform.rotation.yaw), 0.0)
+        self._z[row] = location.z
+        self._controls[row] = 0.0
+        self._hand_brake[row] = False
+        self._parameters[row] = (wheelbase, math.radians(max_steer_angle), max_acceleration, max_deceleration, drag)
+        self._active[row] = True
+
+        vehicle = KinematicVehicle(self, self._new_actor_id(), type_id, row, extent, speed_limit)
+        self._add_actor(vehicle)
+        return vehicle
+
+    def add_traffic_light(self, trigger_waypoint, phase=0, green_time=DEFAULT_GREEN_TIME,
+                          yellow_time=DEFAULT_YELLOW_TIME, red_time=None):
+        """
+        Adds a KinematicTrafficLight whose trigger volume is at a waypoint, and returns it.
+        The lights cycle green, yellow and red, with phase 1 starting at red, so that two groups
+        of lights with different phases alternate.
+
+            :param trigger_waypoint (carla.Waypoint): waypoint of the trigger volume, usually before a junction
+            :param phase (int): 0 to start at green, 1 to start at red
+            :param green_time (float): seconds of green
+            :param yellow_time (float): seconds of yellow
+            :param red_time (float): seconds of red, by default the green and yellow time of the other phase
+        """
+        if red_time is None:
+            red_time = green_time + yellow_time
+        traffic_light = KinematicTrafficLight(self, self._new_actor_id(), trigger_waypoint,
+                                              green_time, yellow_time, red_time,
+                                              phase * (green_time + yellow_time))
+        self._add_actor(traffic_light)
+        return traffic_light
+
+    def add_junction_traffic_lights(self, stop_distance=3.0, **timing):
+        """
+        Adds a traffic light to every lane entering a junction, stop_distance meters before it.
+        In each junction the lanes entering roughly north-south and east-west alternate.
+        Returns the list of new traffic lights.
+
+            :param stop_distance (float): distance from the trigger volume to the junction
+            :param timing: green_time, yellow_time and red_time, see add_traffic_light
+        """
+        traffic_lights = []
+        entering_lanes = set()
+        for entry, _ in self._map.get_topology():
+            if not entry.is_junction:
+                continue
+            previous_waypoints = entry.previous(stop_distance)
+            if not previous_waypoints or previous_waypoints[0].is_junction:
+                continue
+            trigger_waypoint = previous_waypoints[0]
+            lane = (entry.junction_id, trigger_waypoint.road_id, trigger_waypoint.lane_id)
+            if lane in entering_lanes:
+                continue
+            entering_lanes.add(lane)
+
+            phase = int(round((trigger_waypoint.transform.rotation.yaw % 180.0) / 90.0)) % 2
+            traffic_lights.append(self.add_traffic_light(trigger_waypoint, phase, **timing))
+        return traffic_lights
+
+    def destroy_actor(self, actor):
+        """Removes an actor from the world"""
+        if actor.id not in self._actors_by_id:
+            return False
+        del self._actors_by_id[actor.id]
+        self._actors.remove(actor)
+        if isinstance(actor, KinematicVehicle):
+            self._active[actor.row] = False
+            self._free_rows.append(actor.row)
+        return True
+
+    def tick(self, seconds=10.0):
+        """
+        Advances the simulation one step of fixed_delta_seconds and returns the new frame.
+        The seconds argument only mirrors carla.World.tick.
+        """
+        self._step_vehicles(self._dt)
+        self._frame += 1
+        self._elapsed_seconds += self._dt
+        return self._frame
+
+    def wait_for_tick(self, seconds=10.0):
+        """Ticks the world, there is no simulator running on its own"""
+        self.tick()
+        return self.get_snapshot()
+
+    def _step_vehicles(self, dt):
+        # Kinematic bicycle model, integrated at the center of the vehicle
+        rows = self._vehicle_rows
+        state = self._state[:rows]
+        x, y, yaw, speed = state.T
+        throttle, steer, brake = self._controls[:rows].T
+        wheelbase, max_steer_angle, max_acceleration, max_deceleration, drag = self._parameters[:rows].T
+
+        brake = np.where(self._hand_brake[:rows], 1.0, brake)
+        acceleration = throttle * max_acceleration - brake * max_deceleration - drag * speed
+        new_speed = np.maximum(speed + acceleration * dt, 0.0)
+        mean_speed = 0.5 * (speed + new_speed)
+
+        new_yaw = yaw + mean_speed / wheelbase * np.tan(steer * max_steer_angle) * dt
+        mean_yaw = 0.5 * (yaw + new_yaw)
+        new_state = np.stack([x + mean_speed * np.cos(mean_yaw) * dt,
+                              y + mean_speed * np.sin(mean_yaw) * dt,
+                              np.arctan2(np.sin(new_yaw), np.cos(new_yaw)),
+                              new_speed], axis=1)
+        self._state[:rows] = np.where(self._active[:rows, np.newaxis], new_state, state)
+
+    def _grow_vehicle_arrays(self):
+        # Doubles the rows of the vehicle state arrays, so that spawning N vehicles copies them O(log N) times
+        capacity = 2 * len(self._active)
+        for name in ('_state', '_z', '_controls', '_hand_brake', '_parameters', '_active'):
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def _new_actor_id(self):
+        actor_id = self._next_actor_id
+        self._next_actor_id += 1
+        return actor_id
+
+    def _add_actor(self, actor):
+        self._actors.append(actor)
+        self._actors_by_id[actor.id] = actor
+
+
+class KinematicActor(object):
+    """
+    Base of the actors of a KinematicWorld
+    """
+
+    def __init__(self, world, actor_id, type_id):
+        self._world = world
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = {}
+        self.parent = None
+
+    @property
+    def is_alive(self):
+        return self._world.get_actor(self.id) is self
+
+    def get_world(self):
+        return self._world
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return carla.Vector3D()
+
+    def get_angular_velocity(self):
+        return carla.Vector3D()
+
+    def get_acceleration(self):
+        return carla.Vector3D()
+
+    def destroy(self):
+        return self._world.destroy_actor(self)
+
+
+class KinematicVehicle(KinematicActor):
+    """
+    Vehicle of a KinematicWorld, moved by the controls applied to it
+    """
+
+    def __init__(self, world, actor_id, type_id, row, extent, speed_limit):
+        super(KinematicVehicle, self).__init__(world, actor_id, type_id)
+        self.row = row
+        self.bounding_box = carla.BoundingBox(carla.Location(0.0, 0.0, extent[2]), carla.Vector3D(*extent))
+        self._speed_limit = speed_limit
+        self._control = carla.VehicleControl()
+
+    def get_transform(self):
+        row = self._alive_row()
+        x, y, yaw, _ = self._world._state[row].tolist()
+        return carla.Transform(carla.Location(x, y, float(self._world._z[row])),
+                               carla.Rotation(yaw=math.degrees(yaw)))
+
+    def get_velocity(self):
+        _, _, yaw, speed = self._world._state[self._alive_row()].tolist()
+        return carla.Vector3D(speed * math.cos(yaw), speed * math.sin(yaw), 0.0)
+
+    def get_control(self):
+        return self._control
+
+    def apply_control(self, control):
+        """Sets the control used on the next ticks"""
+        row = self._alive_row()
+        self._control = control
+        self._world._controls[row] = (control.throttle, control.steer, control.brake)
+        self._world._hand_brake[row] = control.hand_brake
+
+    def set_target_velocity(self, velocity):
+        """Sets the speed of the vehicle, along its forward direction"""
+        self._world._state[self._alive_row(), 3] = math.sqrt(velocity.x ** 2 + velocity.y ** 2 + velocity.z ** 2)
+
+    def set_transform(self, transform):
+        row = self._alive_row()
+        location = transform.location
+        self._world._state[row, :3] = (location.x, location.y, math.radians(transform.rotation.yaw))
+        self._world._z[row] = location.z
+
+    def get_speed_limit(self):
+        return self._speed_limit
+
+    def set_speed_limit(self, speed_limit):
+        self._speed_limit = speed_limit
+
+    def set_autopilot(self, enabled=True, port=None):
+        if enabled:
+            raise RuntimeError('There is no traffic manager in a KinematicWorld')
+
+    def _alive_row(self):
+        # The row of a destroyed vehicle may already hold another vehicle
+        if not self.is_alive:
+            raise RuntimeError('trying to operate on a destroyed actor')
+        return self.row
+
+
+class KinematicTrafficLight(KinematicActor):
+    """
+    Traffic light of a KinematicWorld, cycling green, yellow and red on fixed timings
+    """
+
+    def __init__(self, world, actor_id, trigger_waypoint, green_time, yellow_time, red_time, time_offset):
+        super(KinematicTrafficLight, self).__init__(world, actor_id, 'traffic.traffic_light')
+        transform = trigger_waypoint.transform
+        self._transform = carla.Transform(carla.Location(transform.location.x, transform.location.y,
+                                                         transform.location.z),
+                                          carla.Rotation(yaw=transform.rotation.yaw))
+        self.trigger_volume = carla.BoundingBox(carla.Location(), carla.Vector3D(
+            1.0, trigger_waypoint.lane_width / 2.0, 2.0))
+        self.bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(0.5, 0.5, 2.0))
+        self._timing = (green_time, yellow_time, red_time)
+        self._time_offset = time_offset
+        self._frozen_state = None
+
+    @property
+    def state(self):
+        return self.get_state()
+
+    def get_state(self):
+        """Returns the carla.TrafficLightState at the current time of the world"""
+        if self._frozen_state is not None:
+            return self._frozen_state
+        green_time, yellow_time, red_time = self._timing
+        cycle_time = (self._world.get_elapsed_seconds() + self._time_offset) % (green_time + yellow_time + red_time)
+        if cycle_time < green_time:
+            return carla.TrafficLightState.Green
+        if cycle_time < green_time + yellow_time:
+            return carla.TrafficLightState.Yellow
+        return carla.TrafficLightState.Red
+
+    def set_state(self, state):
+        """Freezes the light in a state"""
+        self._frozen_state = state
+
+    def freeze(self, freeze):
+        """Freezes the light in its current state, or releases it"""
+        self._frozen_state = self.get_state() if freeze else None
+
+    def is_frozen(self):
+        return self._frozen_state is not None
+
+    def get_transform(self):
+        return self._transform
+
+
+class KinematicClient(object):
+    """
+    Stand-in for carla.Client, applying the ApplyVehicleControl commands of a batch to a KinematicWorld
+    """
+
+    def __init__(self, world):
+        self._world = world
+
+    def get_world(self):
+        return self._world
+
+    def apply_batch(self, commands):
+        """Applies the controls of a list of carla.command.ApplyVehicleControl"""
+        for command in commands:
+            vehicle = self._world.get_actor(command.actor_id)
+            if vehicle is not None:
+                vehicle.apply_control(command.control)
+
+    def apply_batch_sync(self, commands, due_tick_cue=False):
+        """Applies the controls of a batch, ticking the world after them if due_tick_cue"""
+        self.apply_batch(commands)
+        if due_tick_cue:
+            self._world.tick()
+        return []
+
@@ -0,0 +1,88 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides an index of the traffic lights of a world by the road and lane of
+their trigger volumes. Traffic lights don't move, so it is built once and shared by the agents.
+"""
+
+import threading
+from collections import namedtuple, defaultdict
+
+from agents.tools.misc import get_trafficlight_trigger_location
+
+# Traffic light and the waypoint of its trigger volume, with the forward vector of the waypoint as (x, y, z)
+TrafficLightEntry = namedtuple('TrafficLightEntry', ['traffic_light', 'waypoint', 'forward'])
+
+
+class TrafficLightIndex(object):
+    """
+    Traffic lights of a world grouped by the road, and by the road and lane, of the waypoint
+    of their trigger volume. The entries of each road or lane keep the order of the lights in
+    the list used to build the index.
+    """
+
+    def __init__(self, wmap, traffic_lights):
+        """
+        :param wmap (carla.Map): map of the world
+        :param traffic_lights (list of carla.TrafficLight): traffic lights to index
+        """
+        self._by_road = defaultdict(list)
+        self._by_lane = defaultdict(list)
+        self._ids = set()
+
+        for traffic_light in traffic_lights:
+            waypoint = wmap.get_waypoint(get_trafficlight_trigger_location(traffic_light))
+            forward = waypoint.transform.get_forward_vector()
+            entry = TrafficLightEntry(traffic_light, waypoint, (forward.x, forward.y, forward.z))
+            self._by_road[waypoint.road_id].append(entry)
+            self._by_lane[(waypoint.road_id, waypoint.lane_id)].append(entry)
+            self._ids.add(traffic_light.id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, traffic_light_id):
+        return traffic_light_id in self._ids
+
+    def lights_on_road(self, road_id):
+        """Returns the TrafficLightEntry of the lights triggered from a road"""
+        return self._by_road.get(road_id, ())
+
+    def lights_on_lane(self, road_id, lane_id):
+        """Returns the TrafficLightEntry of the lights triggered from a lane"""
+        return self._by_lane.get((road_id, lane_id), ())
+
+
+# Indices shared by all the agents, see get_traffic_light_index
+_shared_indices = dict()
+_shared_indices_lock = threading.Lock()
+
+
+def get_traffic_light_index(world, wmap, traffic_lights=None):
+    """
+    Returns the TrafficLightIndex shared by all the callers using the same world (episode),
+    building it on the first call
+
+        :param world (carla.World): world of the traffic lights
+        :param wmap (carla.Map): map of the world
+        :param traffic_lights (list of carla.TrafficLight): lights of the world, fetched from it if None
+    """
+    with _shared_indices_lock:
+        index = _shared_indices.get(world.id)
+        if index is None:
+            if traffic_lights is None:
+                traffic_lights = world.get_actors().filter("*traffic_light*")
+            index = TrafficLightIndex(wmap, traffic_lights)
+            _shared_indices[world.id] = index
+    return index
+
+
+def clear_traffic_light_indices():
+    """
+    Releases the shared indices, e.g. after loading a different map
+    """
+    with _shared_indices_lock:
+        _shared_indices.clear()
@@ -0,0 +1,227 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a client-side spatial index of the lanes of a map, to find the closest
+lane of a location without calling carla.Map.get_waypoint.
+"""
+
+import math
+import numpy as np
+
+import carla
+
+# Maximum distance between the samples of a lane, the waypoints are interpolated to it
+DEFAULT_SAMPLE_DISTANCE = 0.5
+
+# Side of the grid cells, queries closer than this to a lane only look at the 3x3 neighbouring cells
+DEFAULT_CELL_SIZE = 5.0
+
+
+class IndexedWaypoint(object):
+    """
+    Result of a WaypointIndex query. It has the same lane attributes as a carla.Waypoint
+    (road_id, section_id, lane_id, s, is_junction, lane_width and transform)
+    plus the distance from the query location to the lane sample.
+    """
+    __slots__ = ('road_id', 'section_id', 'lane_id', 's', 'is_junction', 'lane_width',
+                 'distance', '_location', '_yaw', '_transform')
+
+    lane_type = carla.LaneType.Driving
+
+    def __init__(self, road_id, section_id, lane_id, s, is_junction, lane_width, distance, location, yaw):
+        self.road_id = road_id
+        self.section_id = section_id
+        self.lane_id = lane_id
+        self.s = s
+        self.is_junction = is_junction
+        self.lane_width = lane_width
+        self.distance = distance
+        self._location = location
+        self._yaw = yaw
+        self._transform = None
+
+    @property
+    def transform(self):
+        """Transform of the lane sample, oriented along the lane"""
+        if self._transform is None:
+            self._transform = carla.Transform(carla.Location(*self._location), carla.Rotation(yaw=self._yaw))
+        return self._transform
+
+
+class WaypointIndex(object):
+    """
+    Uniform grid over points sampled along the lanes of the map. Each sample carries
+    the road, section and lane ids of its lane, so the closest lane of a location is
+    found locally, one location at a time or in batch.
+
+    The closest sample is returned instead of the projection on the lane center, so the
+    result matches carla.Map.get_waypoint except for locations about half the sample
+    distance away from the border between two lanes.
+    """
+
+    def __init__(self, arrays, cell_size=DEFAULT_CELL_SIZE):
+        """
+        :param arrays: dictionary of sample arrays, as returned by to_arrays
+        :param cell_size: side of the grid cells
+        """
+        self._cell_size = cell_size
+        self._xyz = np.ascontiguousarray(arrays['xyz'], dtype=np.float64)
+        self._yaw = np.asarray(arrays['yaw'], dtype=np.float64)
+        self._ids = np.asarray(arrays['ids'], dtype=np.int64)  # (N, 3) road, section and lane ids
+        self._s = np.asarray(arrays['s'], dtype=np.float64)
+        self._is_junction = np.asarray(arrays['is_junction'], dtype=bool)
+        self._lane_width = np.asarray(arrays['lane_width'], dtype=np.float64)
+
+        # Sort the samples by cell, so that the samples of a cell are a contiguous slice
+        cells = np.floor(self._xyz[:, :2] / cell_size).astype(np.int64)
+        self._cell_min = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        self._cell_rows = (cells[:, 1].max() - self._cell_min[1] + 3) if len(cells) else 1
+        keys = self._cell_key(cells)
+        order = np.argsort(keys, kind='stable')
+        for name in ('_xyz', '_yaw', '_ids', '_s', '_is_junction', '_lane_width'):
+            setattr(self, name, getattr(self, name)[order])
+        keys = keys[order]
+        self._keys, self._starts = np.unique(keys, return_index=True)
+        self._starts = np.append(self._starts, len(keys))
+
+    @classmethod
+    def from_waypoint_lists(cls, waypoint_lists, sample_distance=DEFAULT_SAMPLE_DISTANCE, cell_size=DEFAULT_CELL_SIZE):
+        """
+        Builds the index from lists of consecutive waypoints along the lanes, such as the
+        entry, path and exit waypoints of the GlobalRoutePlanner edges. Consecutive waypoints of
+        the same lane further apart than sample_distance are linearly interpolated.
+        """
+        return cls(waypoints_to_arrays(waypoint_lists, sample_distance), cell_size)
+
+    def to_arrays(self):
+        """
+        Returns the sample arrays of the index, which can be pickled and passed back to the constructor
+        """
+        return {'xyz': self._xyz, 'yaw': self._yaw, 'ids': self._ids, 's': self._s,
+                'is_junction': self._is_junction, 'lane_width': self._lane_width}
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def _cell_key(self, cells):
+        # Cell coordinates to a single integer, shifted by one so that the neighbours of the border cells are valid
+        cells = cells - self._cell_min + 1
+        return cells[..., 0] * self._cell_rows + cells[..., 1]
+
+    def query_batch(self, points):
+        """
+        Returns, for each of the (M, 2) or (M, 3) points, the index of the closest lane sample and its distance
+        """
+        points = np.asarray(points, dtype=np.float64)
+        points = points.reshape(-1, points.shape[-1] if points.ndim > 1 else 3)
+        num_points = len(points)
+        if num_points == 0 or len(self._xyz) == 0:
+            return np.full(num_points, -1, dtype=np.int64), np.full(num_points, np.inf)
+        if points.shape[1] == 2:
+            points = np.hstack([points, np.zeros((num_points, 1))])
+            sample_xyz = np.hstack([self._xyz[:, :2], np.zeros((len(self._xyz), 1))])
+        else:
+            sample_xyz = self._xyz
+
+        # Samples of the 3x3 cells around each point, as a flat list of (point, sample) candidates
+        cells = np.floor(points[:, :2] / self._cell_size).astype(np.int64)
+        offsets = np.array([(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)], dtype=np.int64)
+        keys = self._cell_key(cells[:, np.newaxis, :] + offsets).ravel()
+        position = np.searchsorted(self._keys, keys)
+        found = position < len(self._keys)
+        found[found] = self._keys[position[found]] == keys[found]
+        starts = np.where(found, self._starts[np.minimum(position, len(self._keys) - 1)], 0)
+        counts = np.where(found, self._starts[np.minimum(position + 1, len(self._keys))] - starts, 0)
+
+        candidate_point = np.repeat(np.arange(len(keys)) // len(offsets), counts)
+        candidate_sample = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) \
+            + np.repeat(starts, counts)
+        difference = sample_xyz[candidate_sample] - points[candidate_point]
+        distance = np.sqrt(np.einsum('ij,ij->i', difference, difference))
+
+        # Closest candidate of each point, ties solved by the lowest sample index
+        indices = np.full(num_points, -1, dtype=np.int64)
+        distances = np.full(num_points, np.inf)
+        if len(candidate_point):
+            order = np.lexsort((candidate_sample, distance, candidate_point))
+            first = order[np.flatnonzero(np.r_[True, np.diff(candidate_point[order]) != 0])]
+            indices[candidate_point[first]] = candidate_sample[first]
+            distances[candidate_point[first]] = distance[first]
+
+        # Points further than a cell from every lane may have their closest sample outside the 3x3 cells
+        for i in np.flatnonzero(distances > self._cell_size):
+            difference = sample_xyz - points[i]
+            squared = np.einsum('ij,ij->i', difference, difference)
+            indices[i] = np.argmin(squared)
+            distances[i] = math.sqrt(squared[indices[i]])
+
+        return indices, distances
+
+    def lane_ids_batch(self, points):
+        """
+        Returns the (M, 3) road, section and lane ids of the closest lane of each point
+        """
+        indices, _ = self.query_batch(points)
+        return self._ids[indices]
+
+    def get_waypoint(self, location):
+        """
+        Returns the IndexedWaypoint of the closest lane to a carla.Location
+        """
+        return self.get_waypoints([location])[0]
+
+    def get_waypoints(self, locations):
+        """
+        Returns the IndexedWaypoint of the closest lane to each carla.Location
+        """
+        indices, distances = self.query_batch([[l.x, l.y, l.z] for l in locations])
+        return [self._waypoint(i, d) for i, d in zip(indices.tolist(), distances.tolist())]
+
+    def _waypoint(self, index, distance):
+        road_id, section_id, lane_id = self._ids[index].tolist()
+        return IndexedWaypoint(road_id, section_id, lane_id, float(self._s[index]), bool(self._is_junction[index]),
+                               float(self._lane_width[index]), distance, self._xyz[index].tolist(),
+                               float(self._yaw[index]))
+
+
+def waypoints_to_arrays(waypoint_lists, sample_distance=DEFAULT_SAMPLE_DISTANCE):
+    """
+    Samples lists of consecutive waypoints into the arrays of a WaypointIndex
+    """
+    xyz, yaw, ids, s, is_junction, lane_width = [], [], [], [], [], []
+    for waypoints in waypoint_lists:
+        for i, waypoint in enumerate(waypoints):
+            location = waypoint.transform.location
+            lane = (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+            xyz.append((location.x, location.y, location.z))
+            yaw.append(waypoint.transform.rotation.yaw)
+            ids.append(lane)
+            s.append(waypoint.s)
+            is_junction.append(waypoint.is_junction)
+            lane_width.append(waypoint.lane_width)
+
+            if i + 1 == len(waypoints):
+                break
+            following = waypoints[i + 1]
+            if (following.road_id, following.section_id, following.lane_id) != lane:
+                continue
+
+            # Interpolated samples up to the next waypoint of the same lane
+            end = following.transform.location
+            steps = int(math.ceil(location.distance(end) / sample_distance))
+            for t in np.arange(1, steps) / float(max(steps, 1)):
+                xyz.append((location.x + t * (end.x - location.x),
+                            location.y + t * (end.y - location.y),
+                            location.z + t * (end.z - location.z)))
+                yaw.append(math.degrees(math.atan2(end.y - location.y, end.x - location.x)))
+                ids.append(lane)
+                s.append(waypoint.s + t * (following.s - waypoint.s))
+                is_junction.append(waypoint.is_junction)
+                lane_width.append(waypoint.lane_width)
+
+    return {'xyz': np.array(xyz, dtype=np.float64).reshape(-1, 3), 'yaw': np.array(yaw, dtype=np.float64),
+            'ids': np.array(ids, dtype=np.int64).reshape(-1, 3), 's': np.array(s, dtype=np.float64),
+            'is_junction': np.array(is_junction, dtype=bool), 'lane_width': np.array(lane_width, dtype=np.float64)}
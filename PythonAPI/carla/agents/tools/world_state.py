@@ -0,0 +1,231 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a per-frame cache of the actors of the world and their state, shared
+by all the agents of a client so that the actor list is fetched once per tick.
+"""
+
+import math
+import threading
+from collections import defaultdict
+import numpy as np
+
+# Side of the cells of the spatial grid of each group of actors
+DEFAULT_CELL_SIZE = 10.0
+
+# Filters of the groups of actors kept by the cache, as used by the agents
+VEHICLE_FILTER = "*vehicle*"
+WALKER_FILTER = "*walker.pedestrian*"
+TRAFFIC_LIGHT_FILTER = "*traffic_light*"
+
+
+class ActorGroup(object):
+    """
+    Actors of one type at a given frame, in the order of world.get_actors(), with their
+    state as NumPy arrays and a uniform grid over their positions. It can be used
+    in place of the actor lists passed to the agent checks.
+
+    Arrays:
+        ids (N,) actor ids
+        positions (N, 3) locations of the actors
+        yaws (N,) yaws of the actors, in degrees
+        extents (N, 3) extents of the bounding boxes
+        velocities (N, 3) velocities of the actors, in m/s
+    """
+
+    def __init__(self, actors, transforms, velocities, cell_size=DEFAULT_CELL_SIZE):
+        """
+        :param actors (list of carla.Actor): actors of the group
+        :param transforms (list of carla.Transform): transform of each actor
+        :param velocities (list of carla.Vector3D): velocity of each actor
+        :param cell_size (float): side of the grid cells
+        """
+        self.actors = actors
+        self.transforms = transforms
+        self._cell_size = cell_size
+
+        count = len(actors)
+        self.ids = np.array([actor.id for actor in actors], dtype=np.int64)
+        self.positions = np.array(
+            [[t.location.x, t.location.y, t.location.z] for t in transforms], dtype=np.float64).reshape(count, 3)
+        self.yaws = np.array([t.rotation.yaw for t in transforms], dtype=np.float64)
+        self.extents = np.array(
+            [[e.x, e.y, e.z] for e in (actor.bounding_box.extent for actor in actors)],
+            dtype=np.float64).reshape(count, 3)
+        self.velocities = np.array(
+            [[v.x, v.y, v.z] for v in velocities], dtype=np.float64).reshape(count, 3)
+
+        self._grid = defaultdict(list)
+        cells = np.floor(self.positions[:, :2] / cell_size).astype(np.int64)
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            self._grid[cell].append(index)
+
+    def __len__(self):
+        return len(self.actors)
+
+    def __iter__(self):
+        return iter(self.actors)
+
+    def __getitem__(self, index):
+        return self.actors[index]
+
+    def speeds(self):
+        """Returns the speed of each actor, in Km/h"""
+        return 3.6 * np.linalg.norm(self.velocities, axis=1)
+
+    def indices_within_distance(self, location, max_distance, exclude_id=None):
+        """
+        Returns the sorted indices of the actors closer than max_distance to a location
+
+            :param location (carla.Location): center of the query
+            :param max_distance (float): radius of the query
+            :param exclude_id (int): id of an actor to leave out, usually the ego vehicle
+        """
+        min_cell_x = int(math.floor((location.x - max_distance) / self._cell_size))
+        max_cell_x = int(math.floor((location.x + max_distance) / self._cell_size))
+        min_cell_y = int(math.floor((location.y - max_distance) / self._cell_size))
+        max_cell_y = int(math.floor((location.y + max_distance) / self._cell_size))
+
+        candidates = []
+        if (max_cell_x - min_cell_x + 1) * (max_cell_y - min_cell_y + 1) > len(self._grid):
+            for cell, indices in self._grid.items():
+                if min_cell_x <= cell[0] <= max_cell_x and min_cell_y <= cell[1] <= max_cell_y:
+                    candidates.extend(indices)
+        else:
+            for cell_x in range(min_cell_x, max_cell_x + 1):
+                for cell_y in range(min_cell_y, max_cell_y + 1):
+                    candidates.extend(self._grid.get((cell_x, cell_y), ()))
+        candidates = np.array(sorted(candidates), dtype=np.int64)
+
+        difference = self.positions[candidates] - np.array([location.x, location.y, location.z])
+        inside = np.sqrt(np.einsum('ij,ij->i', difference, difference)) < max_distance
+        if exclude_id is not None:
+            inside &= self.ids[candidates] != exclude_id
+        return candidates[inside]
+
+    def within_distance(self, location, max_distance, exclude_id=None):
+        """
+        Returns the ActorGroup of the actors closer than max_distance to a location,
+        see indices_within_distance
+        """
+        return self.subset(self.indices_within_distance(location, max_distance, exclude_id))
+
+    def subset(self, indices):
+        """Returns the ActorGroup of the actors at the given indices"""
+        group = ActorGroup.__new__(ActorGroup)
+        group.actors = [self.actors[i] for i in indices]
+        group.transforms = [self.transforms[i] for i in indices]
+        group._cell_size = self._cell_size
+        for name in ('ids', 'positions', 'yaws', 'extents', 'velocities'):
+            setattr(group, name, getattr(self, name)[indices])
+        group._grid = defaultdict(list)
+        index_map = {index: position for position, index in enumerate(np.asarray(indices).tolist())}
+        for cell, cell_indices in self._grid.items():
+            kept = [index_map[i] for i in cell_indices if i in index_map]
+            if kept:
+                group._grid[cell] = sorted(kept)
+        return group
+
+
+class WorldStateCache(object):
+    """
+    Actors of the world and their state, fetched once per frame. Every accessor checks the
+    frame of the latest world snapshot and refreshes the cache when it changed, so the
+    agents of a client read the same data instead of querying the server each.
+    """
+
+    def __init__(self, world, cell_size=DEFAULT_CELL_SIZE):
+        """
+        :param world (carla.World): world of the actors
+        :param cell_size (float): side of the grid cells of the actor groups
+        """
+        self._world = world
+        self._cell_size = cell_size
+        self._lock = threading.Lock()
+        self._frame = None
+        self._vehicles = None
+        self._walkers = None
+        self._traffic_lights = None
+
+    @property
+    def frame(self):
+        """Frame of the cached data"""
+        self._update()
+        return self._frame
+
+    def vehicles(self):
+        """Returns the ActorGroup of the vehicles of the current frame"""
+        self._update()
+        return self._vehicles
+
+    def walkers(self):
+        """Returns the ActorGroup of the pedestrians of the current frame"""
+        self._update()
+        return self._walkers
+
+    def traffic_lights(self):
+        """Returns the list of traffic lights of the current frame"""
+        self._update()
+        return self._traffic_lights
+
+    def invalidate(self):
+        """Forces a refresh on the next access, e.g. right after spawning or destroying actors"""
+        with self._lock:
+            self._frame = None
+
+    def _update(self):
+        snapshot = self._world.get_snapshot()
+        with self._lock:
+            if snapshot.frame == self._frame:
+                return
+
+            actor_list = self._world.get_actors()
+            self._vehicles = self._group(actor_list.filter(VEHICLE_FILTER), snapshot)
+            self._walkers = self._group(actor_list.filter(WALKER_FILTER), snapshot)
+            self._traffic_lights = list(actor_list.filter(TRAFFIC_LIGHT_FILTER))
+            self._frame = snapshot.frame
+
+    def _group(self, actors, snapshot):
+        actors = list(actors)
+        transforms, velocities = [], []
+        for actor in actors:
+            # Actors spawned after the snapshot aren't part of it
+            actor_snapshot = snapshot.find(actor.id)
+            if actor_snapshot is None:
+                transforms.append(actor.get_transform())
+                velocities.append(actor.get_velocity())
+            else:
+                transforms.append(actor_snapshot.get_transform())
+                velocities.append(actor_snapshot.get_velocity())
+        return ActorGroup(actors, transforms, velocities, self._cell_size)
+
+
+# Caches shared by all the agents, see get_world_state_cache
+_shared_caches = dict()
+_shared_caches_lock = threading.Lock()
+
+
+def get_world_state_cache(world):
+    """
+    Returns the WorldStateCache shared by all the callers using the same world (episode),
+    creating it on the first call
+
+        :param world (carla.World): world of the actors
+    """
+    with _shared_caches_lock:
+        cache = _shared_caches.get(world.id)
+        if cache is None:
+            cache = WorldStateCache(world)
+            _shared_caches[world.id] = cache
+    return cache
+
+
+def clear_world_state_caches():
+    """
+    Releases the shared caches, e.g. after loading a different map
+    """
+    with _shared_caches_lock:
+        _shared_caches.clear()
@@ -19,103 +19,329 @@ except IndexError:
 
 import carla
 import random
+import struct
 
+import numpy as np
 
-def get_scene_layout(carla_map):
+# Magic bytes and version of the binary scene layout format, see write_scene_layout
+LAYOUT_MAGIC = b'CSLY'
+LAYOUT_VERSION = 1
+
+_HEADER = struct.Struct('<4sId')
+_ROAD_HEADER = struct.Struct('<II')
+_LANE_HEADER = struct.Struct('<iI')
+
+
+class WaypointIdRange(object):
     """
-    Function to extract the full scene layout to be used as a full scene description to be
-    given to the user
-    :return: a dictionary describing the scene.
+    Ids of the waypoints of a lane from a given index to the end of the lane, as a view
+    on the ids of the lane instead of a list, so that all the successors of all the
+    waypoints of a lane take constant memory each.
     """
 
-    def _lateral_shift(transform, shift):
-        transform.rotation.yaw += 90
-        return transform.location + shift * transform.get_forward_vector()
+    def __init__(self, ids, start):
+        self._ids = ids
+        self.start = start
+        self.stop = len(ids)
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __iter__(self):
+        return iter(self._ids[self.start:self.stop].tolist())
 
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('waypoint id index out of range')
+        return int(self._ids[self.start + index])
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'WaypointIdRange(%d, %d)' % (self.start, self.stop)
+
+    def tolist(self):
+        return self._ids[self.start:self.stop].tolist()
+
+
+class LaneLayout(object):
+    """
+    Waypoints of a lane every `precision` meters as contiguous arrays. The successors of
+    the waypoint i are the waypoints i + 1 to the end of the lane.
+
+    Arrays:
+        ids (N,) waypoint ids
+        positions (N, 3) latitude, longitude and altitude of the waypoints
+        orientations (N, 3) roll, pitch and yaw of the waypoints
+        left_margins (N, 3) latitude, longitude and altitude of the left lane marking
+        right_margins (N, 3) latitude, longitude and altitude of the right lane marking
+    """
+
+    def __init__(self, road_id, lane_id, ids, positions, orientations, left_margins, right_margins):
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.ids = ids
+        self.positions = positions
+        self.orientations = orientations
+        self.left_margins = left_margins
+        self.right_margins = right_margins
+
+    def __len__(self):
+        return len(self.ids)
+
+    def next_ids(self, index):
+        """Returns the WaypointIdRange of the successors of a waypoint"""
+        return WaypointIdRange(self.ids, index + 1)
+
+
+def _left_lane_key(lane_key):
+    return lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
+
+
+def _right_lane_key(lane_key):
+    return lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
+
+
+def _lane_waypoints(waypoint, precision):
+    """
+    Waypoints of the lane of a waypoint every `precision` meters until the road changes
+    """
+    waypoints = [waypoint]
+    # next_until_lane_end walks the lane on the server, its last waypoint is the exact lane end.
+    # It fails when the walk ends right at the lane end, then the lane is walked from here
+    try:
+        waypoints.extend(waypoint.next_until_lane_end(precision)[:-1])
+    except RuntimeError:
+        pass
+
+    # It stops at forks too, where each waypoint continues through its first successor
+    nxt = waypoints[-1].next(precision)
+    while len(nxt) > 0 and nxt[0].road_id == waypoint.road_id:
+        waypoints.append(nxt[0])
+        nxt = nxt[0].next(precision)
+    return waypoints
+
+
+def _geolocations(carla_map, points):
+    geolocations = [carla_map.transform_to_geolocation(carla.Location(x, y, z)) for x, y, z in points.tolist()]
+    return np.array([[g.latitude, g.longitude, g.altitude] for g in geolocations],
+                    dtype=np.float64).reshape(len(points), 3)
+
+
+def _lane_layout(carla_map, waypoint, precision):
+    waypoints = _lane_waypoints(waypoint, precision)
+    count = len(waypoints)
+
+    transforms = [w.transform for w in waypoints]
+    locations = np.array([[t.location.x, t.location.y, t.location.z] for t in transforms], dtype=np.float64)
+    orientations = np.array([[t.rotation.roll, t.rotation.pitch, t.rotation.yaw] for t in transforms],
+                            dtype=np.float64).reshape(count, 3)
+
+    # The markings are half a lane away along the forward vector of the waypoint rotated 90 degrees
+    pitch = np.radians(orientations[:, 1])
+    yaw = np.radians(orientations[:, 2] + 90)
+    lateral = np.stack([np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw), np.sin(pitch)], axis=1)
+    half_width = 0.5 * np.array([w.lane_width for w in waypoints], dtype=np.float64)[:, np.newaxis]
+
+    return LaneLayout(
+        waypoint.road_id, waypoint.lane_id,
+        np.array([w.id for w in waypoints], dtype=np.uint64),
+        _geolocations(carla_map, locations),
+        orientations,
+        _geolocations(carla_map, locations - half_width * lateral),
+        _geolocations(carla_map, locations + half_width * lateral))
+
+
+def iter_scene_layout(carla_map, precision=0.05):
+    """
+    Generator of the layout of the map one road at a time, as a pair (road_id, lanes) where
+    lanes is a dictionary of LaneLayout by lane_id. Only the lanes of one road are kept in
+    memory at a time.
+
+        :param carla_map (carla.Map): map of the layout
+        :param precision (float): distance between the waypoints of a lane, in meters
+    """
     topology = [x[0] for x in carla_map.get_topology()]
     topology = sorted(topology, key=lambda w: w.transform.location.z)
 
-    # A road contains a list of lanes, a each lane contains a list of waypoints
-    map_dict = dict()
-    precision = 0.05
+    # Each lane is walked from its highest entry point in the topology
+    entries = dict()
     for waypoint in topology:
-        waypoints = [waypoint]
-        nxt = waypoint.next(precision)
-        if len(nxt) > 0:
-            nxt = nxt[0]
-            while nxt.road_id == waypoint.road_id:
-                waypoints.append(nxt)
-                nxt = nxt.next(precision)
-                if len(nxt) > 0:
-                    nxt = nxt[0]
-                else:
-                    break
-
-        left_marking = [_lateral_shift(w.transform, -w.lane_width * 0.5) for w in waypoints]
-        right_marking = [_lateral_shift(w.transform, w.lane_width * 0.5) for w in waypoints]
-
-        lane = {
-            "waypoints": waypoints,
-            "left_marking": left_marking,
-            "right_marking": right_marking
-        }
+        entries[(waypoint.road_id, waypoint.lane_id)] = waypoint
+    roads = dict()
+    for (road_key, lane_key), waypoint in entries.items():
+        roads.setdefault(road_key, dict())[lane_key] = waypoint
 
-        if map_dict.get(waypoint.road_id) is None:
-            map_dict[waypoint.road_id] = {}
-        map_dict[waypoint.road_id][waypoint.lane_id] = lane
+    for road_key, road_entries in roads.items():
+        lanes = dict()
+        for lane_key, waypoint in road_entries.items():
+            lanes[lane_key] = _lane_layout(carla_map, waypoint, precision)
+        yield road_key, lanes
+
+
+def _neighbour_waypoint_ids(lanes, lane_key, neighbour_key):
+    """Ids of the waypoints of the neighbour lane with the same index, -1 past its end or without it"""
+    neighbour_ids = [-1] * len(lanes[lane_key])
+    if neighbour_key in lanes:
+        ids = lanes[neighbour_key].ids[:len(neighbour_ids)].tolist()
+        neighbour_ids[:len(ids)] = ids
+    return neighbour_ids
+
+
+def _road_waypoints_graph(road_key, lanes, waypoints_graph, lanes_ids=None):
+    """
+    Adds the waypoints of a road to the waypoints graph. With lanes_ids, the successors of each
+    waypoint are the range [start, stop] of the ids of its lane, which are added to lanes_ids,
+    otherwise they are the list of ids.
+    """
+    for lane_key, lane in lanes.items():
+        left_ids = _neighbour_waypoint_ids(lanes, lane_key, _left_lane_key(lane_key))
+        right_ids = _neighbour_waypoint_ids(lanes, lane_key, _right_lane_key(lane_key))
+        ids = lane.ids.tolist()
+        rows = zip(ids, lane.positions.tolist(), lane.orientations.tolist(),
+                   lane.left_margins.tolist(), lane.right_margins.tolist(), left_ids, right_ids)
+        if lanes_ids is not None:
+            lanes_ids.setdefault(road_key, dict())[lane_key] = ids
+
+        for i, (waypoint_id, position, orientation, left_margin, right_margin, left_id, right_id) \
+                in enumerate(rows):
+            waypoints_graph[waypoint_id] = {
+                "road_id": road_key,
+                "lane_id": lane_key,
+                "position": position,
+                "orientation": orientation,
+                "left_margin_position": left_margin,
+                "right_margin_position": right_margin,
+                "next_waypoints_ids": ids[i + 1:] if lanes_ids is None else [i + 1, len(ids)],
+                "left_lane_waypoint_id": left_id,
+                "right_lane_waypoint_id": right_id
+            }
+
+
+def _scene_layout(roads, successors):
+    if successors not in ('range', 'list'):
+        raise ValueError("successors must be 'range' or 'list', not %r" % (successors,))
 
-    # Generate waypoints graph
     waypoints_graph = dict()
-    for road_key in map_dict:
-        for lane_key in map_dict[road_key]:
-            # List of waypoints
-            lane = map_dict[road_key][lane_key]
-
-            for i in range(0, len(lane["waypoints"])):
-                next_ids = [w.id for w in lane["waypoints"][i + 1:len(lane["waypoints"])]]
-
-                # Get left and right lane keys
-                left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
-                right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
-
-                # Get left and right waypoint ids only if they are valid
-                left_lane_waypoint_id = -1
-                if left_lane_key in map_dict[road_key]:
-                    left_lane_waypoints = map_dict[road_key][left_lane_key]["waypoints"]
-                    if i < len(left_lane_waypoints):
-                        left_lane_waypoint_id = left_lane_waypoints[i].id
-
-                right_lane_waypoint_id = -1
-                if right_lane_key in map_dict[road_key]:
-                    right_lane_waypoints = map_dict[road_key][right_lane_key]["waypoints"]
-                    if i < len(right_lane_waypoints):
-                        right_lane_waypoint_id = right_lane_waypoints[i].id
-
-                # Get left and right margins (aka markings)
-                lm = carla_map.transform_to_geolocation(lane["left_marking"][i])
-                rm = carla_map.transform_to_geolocation(lane["right_marking"][i])
-
-                # Waypoint Position
-                wl = carla_map.transform_to_geolocation(lane["waypoints"][i].transform.location)
-
-                # Waypoint Orientation
-                wo = lane["waypoints"][i].transform.rotation
-
-                # Waypoint dict
-                waypoint_dict = {
-                    "road_id": road_key,
-                    "lane_id": lane_key,
-                    "position": [wl.latitude, wl.longitude, wl.altitude],
-                    "orientation": [wo.roll, wo.pitch, wo.yaw],
-                    "left_margin_position": [lm.latitude, lm.longitude, lm.altitude],
-                    "right_margin_position": [rm.latitude, rm.longitude, rm.altitude],
-                    "next_waypoints_ids": next_ids,
-                    "left_lane_waypoint_id": left_lane_waypoint_id,
-                    "right_lane_waypoint_id": right_lane_waypoint_id
-                }
-                waypoints_graph[map_dict[road_key][lane_key]["waypoints"][i].id] = waypoint_dict
-
-    return waypoints_graph
+    if successors == 'list':
+        for road_key, lanes in roads:
+            _road_waypoints_graph(road_key, lanes, waypoints_graph)
+        return waypoints_graph
+
+    lanes_ids = dict()
+    for road_key, lanes in roads:
+        _road_waypoints_graph(road_key, lanes, waypoints_graph, lanes_ids)
+    return {"lanes": lanes_ids, "waypoints": waypoints_graph}
+
+
+def get_scene_layout(carla_map, precision=0.05, successors='range'):
+    """
+    Function to extract the full scene layout to be used as a full scene description to be
+    given to the user
+    :param precision: distance between the waypoints of a lane, in meters
+    :param successors: 'range' or 'list', how the "next_waypoints_ids" of each waypoint are given
+    :return: a dictionary describing the scene.
+        With successors='range', a dictionary with the "waypoints" by id and the "lanes", the
+        ids of the waypoints of each lane by road_id and lane_id. The "next_waypoints_ids" of a
+        waypoint are the range [start, stop] of the ids of its lane, see next_waypoints_ids.
+        With successors='list', the dictionary of the waypoints by id, where "next_waypoints_ids"
+        lists all the waypoints after each one in its lane. This was the only layout before,
+        but it takes memory quadratic in the length of the lanes.
+    """
+    return _scene_layout(iter_scene_layout(carla_map, precision), successors)
+
+
+def next_waypoints_ids(scene_layout, waypoint):
+    """
+    Returns the list of ids of the successors of a waypoint of a scene layout with successors='range'
+    :param scene_layout: dictionary returned by get_scene_layout or load_scene_layout
+    :param waypoint: dictionary of the waypoint in scene_layout["waypoints"]
+    """
+    start, stop = waypoint["next_waypoints_ids"]
+    return scene_layout["lanes"][waypoint["road_id"]][waypoint["lane_id"]][start:stop]
+
+
+def write_scene_layout(carla_map, output, precision=0.05):
+    """
+    Streams the scene layout of a map to a binary file, one road at a time. The file has a
+    header (magic, version, precision) followed by the roads, each with its road id, amount
+    of lanes and for each lane its lane id, amount of waypoints and the LaneLayout arrays,
+    little-endian. The successors and the neighbour lanes are implicit, as in LaneLayout.
+    :param output: file object opened in binary mode, or path of the file
+    :return: the amount of waypoints written
+    """
+    if not hasattr(output, 'write'):
+        with open(output, 'wb') as output_file:
+            return write_scene_layout(carla_map, output_file, precision)
+
+    output.write(_HEADER.pack(LAYOUT_MAGIC, LAYOUT_VERSION, precision))
+    count = 0
+    for road_key, lanes in iter_scene_layout(carla_map, precision):
+        output.write(_ROAD_HEADER.pack(road_key, len(lanes)))
+        for lane_key, lane in lanes.items():
+            output.write(_LANE_HEADER.pack(lane_key, len(lane)))
+            output.write(lane.ids.astype('<u8').tobytes())
+            for array in (lane.positions, lane.orientations, lane.left_margins, lane.right_margins):
+                output.write(array.astype('<f8').tobytes())
+            count += len(lane)
+    return count
+
+
+def _read_exactly(input_file, size):
+    data = input_file.read(size)
+    if len(data) != size:
+        raise ValueError('truncated scene layout file')
+    return data
+
+
+def read_scene_layout(input_file):
+    """
+    Generator of the roads of a binary scene layout written by write_scene_layout, as the
+    pairs (road_id, lanes) of iter_scene_layout
+    :param input_file: file object opened in binary mode
+    """
+    magic, version, _ = _HEADER.unpack(_read_exactly(input_file, _HEADER.size))
+    if magic != LAYOUT_MAGIC or version != LAYOUT_VERSION:
+        raise ValueError('not a scene layout file of version %d' % LAYOUT_VERSION)
+
+    while True:
+        road_header = input_file.read(_ROAD_HEADER.size)
+        if not road_header:
+            return
+        if len(road_header) != _ROAD_HEADER.size:
+            raise ValueError('truncated scene layout file')
+        road_key, lane_count = _ROAD_HEADER.unpack(road_header)
+
+        lanes = dict()
+        for _ in range(lane_count):
+            lane_key, count = _LANE_HEADER.unpack(_read_exactly(input_file, _LANE_HEADER.size))
+            ids = np.frombuffer(_read_exactly(input_file, 8 * count), dtype='<u8').astype(np.uint64)
+            arrays = [np.frombuffer(_read_exactly(input_file, 24 * count), dtype='<f8').reshape(count, 3)
+                      for _ in range(4)]
+            lanes[lane_key] = LaneLayout(road_key, lane_key, ids, *arrays)
+        yield road_key, lanes
+
+
+def load_scene_layout(input_file, successors='range'):
+    """
+    Reads a binary scene layout written by write_scene_layout into the dictionary
+    returned by get_scene_layout
+    :param input_file: file object opened in binary mode, or path of the file
+    :param successors: 'range' or 'list', see get_scene_layout
+    """
+    if not hasattr(input_file, 'read'):
+        with open(input_file, 'rb') as layout_file:
+            return load_scene_layout(layout_file, successors)
+
+    return _scene_layout(read_scene_layout(input_file), successors)
 
 
 def get_dynamic_objects(carla_world, carla_map):
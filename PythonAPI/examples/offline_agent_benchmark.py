@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Runs a fleet of navigation agents on a kinematic world built from an OpenDRIVE file,
+without a simulator, and reports the agent steps per second. The OpenDRIVE of a map can
+be saved from a running simulator with:
+
+    open('Town01.xodr', 'w').write(client.get_world().get_map().to_opendrive())
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+# ==============================================================================
+# -- Find CARLA module ---------------------------------------------------------
+# ==============================================================================
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+# ==============================================================================
+# -- Add PythonAPI for release mode --------------------------------------------
+# ==============================================================================
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+from agents.navigation.behavior_agent import BehaviorAgent  # pylint: disable=import-error
+from agents.navigation.basic_agent import BasicAgent  # pylint: disable=import-error
+from agents.navigation.fleet_controller import FleetController  # pylint: disable=import-error
+from agents.tools.kinematic_world import (  # pylint: disable=import-error
+    KinematicWorld, KinematicClient, load_opendrive_map, generate_spawn_points)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        'xodr',
+        help='OpenDRIVE file of the map')
+    argparser.add_argument(
+        '-n', '--number-of-vehicles',
+        default=30,
+        type=int,
+        help='number of vehicles (default: 30)')
+    argparser.add_argument(
+        '--steps',
+        default=1000,
+        type=int,
+        help='number of ticks (default: 1000)')
+    argparser.add_argument(
+        '--agent', type=str,
+        choices=["Behavior", "Basic"],
+        help="select which agent to run",
+        default="Behavior")
+    argparser.add_argument(
+        '-b', '--behavior', type=str,
+        choices=["cautious", "normal", "aggressive"],
+        help='Choose one of the possible agent behaviors (default: normal) ',
+        default='normal')
+    argparser.add_argument(
+        '--no-traffic-lights',
+        action='store_true',
+        help='do not add traffic lights to the junctions')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    random.seed(args.seed)
+
+    start_time = time.time()
+    world = KinematicWorld(load_opendrive_map(args.xodr))
+    if not args.no_traffic_lights:
+        world.add_junction_traffic_lights()
+    spawn_points = generate_spawn_points(world.get_map())
+    print('Map loaded in %.2f s, %d spawn points' % (time.time() - start_time, len(spawn_points)))
+
+    start_time = time.time()
+    agents = []
+    for spawn_point in random.sample(spawn_points, min(args.number_of_vehicles, len(spawn_points))):
+        vehicle = world.spawn_vehicle(spawn_point)
+        if args.agent == "Basic":
+            agent = BasicAgent(vehicle)
+        else:
+            agent = BehaviorAgent(vehicle, behavior=args.behavior)
+        agent.set_destination(random.choice(spawn_points).location)
+        agents.append(agent)
+    print('Routes planned in %.2f s' % (time.time() - start_time))
+
+    fleet = FleetController(KinematicClient(world), agents)
+    start_time = time.time()
+    for _ in range(args.steps):
+        fleet.step()
+        world.tick()
+        for agent in agents:
+            if agent.done():
+                agent.set_destination(random.choice(spawn_points).location)
+    elapsed = time.time() - start_time
+
+    stats = fleet.get_timing_stats()
+    print('%d ticks of %d agents in %.2f s: %.0f agent steps/s, %.2f ms per agent step' % (
+        args.steps, len(agents), elapsed, stats['agent_steps'] / elapsed,
+        1000.0 * stats['run_step_time_per_agent']))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('\nCancelled by user. Bye!')
@@ -0,0 +1,39 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+
+
+# PID parameters of the controllers under test
+ARGS_LATERAL = {'K_P': 1.95, 'K_I': 0.05, 'K_D': 0.2, 'dt': 0.05}
+ARGS_LONGITUDINAL = {'K_P': 1.0, 'K_I': 0.05, 'K_D': 0, 'dt': 0.05}
+
+
+class SyntheticVehicle(object):
+    """Vehicle with a synthetic state, exposing the methods used by the controllers"""
+
+    def __init__(self, location=None, yaw=0.0, speed=0.0, actor_id=0):
+        self.id = actor_id
+        self.transform = carla.Transform(carla.Location() if location is None else location,
+                                         carla.Rotation(yaw=yaw))
+        self.velocity = carla.Vector3D(x=speed)
+
+    def get_world(self):
+        return None
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return self.velocity
+
+
+class SyntheticWaypoint(object):
+    def __init__(self, location, yaw):
+        self.transform = carla.Transform(location, carla.Rotation(yaw=yaw))
@@ -0,0 +1,145 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'carla'))
+
+import carla
+import numpy as np
+
+import unittest
+
+from agents.navigation.controller import VehiclePIDController
+from agents.navigation.fleet_controller import FleetController
+
+from .synthetic_actors import ARGS_LATERAL, ARGS_LONGITUDINAL, SyntheticVehicle, SyntheticWaypoint
+
+
+class SyntheticLocalPlanner(object):
+    def __init__(self, vehicle, offset):
+        self._vehicle_controller = VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=offset)
+
+    def get_vehicle_controller(self):
+        return self._vehicle_controller
+
+    def set_vehicle_controller(self, controller):
+        self._vehicle_controller = controller
+
+
+class SyntheticWorldState(object):
+    def vehicles(self):
+        return []
+
+
+class SyntheticAgent(object):
+    """
+    Agent following a random target. Some steps overwrite the throttle and brake of the control,
+    as an emergency stop, or only one of them, and some ask the controller twice, as BehaviorAgent can.
+    """
+
+    def __init__(self, actor_id, offset, world_state):
+        self.vehicle = SyntheticVehicle(actor_id=actor_id)
+        self.local_planner = SyntheticLocalPlanner(self.vehicle, offset)
+        self.world_state = world_state
+        self.target_speed = 0.0
+        self.waypoint = None
+        self.overrides = {}
+        self.requests = 1
+        self.read_controls = []
+
+    def get_local_planner(self):
+        return self.local_planner
+
+    def get_vehicle(self):
+        return self.vehicle
+
+    def get_world_state(self):
+        return self.world_state
+
+    def done(self):
+        return False
+
+    def run_step(self):
+        for _ in range(self.requests):
+            control = self.local_planner.get_vehicle_controller().run_step(self.target_speed, self.waypoint)
+            self.read_controls.append((control.throttle, control.brake, control.steer))
+        for name, value in self.overrides.items():
+            setattr(control, name, value)
+        return control
+
+
+class SyntheticClient(object):
+    def __init__(self):
+        self.batches = []
+
+    def apply_batch(self, commands):
+        self.batches.append(commands)
+
+
+# Fields set by the agents after asking the controller
+OVERRIDES = [{}, {'throttle': 0.0, 'brake': 0.5}, {'throttle': 0.0}, {'brake': 0.3}, {'steer': 0.0}]
+
+
+def randomize(agents, rng):
+    """Sets the same random state and targets to each pair of agents"""
+    for pair in agents:
+        location = carla.Location(x=rng.uniform(-50, 50), y=rng.uniform(-50, 50))
+        yaw, speed = rng.uniform(-180, 180), rng.uniform(0, 15)
+        target = SyntheticWaypoint(carla.Location(x=rng.uniform(-50, 50), y=rng.uniform(-50, 50)),
+                                   rng.uniform(-180, 180))
+        target_speed, requests = rng.uniform(0, 50), 1 + (rng.uniform() < 0.1)
+        overrides = OVERRIDES[rng.randint(len(OVERRIDES))] if rng.uniform() < 0.4 else {}
+        for agent in pair:
+            agent.vehicle.transform = carla.Transform(location, carla.Rotation(yaw=yaw))
+            agent.vehicle.velocity = carla.Vector3D(x=speed)
+            agent.waypoint, agent.target_speed = target, target_speed
+            agent.overrides, agent.requests = overrides, requests
+
+
+class TestFleetController(unittest.TestCase):
+    def assertSameControls(self, controls, expected):
+        self.assertEqual(len(controls), len(expected))
+        for control, expected_control in zip(controls, expected):
+            self.assertEqual(control.throttle, expected_control.throttle)
+            self.assertEqual(control.brake, expected_control.brake)
+            self.assertEqual(control.steer, expected_control.steer)
+
+    def test_matches_agents_stepped_alone(self):
+        rng = np.random.RandomState(0)
+        world_state = SyntheticWorldState()
+        agents = [(SyntheticAgent(i, offset, world_state), SyntheticAgent(i, offset, world_state))
+                  for i, offset in enumerate([0.0, 0.5, -0.3, 0.0, 0.0])]
+        client = SyntheticClient()
+        fleet = FleetController(client, [fleet_agent for _, fleet_agent in agents])
+
+        for step in range(30):
+            randomize(agents, rng)
+            expected = [agent.run_step() for agent, _ in agents]
+            controls = fleet.step()
+            self.assertSameControls(controls, expected)
+            self.assertEqual([command.actor_id for command in client.batches[-1]],
+                             [fleet_agent.vehicle.id for _, fleet_agent in agents])
+
+            # Before the bank computes them, the controls read by the agents are still valid
+            for _, fleet_agent in agents:
+                for throttle, brake, steer in fleet_agent.read_controls:
+                    self.assertTrue(0.0 <= throttle <= 1.0 and 0.0 <= brake <= 1.0 and -1.0 <= steer <= 1.0)
+                fleet_agent.read_controls = []
+
+            # An agent leaving the fleet gets its controller back, and can rejoin it
+            if step == 10:
+                fleet.remove_agent(agents[1][1])
+                self.assertIsInstance(agents[1][1].get_local_planner().get_vehicle_controller(), VehiclePIDController)
+                fleet.add_agent(agents[1][1])
+                agents.append(agents.pop(1))
+
+        self.assertEqual(fleet.get_timing_stats()['agent_steps'], 30 * len(agents))
+
+
+if __name__ == '__main__':
+    unittest.main()
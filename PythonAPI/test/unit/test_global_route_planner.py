@@ -0,0 +1,69 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'carla'))
+
+import carla
+
+import unittest
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+
+from .test_kinematic_world import RING_XODR
+
+
+def two_section_ring_map():
+    """Ring road whose roads have a second lane section starting halfway"""
+    start = RING_XODR.index('            <laneSection s="0.0">')
+    section = RING_XODR[start:RING_XODR.index('        </lanes>')]
+    second_section = section.replace('laneSection s="0.0"', 'laneSection s="78.53981633974483"')
+    return carla.Map('Ring', RING_XODR.replace(section, section + second_section))
+
+
+def lane_keys(waypoints):
+    return [(waypoint.road_id, waypoint.section_id, waypoint.lane_id) for waypoint in waypoints]
+
+
+class TestGraphCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached_graph_gives_the_same_routes(self):
+        wmap = two_section_ring_map()
+        built = GlobalRoutePlanner(wmap, 2.0, cache_dir=self.cache_dir)
+        self.assertTrue(os.listdir(self.cache_dir))
+        loaded = GlobalRoutePlanner(wmap, 2.0, cache_dir=self.cache_dir)
+
+        # Waypoints at the boundary of the lane sections are rehydrated in their own section
+        for n1, n2, data in loaded._graph.edges(data=True):
+            built_data = built._graph.edges[n1, n2]
+            waypoints = [data['entry_waypoint'], data['exit_waypoint']] + data['path']
+            built_waypoints = [built_data['entry_waypoint'], built_data['exit_waypoint']] + built_data['path']
+            self.assertEqual(lane_keys(waypoints), lane_keys(built_waypoints))
+            for waypoint, built_waypoint in zip(waypoints, built_waypoints):
+                self.assertAlmostEqual(waypoint.s, built_waypoint.s, delta=1e-3)
+
+        locations = [waypoint.transform.location for waypoint in wmap.generate_waypoints(20.0)]
+        for origin in locations:
+            for destination in locations:
+                route = loaded.trace_route(origin, destination)
+                built_route = built.trace_route(origin, destination)
+                self.assertEqual(lane_keys(waypoint for waypoint, _ in route),
+                                 lane_keys(waypoint for waypoint, _ in built_route))
+                self.assertEqual([road_option for _, road_option in route],
+                                 [road_option for _, road_option in built_route])
+
+
+if __name__ == '__main__':
+    unittest.main()
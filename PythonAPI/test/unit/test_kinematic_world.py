@@ -0,0 +1,303 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'carla'))
+
+import carla
+
+import unittest
+
+from agents.navigation.basic_agent import BasicAgent
+from agents.navigation.behavior_agent import BehaviorAgent
+from agents.navigation.fleet_controller import FleetController
+from agents.tools import kinematic_world
+from agents.tools.kinematic_world import KinematicClient, KinematicWorld, generate_spawn_points
+
+
+DT = 0.05
+
+# Ring of radius 50 m made of two half circles, roads 1 and 2, each with a lane in each direction
+RING_ROAD = """
+    <road name="Road %(road)d" length="157.07963267948966" id="%(road)d" junction="-1">
+        <link>
+            <predecessor elementType="road" elementId="%(other)d" contactPoint="end"/>
+            <successor elementType="road" elementId="%(other)d" contactPoint="start"/>
+        </link>
+        <planView>
+            <geometry s="0.0" x="0.0" y="%(y)s" hdg="%(hdg)s" length="157.07963267948966">
+                <arc curvature="0.02"/>
+            </geometry>
+        </planView>
+        <lanes>
+            <laneSection s="0.0">
+                <left>
+                    <lane id="1" type="driving" level="false">
+                        <link><predecessor id="1"/><successor id="1"/></link>
+                        <width sOffset="0.0" a="3.5" b="0.0" c="0.0" d="0.0"/>
+                        <roadMark sOffset="0.0" type="solid" weight="standard" color="standard" width="0.15"
+                                  laneChange="none"/>
+                    </lane>
+                </left>
+                <center>
+                    <lane id="0" type="none" level="false">
+                        <roadMark sOffset="0.0" type="broken" weight="standard" color="standard" width="0.15"
+                                  laneChange="both"/>
+                    </lane>
+                </center>
+                <right>
+                    <lane id="-1" type="driving" level="false">
+                        <link><predecessor id="-1"/><successor id="-1"/></link>
+                        <width sOffset="0.0" a="3.5" b="0.0" c="0.0" d="0.0"/>
+                        <roadMark sOffset="0.0" type="solid" weight="standard" color="standard" width="0.15"
+                                  laneChange="none"/>
+                    </lane>
+                </right>
+            </laneSection>
+        </lanes>
+    </road>"""
+
+RING_XODR = """<?xml version="1.0" standalone="yes"?>
+<OpenDRIVE>
+    <header revMajor="1" revMinor="4" name="Ring" version="1.00"/>%s%s
+</OpenDRIVE>
+""" % (RING_ROAD % {'road': 1, 'other': 2, 'y': '-50.0', 'hdg': '0.0'},
+       RING_ROAD % {'road': 2, 'other': 1, 'y': '50.0', 'hdg': '3.141592653589793'})
+
+
+def ring_map():
+    return carla.Map('Ring', RING_XODR)
+
+
+def lane_transform(wmap, road_id, lane_id, s):
+    """Spawn transform half a meter over the waypoint of a lane at s"""
+    transform = wmap.get_waypoint_xodr(road_id, lane_id, s).transform
+    location = transform.location
+    return carla.Transform(carla.Location(location.x, location.y, location.z + 0.5), transform.rotation)
+
+
+def spawn(world, x=0.0, y=0.0, yaw=0.0, speed=0.0):
+    vehicle = world.spawn_vehicle(carla.Transform(carla.Location(x=x, y=y), carla.Rotation(yaw=yaw)))
+    vehicle.set_target_velocity(carla.Vector3D(x=speed))
+    return vehicle
+
+
+class TestStepVehicles(unittest.TestCase):
+    def test_straight_line(self):
+        world = KinematicWorld(None, DT)
+        vehicle = spawn(world, x=5.0, y=-2.0)
+        vehicle.apply_control(carla.VehicleControl(throttle=1.0))
+
+        # Trapezoidal integration of the speed, accelerating against the drag
+        x, speed = 5.0, 0.0
+        for _ in range(40):
+            world.tick()
+            new_speed = speed + (kinematic_world.DEFAULT_MAX_ACCELERATION - kinematic_world.DEFAULT_DRAG * speed) * DT
+            x += 0.5 * (speed + new_speed) * DT
+            speed = new_speed
+
+        transform = vehicle.get_transform()
+        self.assertAlmostEqual(transform.location.x, x, places=4)
+        self.assertAlmostEqual(transform.location.y, -2.0, places=4)
+        self.assertAlmostEqual(transform.rotation.yaw, 0.0)
+        self.assertAlmostEqual(vehicle.get_velocity().x, speed, places=4)
+
+    def test_braking_to_zero(self):
+        world = KinematicWorld(None, DT)
+        vehicle = spawn(world, yaw=90.0, speed=10.0)
+        vehicle.apply_control(carla.VehicleControl(brake=1.0))
+
+        speeds = []
+        for _ in range(40):
+            world.tick()
+            speeds.append(vehicle.get_velocity().y)
+        self.assertTrue(all(speed >= 0.0 for speed in speeds))
+        self.assertTrue(all(speed <= previous for previous, speed in zip(speeds, speeds[1:])))
+        self.assertEqual(speeds[-1], 0.0)
+
+        # Once stopped the vehicle stays in place
+        location = vehicle.get_location()
+        world.tick()
+        self.assertEqual(vehicle.get_location().y, location.y)
+
+    def test_hand_brake(self):
+        world = KinematicWorld(None, DT)
+        vehicle = spawn(world, speed=10.0)
+        vehicle.apply_control(carla.VehicleControl(throttle=1.0, hand_brake=True))
+        world.tick()
+        self.assertLess(vehicle.get_velocity().x, 10.0)
+
+    def test_yaw_wraparound(self):
+        world = KinematicWorld(None, DT)
+        vehicle = spawn(world, yaw=170.0, speed=10.0)
+        vehicle.apply_control(carla.VehicleControl(throttle=0.5, steer=0.2))
+
+        yaws = [170.0]
+        for _ in range(20):
+            world.tick()
+            yaws.append(vehicle.get_transform().rotation.yaw)
+        self.assertTrue(all(-180.0 <= yaw <= 180.0 for yaw in yaws))
+        self.assertLess(yaws[-1], 0.0)
+
+        # Turning left at a steady rate, the yaw only jumps when it wraps around
+        for previous, yaw in zip(yaws, yaws[1:]):
+            turn = (yaw - previous + 180.0) % 360.0 - 180.0
+            self.assertGreater(turn, 0.0)
+            self.assertLess(turn, 10.0)
+
+    def test_vehicles_are_independent(self):
+        world = KinematicWorld(None, DT)
+        moving = spawn(world, speed=10.0)
+        parked = spawn(world, x=20.0)
+        moving.apply_control(carla.VehicleControl(throttle=1.0, steer=0.1))
+        for _ in range(10):
+            world.tick()
+        self.assertGreater(moving.get_location().x, 0.0)
+        self.assertEqual(parked.get_location().x, 20.0)
+        self.assertEqual(parked.get_velocity().x, 0.0)
+
+
+class TestVehicleRows(unittest.TestCase):
+    def test_growth_keeps_the_state(self):
+        world = KinematicWorld(None, DT)
+        count = 3 * kinematic_world.INITIAL_VEHICLE_CAPACITY
+        vehicles = [spawn(world, x=float(i), speed=1.0) for i in range(count)]
+        world.tick()
+        distance = (1.0 - 0.5 * kinematic_world.DEFAULT_DRAG * DT) * DT
+        for i, vehicle in enumerate(vehicles):
+            self.assertAlmostEqual(vehicle.get_location().x, i + distance, places=4)
+
+    def test_destroyed_rows_are_reused(self):
+        world = KinematicWorld(None, DT)
+        vehicles = [spawn(world, x=float(i)) for i in range(3)]
+        vehicles[1].apply_control(carla.VehicleControl(throttle=1.0, hand_brake=True))
+        vehicles[1].destroy()
+
+        vehicle = spawn(world, x=10.0)
+        self.assertEqual(vehicle.row, vehicles[1].row)
+        self.assertEqual(world._vehicle_rows, 3)
+        self.assertEqual(len(world.get_actors()), 3)
+
+        # The new vehicle starts at rest, without the controls of the destroyed one
+        world.tick()
+        self.assertEqual(vehicle.get_location().x, 10.0)
+        self.assertEqual(vehicle.get_velocity().x, 0.0)
+        with self.assertRaises(RuntimeError):
+            vehicles[1].apply_control(carla.VehicleControl(throttle=1.0))
+
+
+class TestKinematicTrafficLight(unittest.TestCase):
+    def test_phases_alternate(self):
+        world = KinematicWorld(ring_map(), DT)
+        waypoint = world.get_map().get_waypoint_xodr(1, -1, 10.0)
+        first = world.add_traffic_light(waypoint, phase=0, green_time=1.0, yellow_time=0.5)
+        second = world.add_traffic_light(waypoint, phase=1, green_time=1.0, yellow_time=0.5)
+
+        states = []
+        for _ in range(int(round(6.0 / DT))):
+            states.append((first.get_state(), second.get_state()))
+            world.tick()
+
+        # At any time exactly one of the lights lets the traffic go
+        for state in states:
+            self.assertEqual(sum(light_state != carla.TrafficLightState.Red for light_state in state), 1)
+
+        # Each light cycles green, yellow and red, every 3 seconds
+        def cycles(light_states):
+            changes = [light_states[0]]
+            for light_state in light_states[1:]:
+                if light_state != changes[-1]:
+                    changes.append(light_state)
+            return changes
+
+        green, yellow, red = (carla.TrafficLightState.Green, carla.TrafficLightState.Yellow,
+                              carla.TrafficLightState.Red)
+        self.assertEqual(cycles([state[0] for state in states]), [green, yellow, red, green, yellow, red])
+        self.assertEqual(cycles([state[1] for state in states]), [red, green, yellow, red, green, yellow])
+
+    def test_frozen_state(self):
+        world = KinematicWorld(ring_map(), DT)
+        traffic_light = world.add_traffic_light(world.get_map().get_waypoint_xodr(1, -1, 10.0))
+        traffic_light.set_state(carla.TrafficLightState.Red)
+        for _ in range(10):
+            world.tick()
+            self.assertEqual(traffic_light.get_state(), carla.TrafficLightState.Red)
+
+
+
+class TestAgentsOnKinematicWorld(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.map = ring_map()
+
+    def drive(self, world, agent, vehicle, ticks=1500):
+        for _ in range(ticks):
+            if agent.done():
+                break
+            vehicle.apply_control(agent.run_step())
+            world.tick()
+
+    def test_agents_reach_their_destination(self):
+        destination = self.map.get_waypoint_xodr(2, -1, 30.0).transform.location
+        for make_agent in (BasicAgent, BehaviorAgent):
+            world = KinematicWorld(self.map, DT)
+            vehicle = world.spawn_vehicle(lane_transform(self.map, 1, -1, 5.0))
+            agent = make_agent(vehicle)
+            agent.set_destination(destination)
+
+            self.drive(world, agent, vehicle)
+            self.assertTrue(agent.done())
+            self.assertLess(vehicle.get_location().distance(destination), 5.0)
+            waypoint = self.map.get_waypoint(vehicle.get_location())
+            self.assertEqual((waypoint.road_id, waypoint.lane_id), (2, -1))
+
+    def test_worlds_do_not_share_caches(self):
+        # The agents keep caches by world id, which would show the vehicles of the first world in the second
+        destination = self.map.get_waypoint_xodr(2, -1, 30.0).transform.location
+        blocked_world = KinematicWorld(self.map, DT)
+        blocked = blocked_world.spawn_vehicle(lane_transform(self.map, 1, -1, 5.0))
+        parked = blocked_world.spawn_vehicle(lane_transform(self.map, 1, -1, 60.0))
+        blocked_agent = BasicAgent(blocked)
+        blocked_agent.set_destination(destination)
+        self.drive(blocked_world, blocked_agent, blocked)
+        self.assertFalse(blocked_agent.done())
+        self.assertEqual(blocked.get_velocity().length(), 0.0)
+        self.assertLess(blocked.get_location().distance(parked.get_location()), 15.0)
+
+        free_world = KinematicWorld(self.map, DT)
+        self.assertNotEqual(free_world.id, blocked_world.id)
+        free = free_world.spawn_vehicle(lane_transform(self.map, 1, -1, 5.0))
+        free_agent = BasicAgent(free)
+        free_agent.set_destination(destination)
+        self.drive(free_world, free_agent, free)
+        self.assertTrue(free_agent.done())
+
+    def test_fleet_throughput(self):
+        world = KinematicWorld(self.map, DT)
+        spawn_points = generate_spawn_points(self.map, 10.0)
+        agents = []
+        for i, spawn_point in enumerate(spawn_points[::2]):
+            agent = BehaviorAgent(world.spawn_vehicle(spawn_point))
+            agent.set_destination(spawn_points[(2 * i + 10) % len(spawn_points)].location)
+            agents.append(agent)
+        fleet = FleetController(KinematicClient(world), agents)
+
+        start_time = time.time()
+        for _ in range(100):
+            fleet.step()
+            world.tick()
+        elapsed = time.time() - start_time
+
+        # Well under the agent steps per second of a typical machine, to only catch gross regressions
+        self.assertEqual(fleet.get_timing_stats()['agent_steps'], 100 * len(agents))
+        self.assertGreater(100 * len(agents) / elapsed, 500.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
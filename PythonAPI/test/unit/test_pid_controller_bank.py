@@ -0,0 +1,118 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'carla'))
+
+import carla
+import numpy as np
+
+import unittest
+
+from agents.navigation.controller import PIDControllerBank, VehiclePIDController
+
+from .synthetic_actors import ARGS_LATERAL, ARGS_LONGITUDINAL, SyntheticVehicle, SyntheticWaypoint
+
+
+def random_state(rng):
+    vehicle = SyntheticVehicle(carla.Location(x=rng.uniform(-50, 50), y=rng.uniform(-50, 50)),
+                               rng.uniform(-180, 180), rng.uniform(0, 15))
+    waypoint = SyntheticWaypoint(carla.Location(x=rng.uniform(-50, 50), y=rng.uniform(-50, 50)),
+                                 rng.uniform(-180, 180))
+    return vehicle, waypoint
+
+
+class TestPIDControllerBank(unittest.TestCase):
+    def assertSameControls(self, controls, expected):
+        for control, expected_control in zip(controls, expected):
+            self.assertEqual(control.throttle, expected_control.throttle)
+            self.assertEqual(control.brake, expected_control.brake)
+            self.assertEqual(control.steer, expected_control.steer)
+
+    def test_matches_vehicle_controllers(self):
+        rng = np.random.RandomState(0)
+        size = 20
+        offsets = rng.uniform(-1, 1, size) * (rng.uniform(size=size) < 0.5)
+        vehicles = [random_state(rng)[0] for _ in range(size)]
+        controllers = [VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=offset)
+                       for vehicle, offset in zip(vehicles, offsets)]
+        bank = PIDControllerBank(size, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=offsets)
+
+        # More steps than the size of the error buffers
+        for _ in range(25):
+            states = [random_state(rng) for _ in range(size)]
+            for vehicle, (new_vehicle, _) in zip(vehicles, states):
+                vehicle.transform, vehicle.velocity = new_vehicle.transform, new_vehicle.velocity
+            waypoints = [waypoint for _, waypoint in states]
+            target_speeds = rng.uniform(0, 50, size)
+
+            expected = [controller.run_step(target_speed, waypoint)
+                        for controller, target_speed, waypoint in zip(controllers, target_speeds, waypoints)]
+            self.assertSameControls(bank.run_step_controls(vehicles, target_speeds, waypoints), expected)
+
+    def test_load_and_store_controller(self):
+        rng = np.random.RandomState(2)
+        vehicle, waypoint = random_state(rng)
+        controller = VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=0.5, max_throttle=0.6)
+        follower = VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=0.5, max_throttle=0.6)
+        for _ in range(5):
+            controller.run_step(rng.uniform(0, 50), waypoint)
+
+        # The bank continues the control of the vehicle, then gives it back
+        bank = PIDControllerBank(3, {}, {})
+        bank.load_controller(1, controller)
+        for _ in range(12):
+            vehicle.transform, waypoint = random_state(rng)[0].transform, random_state(rng)[1]
+            target_speed = rng.uniform(0, 50)
+            self.assertSameControls(bank.run_step_controls([vehicle], [target_speed], [waypoint], [1]),
+                                    [controller.run_step(target_speed, waypoint)])
+        bank.store_controller(1, follower)
+        for _ in range(5):
+            target_speed = rng.uniform(0, 50)
+            self.assertSameControls([follower.run_step(target_speed, waypoint)],
+                                    [controller.run_step(target_speed, waypoint)])
+
+    def test_resize(self):
+        bank = PIDControllerBank(2, ARGS_LATERAL, ARGS_LONGITUDINAL, max_throttle=0.5)
+        bank.run_step([10.0, 10.0], [0.0, 0.0], [[0, 0], [0, 0]], [[1, 0], [1, 0]], [[5, 0], [5, 0]])
+        bank.resize(4)
+        self.assertEqual(bank.max_throt.tolist(), [0.5, 0.5, 0.75, 0.75])
+        throttle, _, _ = bank.run_step([10.0] * 4, [0.0] * 4, np.zeros((4, 2)), [[1, 0]] * 4, [[5, 0]] * 4)
+        # The new vehicles have no error history, nor the gains of the others
+        self.assertEqual(throttle.tolist()[2:], [0.75, 0.75])
+        self.assertEqual(throttle.tolist()[:2], [0.5, 0.5])
+
+    def test_subset_of_vehicles(self):
+        rng = np.random.RandomState(1)
+        bank = PIDControllerBank(4, ARGS_LATERAL, ARGS_LONGITUDINAL)
+        single = PIDControllerBank(1, ARGS_LATERAL, ARGS_LONGITUDINAL)
+
+        for step in range(15):
+            target_speeds = rng.uniform(0, 50, 2)
+            current_speeds = rng.uniform(0, 50, 2)
+            locations = rng.uniform(-10, 10, (2, 2))
+            forward_vectors = rng.uniform(-1, 1, (2, 2))
+            targets = rng.uniform(-10, 10, (2, 2))
+
+            # Vehicle 2 is stepped along with others, the single bank steps it alone
+            indices = [2, step % 2]
+            outputs = bank.run_step(target_speeds, current_speeds, locations, forward_vectors, targets, indices)
+            single_outputs = single.run_step(target_speeds[:1], current_speeds[:1], locations[:1],
+                                             forward_vectors[:1], targets[:1])
+            for output, single_output in zip(outputs, single_outputs):
+                self.assertEqual(output[0], single_output[0])
+
+    def test_limits(self):
+        bank = PIDControllerBank(2, ARGS_LATERAL, ARGS_LONGITUDINAL, max_throttle=0.5, max_brake=0.2,
+                                 max_steering=[0.8, 0.05])
+        throttle, brake, steer = bank.run_step([100.0, 0.0], [0.0, 100.0], [[0, 0], [0, 0]],
+                                               [[1, 0], [1, 0]], [[0, 10], [0, 10]])
+        self.assertEqual(throttle.tolist(), [0.5, 0.0])
+        self.assertEqual(brake.tolist(), [0.0, 0.2])
+        # The steering can't change more than 0.1 per step, nor go over the maximum
+        self.assertEqual(steer.tolist(), [0.1, 0.05])
@@ -0,0 +1,155 @@
+""" Log binario de los transforms de los actores de cada frame, para regenerar las labels sin el simulador
+
+Por cada frame capturado se guarda un registro (frames.bin) con el transform del vehiculo con los sensores
+y las matrices de la camara y el lidar en world-3D, y un registro por npc (actors.bin) con su id, transform
+y bounding box. Ambos archivos solo se escriben al final y se leen con numpy.memmap. En meta.json se guardan
+los datos de la captura que no cambian por frame (tamaño de la imagen, matriz K de la camara con todos sus
+digitos y archivo del recorder del simulador).
+"""
+
+import os
+import json
+import threading
+import numpy as np
+
+FRAMES_FILE = "frames.bin"
+ACTORS_FILE = "actors.bin"
+META_FILE = "meta.json"
+
+#Registro por frame, actor_offset y actor_count en cantidad de registros de actors.bin
+FRAME_DTYPE = np.dtype([('frame', '<i8'),
+                        ('ego_location', '<f8', (3,)),
+                        ('ego_rotation', '<f8', (3,)),
+                        ('world_2_camera', '<f8', (4, 4)),
+                        ('lidar_2_world', '<f8', (4, 4)),
+                        ('actor_offset', '<u8'),
+                        ('actor_count', '<u4')])
+
+#Registro por npc, rotation es (pitch, yaw, roll) igual que en get_actors_arrays
+ACTOR_DTYPE = np.dtype([('id', '<u4'),
+                        ('location', '<f8', (3,)),
+                        ('rotation', '<f8', (3,)),
+                        ('extent', '<f8', (3,)),
+                        ('bb_location', '<f8', (3,))])
+
+
+class ActorLogWriter:
+    """ Agrega al log los transforms de cada frame, creandolo si no existe """
+
+    def __init__(self, path, image_w=None, image_h=None, recorder_file=None, K=None):
+        self._path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, META_FILE), 'w') as file:
+            #json guarda los float64 de K sin perder precision, a diferencia del archivo de calibracion
+            json.dump({'image_w': image_w, 'image_h': image_h, 'recorder_file': recorder_file,
+                       'K': None if K is None else np.asarray(K, dtype=np.float64).tolist()}, file)
+
+        #Se continua un log existente
+        self._frames = set(_read_records(os.path.join(path, FRAMES_FILE), FRAME_DTYPE)['frame'].tolist())
+        self._actors_file = open(os.path.join(path, ACTORS_FILE), 'ab')
+        self._frames_file = open(os.path.join(path, FRAMES_FILE), 'ab')
+        self._actor_offset = self._actors_file.tell() // ACTOR_DTYPE.itemsize
+
+    def write(self, frame, ego_location, ego_rotation, world_2_camera, lidar_2_world,
+              actor_ids, locations, rotations, extents, bb_locations):
+        """ Agrega el frame, los arrays de los npcs son (N,3) como los devuelve get_actors_arrays """
+
+        actors = np.empty(len(actor_ids), dtype=ACTOR_DTYPE)
+        actors['id'] = actor_ids
+        actors['location'] = np.reshape(locations, (-1, 3))
+        actors['rotation'] = np.reshape(rotations, (-1, 3))
+        actors['extent'] = np.reshape(extents, (-1, 3))
+        actors['bb_location'] = np.reshape(bb_locations, (-1, 3))
+
+        with self._lock:
+            assert frame not in self._frames, "El frame {} ya esta en el log".format(frame)
+
+            self._actors_file.write(actors.tobytes())
+            self._actors_file.flush()
+
+            #El registro del frame se escribe despues de los actores, nunca apunta a datos incompletos
+            record = np.array([(frame, ego_location, ego_rotation, world_2_camera, lidar_2_world,
+                                self._actor_offset, len(actors))], dtype=FRAME_DTYPE)
+            self._frames_file.write(record.tobytes())
+            self._frames_file.flush()
+
+            self._actor_offset += len(actors)
+            self._frames.add(frame)
+
+    def close(self):
+        with self._lock:
+            self._actors_file.close()
+            self._frames_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ActorLogReader:
+    """ Acceso aleatorio por frame al log de actores
+
+        Cada frame se devuelve como un diccionario con los campos de FRAME_DTYPE y los arrays (N,3)
+        de los npcs (ids, locations, rotations, extents, bb_locations), listos para compute_labels.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._frames = _read_records(os.path.join(path, FRAMES_FILE), FRAME_DTYPE)
+        self._frame_to_record = {int(frame): i for i, frame in enumerate(self._frames['frame'])}
+
+        actors_path = os.path.join(path, ACTORS_FILE)
+        if os.path.getsize(actors_path) >= ACTOR_DTYPE.itemsize:
+            self._actors = np.memmap(actors_path, dtype=ACTOR_DTYPE, mode='r',
+                                     shape=(os.path.getsize(actors_path) // ACTOR_DTYPE.itemsize,))
+        else:
+            self._actors = np.empty(0, dtype=ACTOR_DTYPE)
+
+        with open(os.path.join(path, META_FILE)) as file:
+            self.meta = json.load(file)
+
+    def frames(self):
+        """ Frames del log, en el orden en que se agregaron """
+
+        return self._frames['frame'].tolist()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, frame):
+        return frame in self._frame_to_record
+
+    def __getitem__(self, frame):
+        record = self._frames[self._frame_to_record[frame]]
+        offset, count = int(record['actor_offset']), int(record['actor_count'])
+        actors = self._actors[offset:offset + count]
+
+        return {'frame': int(record['frame']),
+                'ego_location': record['ego_location'],
+                'ego_rotation': record['ego_rotation'],
+                'world_2_camera': record['world_2_camera'],
+                'lidar_2_world': record['lidar_2_world'],
+                'ids': actors['id'],
+                'locations': actors['location'],
+                'rotations': actors['rotation'],
+                'extents': actors['extent'],
+                'bb_locations': actors['bb_location']}
+
+    def __iter__(self):
+        for frame in self.frames():
+            yield self[frame]
+
+
+def _read_records(path, dtype):
+    #Se ignora un registro final incompleto (escritura interrumpida)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=dtype)
+
+    data = np.fromfile(path, dtype=np.uint8)
+    complete = (data.size // dtype.itemsize) * dtype.itemsize
+
+    return data[:complete].view(dtype)
@@ -0,0 +1,88 @@
+import logging
+import threading
+from queue import Queue
+
+#Cantidad de hilos escritores y tamaño maximo de la cola por defecto
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_MAX_QUEUE_SIZE = 32
+
+
+class AsyncWriter:
+    """ Pool de hilos que escribe los datos de los sensores a disco en segundo plano
+
+        El loop de simulacion encola los trabajos de escritura (funcion + argumentos) con submit(),
+        y los hilos los ejecutan en paralelo. La cola es acotada: si se llena, submit() bloquea hasta
+        que se libere lugar (backpressure), para no acumular frames en memoria sin limite.
+        Los hilos de I/O liberan el GIL mientras codifican y escriben, por lo que no hace falta usar procesos.
+    """
+
+    def __init__(self, num_workers=DEFAULT_NUM_WORKERS, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        assert num_workers > 0, "Debe haber al menos un hilo escritor"
+
+        self._queue = Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.errors = 0
+
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name='AsyncWriter-%d' % i, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, write_function, *args):
+        """ Encola un trabajo de escritura, bloquea si la cola esta llena """
+
+        assert not self._closed, "No se pueden encolar trabajos en un AsyncWriter cerrado"
+        self._queue.put((write_function, args))
+
+    def pending(self):
+        """ Cantidad aproximada de trabajos en cola """
+
+        return self._queue.qsize()
+
+    def flush(self):
+        """ Bloquea hasta que se hayan escrito todos los trabajos encolados """
+
+        self._queue.join()
+
+    def close(self):
+        """ Escribe los trabajos pendientes y detiene los hilos """
+
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+
+        #Un None por hilo para que cada uno termine su loop
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+
+                write_function, args = job
+                try:
+                    write_function(*args)
+                except Exception:
+                    logging.exception('Error al escribir datos del sensor')
+                    with self._lock:
+                        self.errors += 1
+                else:
+                    with self._lock:
+                        self.written += 1
+            finally:
+                self._queue.task_done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+
+#Cambio de ejes de UE4 (x adelante, y derecha, z arriba) al standard de camara (x derecha, y abajo, z adelante)
+#(x, y ,z) -> (y, -z, x), igual que en w3D_to_cam3D
+UE4_TO_CAMERA = np.array([[0.0, 1.0, 0.0, 0.0],
+                          [0.0, 0.0, -1.0, 0.0],
+                          [1.0, 0.0, 0.0, 0.0],
+                          [0.0, 0.0, 0.0, 1.0]])
+
+#Orden de las matrices en el archivo de calibracion de KITTI
+CALIB_KEYS = ['P0', 'P1', 'P2', 'P3', 'R0_rect', 'Tr_velo_to_cam', 'Tr_imu_to_velo']
+
+
+def build_calib(K, camera_to_vehicle, lidar_to_vehicle):
+    """ Calcula las matrices de calibracion de KITTI a partir de la matriz K de la camara y de los transforms
+        de montaje (4x4, transform.get_matrix()) de la camara y el lidar respecto al vehiculo
+
+        Tr_velo_to_cam lleva los puntos tal como los guarda save_pointcloud (coordenadas del lidar)
+        a coordenadas de camara. La camara no esta rectificada, por lo que R0_rect es la identidad.
+    """
+
+    #Proyeccion de la camara izquierda a color (P2), se repite para las demas camaras
+    P = np.hstack([np.asarray(K, dtype=np.float64), np.zeros((3, 1))])
+
+    lidar_to_camera = np.linalg.inv(np.asarray(camera_to_vehicle, dtype=np.float64)) @ \
+                      np.asarray(lidar_to_vehicle, dtype=np.float64)
+    Tr_velo_to_cam = (UE4_TO_CAMERA @ lidar_to_camera)[:3, :]
+
+    return {'P0': P, 'P1': P, 'P2': P, 'P3': P,
+            'R0_rect': np.identity(3),
+            'Tr_velo_to_cam': Tr_velo_to_cam,
+            'Tr_imu_to_velo': np.hstack([np.identity(3), np.zeros((3, 1))])}
+
+def calib_to_text(calib):
+    """ Genera el contenido del archivo de calibracion de KITTI """
+
+    return "".join("{}: {}\n".format(key, " ".join("%.12e" % value for value in calib[key].reshape(-1)))
+                   for key in CALIB_KEYS)
+
+
+class CalibWriter:
+    """ Escribe el archivo de calibracion de cada frame
+
+        Las matrices se calculan una vez por configuracion de sensores (set_rig). El primer frame de cada
+        configuracion se escribe completo y los siguientes son symlinks a ese archivo; si el sistema no
+        permite symlinks se escribe el archivo completo.
+    """
+
+    def __init__(self, calib_path):
+        self._calib_path = calib_path
+        self._text = None
+        self._source = None
+        self._use_symlinks = True
+
+    def set_rig(self, K, camera_to_vehicle, lidar_to_vehicle):
+        """ Actualiza la calibracion, solo se vuelve a escribir un archivo completo si las matrices cambian """
+
+        text = calib_to_text(build_calib(K, camera_to_vehicle, lidar_to_vehicle))
+        if text != self._text:
+            self._text = text
+            self._source = None
+
+    def write(self, frame):
+        assert self._text is not None, "Se debe llamar a set_rig antes de escribir la calibracion"
+
+        file_name = '%.6d.txt' % frame
+        file_path = os.path.join(self._calib_path, file_name)
+
+        if self._source is not None and self._use_symlinks:
+            try:
+                os.symlink(self._source, file_path)
+                return
+            except OSError:
+                self._use_symlinks = False
+
+        with open(file_path, 'w') as file:
+            file.write(self._text)
+        if self._source is None:
+            self._source = file_name
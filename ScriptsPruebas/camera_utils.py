@@ -41,6 +41,46 @@ def w3D_to_cam2D(loc, K, w2c):
 
         return point_img[0:2]
 
+def w3D_to_cam3D_array(points, w2c):
+    """ Version vectorizada de w3D_to_cam3D: transforma N puntos world-3D (N,3) a camara-3D (N,3) con un solo producto matricial
+
+        Acepta arrays (N,4) como los de la nube de puntos (se ignora la cuarta columna).
+        Conserva el dtype de entrada, un array float32 no se copia a float64.
+    """
+
+    points = np.asarray(points)
+    if points.dtype != np.float32:
+        points = points.astype(np.float64, copy=False)
+
+    # Se combinan la transformacion world-3D->camara-3D y el cambio de ejes (x, y ,z) -> (y, -z, x) en una matriz 3x4
+    w2c = np.asarray(w2c, dtype=points.dtype)
+    M = np.stack([w2c[1], -w2c[2], w2c[0]])
+
+    return points[..., :3] @ M[:, :3].T + M[:, 3]
+
+def cam3D_to_cam2D_array(points_camera, K):
+    """ Proyecta N puntos en camara-3D (N,3) a la imagen (N,2) utilizando la matriz K """
+
+    points_camera = np.asarray(points_camera)
+    point_img = points_camera @ np.asarray(K, dtype=points_camera.dtype).T
+
+    # Normalizar, los puntos con profundidad 0 quedan en inf/nan (se descartan con depth_mask)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return point_img[..., 0:2] / point_img[..., 2:3]
+
+def w3D_to_cam2D_array(points, K, w2c):
+    """ Version vectorizada de w3D_to_cam2D: transforma N puntos world-3D (N,3) a camara-2D (N,2) """
+
+    return cam3D_to_cam2D_array(w3D_to_cam3D_array(points, w2c), K)
+
+def depth_mask(points_camera, min_depth=0.0):
+    """ Mascara (N,) de los puntos en camara-3D que estan delante de la camara (profundidad mayor a min_depth)
+
+        Los puntos detras de la camara se proyectan invertidos en la imagen, por lo que deben descartarse
+    """
+
+    return np.asarray(points_camera)[..., 2] > min_depth
+
 def bbox_in_image(bbox_2D,image_w,image_h):
 
     #Corregir la bbox2d para que este completamente dentro de la imagen
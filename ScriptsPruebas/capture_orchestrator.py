@@ -0,0 +1,281 @@
+""" Lanza varias capturas en paralelo, cada una contra su propio servidor de CARLA, y une los resultados
+en un unico dataset en formato KITTI con ids de frame unicos
+
+Cada worker es un proceso que ejecuta el script de captura (por defecto carla_boxes_test.py) con su propio
+host/puerto, puerto de traffic manager, semilla, mapa y cantidad de frames, y escribe en su propio directorio.
+Al terminar todos, se renumeran los frames de cada worker de forma consecutiva en el dataset final
+y se informa el throughput de cada worker y el total.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+from pointcloud_store import INDEX_FILE, PointCloudReader, PointCloudWriter
+from actor_log import FRAMES_FILE, ActorLogReader, ActorLogWriter
+
+OUTPUT_FOLDER = "training"
+IMAGES_FOLDER = "image_2"
+POINTCLOUDS_FOLDER = "velodyne"
+LABELS_FOLDER = "label_2"
+CALIB_FOLDER = "calib"
+ACTOR_LOG_FOLDER = "actor_log"
+STATS_FILE = "stats.json"
+
+#Archivo con la correspondencia entre el id final de cada frame y su worker y frame original
+FRAME_MAP_FILE = "frame_map.txt"
+
+#Extension de los archivos de cada directorio del dataset
+DATASET_FOLDERS = [(IMAGES_FOLDER, '.png'), (POINTCLOUDS_FOLDER, '.bin'),
+                   (LABELS_FOLDER, '.txt'), (CALIB_FOLDER, '.txt')]
+
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'carla_boxes_test.py')
+
+
+def build_worker_configs(arg):
+    """ Configuracion (host, puertos, semilla, mapa, frames y directorio) de cada worker """
+
+    hosts = arg.hosts.split(',')
+    towns = arg.towns.split(',') if arg.towns else [None]
+
+    configs = []
+    for i in range(arg.workers):
+        configs.append({
+            'id': i,
+            'host': hosts[i % len(hosts)],
+            'port': arg.port + i * arg.port_step,
+            'tm_port': arg.tm_port + i,
+            'seed': arg.seed + i,
+            'town': towns[i % len(towns)],
+            'frames': arg.frames,
+            'output': os.path.abspath(os.path.join(arg.output, 'worker_%02d' % i))})
+
+    return configs
+
+def worker_command(config, script, extra_args):
+    """ Linea de comandos del proceso de captura de un worker """
+
+    command = [sys.executable, script,
+               '--host', config['host'],
+               '--port', str(config['port']),
+               '--tm-port', str(config['tm_port']),
+               '--seed', str(config['seed']),
+               '--frames', str(config['frames']),
+               '--output', config['output']]
+    if config['town'] is not None:
+        command += ['--town', config['town']]
+
+    return command + list(extra_args)
+
+def run_workers(configs, script, extra_args=()):
+    """ Lanza todos los workers y espera a que terminen, devuelve el codigo de salida de cada uno """
+
+    processes = []
+    for config in configs:
+        os.makedirs(config['output'], exist_ok=True)
+        log = open(os.path.join(config['output'], 'capture.log'), 'w')
+        #Se ejecuta en el directorio del script, ya que usa paths relativos
+        process = subprocess.Popen(worker_command(config, script, extra_args), stdout=log, stderr=subprocess.STDOUT,
+                                   cwd=os.path.dirname(os.path.abspath(script)))
+        processes.append((process, log))
+
+    return_codes = []
+    for process, log in processes:
+        return_codes.append(process.wait())
+        log.close()
+
+    return return_codes
+
+def _frames_in(folder, extension):
+    #frames (ids) de los archivos de un directorio
+    if not os.path.isdir(folder):
+        return []
+    names = [os.path.splitext(name) for name in os.listdir(folder)]
+    return [int(name) for name, ext in names if ext == extension and name.isdigit()]
+
+def worker_frames(worker_directory):
+    """ Frames capturados por un worker, los de sus labels o en su defecto los de sus nubes de puntos """
+
+    training = os.path.join(worker_directory, OUTPUT_FOLDER)
+    pointclouds = os.path.join(training, POINTCLOUDS_FOLDER)
+
+    frames = set(_frames_in(os.path.join(training, LABELS_FOLDER), '.txt'))
+    frames |= set(_frames_in(pointclouds, '.bin'))
+    if os.path.exists(os.path.join(pointclouds, INDEX_FILE)):
+        frames |= set(PointCloudReader(pointclouds).frames())
+
+    return sorted(frames)
+
+def merge_outputs(worker_directories, output_directory):
+    """ Une las capturas de los workers en un unico dataset, renumerando los frames de forma consecutiva
+
+        Los archivos se mueven (no se copian). Los symlinks de calib se recrean apuntando al nuevo nombre,
+        y las nubes de puntos en formato contenedor y los logs de actores se agregan a un unico contenedor y log.
+        Devuelve la lista de (id final, directorio del worker, frame original).
+    """
+
+    training = os.path.join(output_directory, OUTPUT_FOLDER)
+    for folder, _ in DATASET_FOLDERS:
+        os.makedirs(os.path.join(training, folder), exist_ok=True)
+
+    frame_map = []
+    pointcloud_store = None
+    actor_log = None
+    next_id = 0
+
+    for worker_directory in worker_directories:
+        worker_training = os.path.join(worker_directory, OUTPUT_FOLDER)
+        frames = worker_frames(worker_directory)
+        new_ids = {frame: next_id + i for i, frame in enumerate(frames)}
+        next_id += len(frames)
+
+        for folder, extension in DATASET_FOLDERS:
+            for frame, new_id in new_ids.items():
+                src = os.path.join(worker_training, folder, '%.6d%s' % (frame, extension))
+                dst = os.path.join(training, folder, '%.6d%s' % (new_id, extension))
+                if os.path.islink(src):
+                    #calib: symlink al archivo de otro frame del mismo worker
+                    target_frame = int(os.path.splitext(os.path.basename(os.readlink(src)))[0])
+                    os.symlink('%.6d%s' % (new_ids[target_frame], extension), dst)
+                    os.remove(src)
+                elif os.path.exists(src):
+                    shutil.move(src, dst)
+
+        worker_pointclouds = os.path.join(worker_training, POINTCLOUDS_FOLDER)
+        if os.path.exists(os.path.join(worker_pointclouds, INDEX_FILE)):
+            if pointcloud_store is None:
+                pointcloud_store = PointCloudWriter(os.path.join(training, POINTCLOUDS_FOLDER))
+            for frame, points in PointCloudReader(worker_pointclouds):
+                pointcloud_store.append(new_ids[frame], points)
+
+        worker_actor_log = os.path.join(worker_training, ACTOR_LOG_FOLDER)
+        if os.path.exists(os.path.join(worker_actor_log, FRAMES_FILE)):
+            reader = ActorLogReader(worker_actor_log)
+            if actor_log is None:
+                #El archivo del recorder es de cada worker, queda en su log original
+                actor_log = ActorLogWriter(os.path.join(training, ACTOR_LOG_FOLDER),
+                                           reader.meta['image_w'], reader.meta['image_h'], K=reader.meta.get('K'))
+            for actors in reader:
+                if actors['frame'] in new_ids:
+                    actor_log.write(new_ids[actors['frame']], actors['ego_location'], actors['ego_rotation'],
+                                    actors['world_2_camera'], actors['lidar_2_world'], actors['ids'],
+                                    actors['locations'], actors['rotations'], actors['extents'], actors['bb_locations'])
+
+        frame_map += [(new_ids[frame], worker_directory, frame) for frame in frames]
+
+    if pointcloud_store is not None:
+        pointcloud_store.close()
+    if actor_log is not None:
+        actor_log.close()
+
+    with open(os.path.join(output_directory, FRAME_MAP_FILE), 'w') as file:
+        file.write("".join("%.6d %s %d\n" % row for row in frame_map))
+
+    return frame_map
+
+def collect_stats(worker_directories, wall_time):
+    """ Estadisticas de cada worker (de su stats.json) y el throughput total """
+
+    workers = []
+    for worker_directory in worker_directories:
+        stats_path = os.path.join(worker_directory, STATS_FILE)
+        if os.path.exists(stats_path):
+            with open(stats_path) as file:
+                workers.append(json.load(file))
+        else:
+            workers.append(None)
+
+    total_frames = sum(stats['frames'] for stats in workers if stats is not None)
+
+    return {'workers': workers,
+            'frames': total_frames,
+            'wall_time': wall_time,
+            'fps': total_frames / wall_time if wall_time > 0 else 0.0}
+
+def main(arg, extra_args):
+    configs = build_worker_configs(arg)
+    worker_directories = [config['output'] for config in configs]
+
+    start_time = time.time()
+    return_codes = run_workers(configs, arg.script, extra_args)
+    wall_time = time.time() - start_time
+
+    for config, return_code in zip(configs, return_codes):
+        if return_code != 0:
+            print('worker %d (%s:%d) termino con codigo %d, ver %s' % (
+                config['id'], config['host'], config['port'], return_code,
+                os.path.join(config['output'], 'capture.log')))
+
+    frame_map = merge_outputs(worker_directories, arg.output)
+    stats = collect_stats(worker_directories, wall_time)
+    with open(os.path.join(arg.output, STATS_FILE), 'w') as file:
+        json.dump(stats, file, indent=2)
+
+    for config, worker_stats in zip(configs, stats['workers']):
+        if worker_stats is not None:
+            print('worker %d (%s:%d): %d frames en %.1f s, %.2f frames/s' % (
+                config['id'], config['host'], config['port'],
+                worker_stats['frames'], worker_stats['elapsed'], worker_stats['fps']))
+    print('total: %d frames en %.1f s, %.2f frames/s' % (len(frame_map), wall_time, stats['fps']))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '-n', '--workers',
+        default=2,
+        type=int,
+        help='cantidad de capturas en paralelo, default: 2')
+    argparser.add_argument(
+        '--hosts',
+        default='localhost',
+        help='IPs de los servidores separadas por coma, se asignan en ronda a los workers, default: localhost')
+    argparser.add_argument(
+        '-p', '--port',
+        default=2000,
+        type=int,
+        help='puerto TCP del servidor del primer worker, default: 2000')
+    argparser.add_argument(
+        '--port-step',
+        default=2,
+        type=int,
+        help='separacion entre los puertos de los servidores (cada servidor usa port y port+1), default: 2')
+    argparser.add_argument(
+        '--tm-port',
+        default=8000,
+        type=int,
+        help='puerto del traffic manager del primer worker, default: 8000')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=0,
+        type=int,
+        help='semilla del primer worker, los demas usan seed+i, default: 0')
+    argparser.add_argument(
+        '-t', '--towns',
+        default=None,
+        help='mapas separados por coma, se asignan en ronda a los workers, default: el mapa actual de cada servidor')
+    argparser.add_argument(
+        '-f', '--frames',
+        default=10,
+        type=int,
+        help='cantidad de frames a capturar por worker, default: 10')
+    argparser.add_argument(
+        '-o', '--output',
+        required=True,
+        help='directorio del dataset final')
+    argparser.add_argument(
+        '--script',
+        default=DEFAULT_SCRIPT,
+        help='script de captura que ejecuta cada worker, default: carla_boxes_test.py')
+    #Los argumentos no reconocidos se pasan al script de captura (por ejemplo --pc-format o --writers)
+    args, extra_args = argparser.parse_known_args()
+
+    try:
+        main(args, extra_args)
+    except KeyboardInterrupt:
+        print(' - Exited by user.')
@@ -13,7 +13,6 @@ from queue import Queue
 from queue import Empty
 import logging
 import cv2
-import math
 import json
 
 try:
@@ -26,8 +25,15 @@ except IndexError:
 
 import carla
 
-from camera_utils import build_projection_matrix, w3D_to_cam3D, w3D_to_cam2D, bbox_in_image
-from kitti_label import KittiLabel
+from camera_utils import build_projection_matrix
+from label_generator import compute_labels, build_kitti_labels
+from visibility import compute_occlusion
+from calibration import CalibWriter, build_calib
+from async_writer import AsyncWriter
+from sensor_sync import SensorSynchronizer
+from pointcloud_store import PointCloudWriter
+from pointcloud_filters import PointCloudFilter, add_filter_arguments
+from actor_log import ActorLogWriter
 
 """ OUTPUT FOLDERS """
 OUTPUT_FOLDER = "training"
@@ -35,6 +41,9 @@ IMAGES_FOLDER = "image_2"
 POINTCLOUDS_FOLDER = "velodyne"
 LABELS_FOLDER = "label_2"
 CALIB_FOLDER = "calib"
+ACTOR_LOG_FOLDER = "actor_log"
+RECORDER_FILE = "recording.log"
+STATS_FILE = "stats.json"
 
 LIST_VEHICLES_PATH = "../Unreal/CarlaUE4/LidarModelFiles/vehicles.json"
 
@@ -49,9 +58,11 @@ def sensor_callback(data,queue):
     queue.put(data)
 
 
-def create_output_folders():
-    current_datetime = datetime.now().strftime("%d-%m-%y_%X")
-    output_directory = os.path.join(current_datetime,OUTPUT_FOLDER)
+def create_output_folders(base_directory=None):
+    #por defecto se usa un directorio con la fecha y hora actual
+    if base_directory is None:
+        base_directory = datetime.now().strftime("%d-%m-%y_%X")
+    output_directory = os.path.join(base_directory,OUTPUT_FOLDER)
 
     images_path = create_folder(output_directory, IMAGES_FOLDER)
     pointcloud_path = create_folder(output_directory, POINTCLOUDS_FOLDER)
@@ -123,38 +134,41 @@ def save_image(images_path, image_data):
     image_data.save_to_disk(image_path)
     #print('imagen %.6d.bin guardada' % image_data.frame)
 
-def save_pointcloud(pointclouds_path,pointcloud):
+def save_pointcloud(pointclouds_path,pointcloud,pc_filter=None):
     pc = np.copy(np.frombuffer(pointcloud.raw_data, dtype=np.dtype('f4')))
     pc = np.reshape(pc, (int(pc.shape[0] / 4), 4))
+    if pc_filter is not None:
+        pc = pc_filter.apply(pc)
     pointcloud_path = './%s/%.6d.bin' % (pointclouds_path, pointcloud.frame) 
     pc.tofile(pointcloud_path)
     #print('point cloud %.6d.bin guardada' % lidar_data.frame)
 
-def is_in_image(npc,K,w2c,image_w,image_h):
-    """ Determinar si el vehiculo npc se enceuntra dentro de los limites de la imagen """
-
-    npc_center_world_pos = get_center_world_pos(npc)
-    npc_center_image_pos = w3D_to_cam2D(npc_center_world_pos,K,w2c)
-
-    return (npc_center_image_pos[0] > 0.0 and  npc_center_image_pos[0] < image_w and \
-            npc_center_image_pos[1] > 0.0 and  npc_center_image_pos[1] < image_h  )
-
-def is_in_front(vehicle,npc):
-    """ Determinar si el actor se encuentra al frente del vehiculo q posee la camara """
-
-    #Prod punto entre el forward vector del vehiculo y el vector entre el vehiculo y el actor
-    forward_vec = vehicle.get_transform().get_forward_vector()
-    ray = npc.get_transform().location - vehicle.get_transform().location
-
-    #si el prod punto es mayor a 1, significa q el actor esta al frente del vehiculo
-    return (forward_vec.dot(ray) > 1)
-
-
-def get_center_world_pos(vehicle):
-    vehicle_world_pos = vehicle.get_transform().location
-    vehicle_world_pos.z += vehicle.bounding_box.extent.z
-
-    return vehicle_world_pos
+def save_pointcloud_container(pointcloud_store,pointcloud,pc_filter=None):
+    #se agrega la nube de puntos al contenedor, sin generar un archivo por frame
+    pc = np.frombuffer(pointcloud.raw_data, dtype=np.dtype('f4')).reshape(-1, 4)
+    if pc_filter is not None:
+        pc = pc_filter.apply(pc)
+    pointcloud_store.append(pointcloud.frame, pc)
+
+def get_actors_arrays(actors):
+    """ Obtiene en arrays (N,3) location, rotation (pitch, yaw, roll), extent y location de la bounding box de cada actor """
+
+    n = len(actors)
+    locations = np.empty((n, 3))
+    rotations = np.empty((n, 3))
+    extents = np.empty((n, 3))
+    bb_locations = np.empty((n, 3))
+
+    for i, actor in enumerate(actors):
+        #un solo get_transform() por actor
+        transform = actor.get_transform()
+        bb = actor.bounding_box
+        locations[i] = (transform.location.x, transform.location.y, transform.location.z)
+        rotations[i] = (transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+        extents[i] = (bb.extent.x, bb.extent.y, bb.extent.z)
+        bb_locations[i] = (bb.location.x, bb.location.y, bb.location.z)
+
+    return locations, rotations, extents, bb_locations
 
 def load_list_of_vehicles():
     file = open(LIST_VEHICLES_PATH)
@@ -167,17 +181,46 @@ def load_list_of_vehicles():
 
     return list_of_vehicles
 
+def save_capture_stats(stats_path, frames_captured, ticks, elapsed, synchronizer):
+    """ Guarda en formato json las estadisticas de la captura, las usa capture_orchestrator.py """
+
+    stats = {'frames': frames_captured,
+             'ticks': ticks,
+             'elapsed': elapsed,
+             'fps': frames_captured / elapsed if elapsed > 0 else 0.0,
+             'matched': synchronizer.matched,
+             'missed': synchronizer.missed}
+    with open(stats_path, 'w') as file:
+        json.dump(stats, file)
+
 def main(arg):
     """Spawnea el LIDAR HDL-64E y una camara RGB en un vehiculo, y genera un paso de simulacion"""
     #Cliente y simulador
-    client = carla.Client('localhost', 2000)
+    client = carla.Client(arg.host, arg.port)
     client.set_timeout(2.0)
-    world = client.get_world()
+    if arg.town is not None:
+        client.set_timeout(20.0) #cargar el mapa puede demorar
+        world = client.load_world(arg.town)
+        client.set_timeout(2.0)
+    else:
+        world = client.get_world()
+
+    if arg.seed is not None:
+        random.seed(arg.seed)
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
     
     #Crear directorios para guardar los datos, nubes de puntos, imagenes y labels
-    images_path,pointclouds_path,calib_path,labels_path = create_output_folders()
+    images_path,pointclouds_path,calib_path,labels_path = create_output_folders(arg.output)
+
+    #Pool de hilos que escribe imagenes y nubes de puntos sin bloquear el loop de simulacion
+    writer = AsyncWriter(num_workers=arg.writers)
+
+    #Con el formato container las nubes de puntos se agregan a un unico contenedor en lugar de un .bin por frame
+    pointcloud_store = PointCloudWriter(pointclouds_path) if arg.pc_format == 'container' else None
+
+    #Log de los transforms de los actores por frame, para regenerar las labels con relabel.py
+    actor_log = None
 
     try:
         #Setea modo sincrono en la simulacion con delta fijo
@@ -185,8 +228,10 @@ def main(arg):
         settings = world.get_settings()
 
         #traffic manager
-        traffic_manager = client.get_trafficmanager(8000)
+        traffic_manager = client.get_trafficmanager(arg.tm_port)
         traffic_manager.set_synchronous_mode(True)
+        if arg.seed is not None:
+            traffic_manager.set_random_device_seed(arg.seed)
         traffic_manager.set_global_distance_to_leading_vehicle(2.5) #distancia a mantener entre vehiculos
         #traffic_manager.set_hybrid_physics_mode(True) #desactiva las fisicas de los vehiculos lejanos al vehiculo hero, reduce el computo
         #traffic_manager.set_hybrid_physics_radius(100.0) #dentro de este radio, si se calculan las fisicas
@@ -222,13 +267,15 @@ def main(arg):
         #las coordenadas son relativas al vehiculo
         #x es el eje correspondiente a la direccion del auto, positivo seria hacia adelante
         #z es la altura
+        camera_mount = carla.Transform(carla.Location(x=0.0, z=1.65)) #posicion segun Kitti
         camera = world.spawn_actor(blueprint=camera_bp,
-            transform=carla.Transform(carla.Location(x=0.0, z=1.65)), #posicion segun Kitti 
+            transform=camera_mount,
             attach_to=vehicle)
 
+        lidar_mount = carla.Transform(carla.Location(x=-0.27, z=1.73)) #posicion segun Kitti
         lidar = world.spawn_actor(
             blueprint=lidar_bp,
-            transform=carla.Transform(carla.Location(x=-0.27, z=1.73)), #posicion segun Kitti
+            transform=lidar_mount,
             attach_to=vehicle)
 
         #Funciones de callback para almacenar imagen y nube de puntos
@@ -238,6 +285,9 @@ def main(arg):
         #Al recibir un nuevo data, se almacena en la cola
         lidar.listen(lambda data: sensor_callback(data,lidar_queue))
         camera.listen(lambda data: sensor_callback(data,image_queue))
+
+        #Empareja los datos de la camara y el lidar por frame
+        synchronizer = SensorSynchronizer({'image': image_queue, 'lidar': lidar_queue})
         
         #spawnear trafico 
         list_of_vehicles = load_list_of_vehicles()
@@ -269,33 +319,52 @@ def main(arg):
         image_h = camera_bp.get_attribute("image_size_y").as_int()
         fov = camera_bp.get_attribute("fov").as_float()
         K = build_projection_matrix(image_w, image_h, fov)
-        
+
+        start_time = time.time()
+
+        #Calibracion (P2, R0_rect, Tr_velo_to_cam), se calcula una vez ya que los sensores estan fijos al vehiculo
+        calib_writer = CalibWriter(calib_path)
+        calib_writer.set_rig(K, np.array(camera_mount.get_matrix()), np.array(lidar_mount.get_matrix()))
+
+        #Procesamiento opcional de las nubes de puntos antes de guardarlas (recorte, suelo y voxels)
+        pc_filter = PointCloudFilter.from_args(arg, lidar_height=lidar_mount.location.z)
+        if pc_filter is not None and arg.crop_camera:
+            lidar_to_camera = build_calib(K, np.array(camera_mount.get_matrix()), np.array(lidar_mount.get_matrix()))['Tr_velo_to_cam']
+            pc_filter.set_camera(lidar_to_camera, K, image_w, image_h)
+
+        if arg.record:
+            #El recorder del simulador guarda el episodio completo, el path es del lado del servidor
+            training_path = os.path.dirname(labels_path)
+            recorder_file = os.path.abspath(os.path.join(training_path, RECORDER_FILE))
+            client.start_recorder(recorder_file, True)
+            actor_log = ActorLogWriter(os.path.join(training_path, ACTOR_LOG_FOLDER), image_w, image_h, recorder_file, K)
 
         while frames_captured < frames:
 
-            world.tick()
+            frame = world.tick()
             ticks += 1
-            time.sleep(0.1)
 
-            #tras cada tick, en caso de haber dato disponible, se lo obtiene
-            if not image_queue.empty():
-                image = image_queue.get()
-                
-            if not lidar_queue.empty():
-                pointcloud = lidar_queue.get()
-            
+            #tras cada tick, se espera a tener ambos datos (imagen y nube de puntos) del mismo frame
+            data = synchronizer.get(frame)
 
-            #cuando se tengan ambos datos (imagen y nube de puntos) de un mismo frame, se almacenan ambos
-            if ticks > 1 and (image.frame == pointcloud.frame):
+            #cuando se tengan ambos datos de un mismo frame, se almacenan ambos
+            if data is not None:
+                image, pointcloud = data['image'], data['lidar']
 
                 #guardar imagen
-                save_image(images_path,image)
+                writer.submit(save_image, images_path, image)
 
                 #guardar nube de puntos
-                save_pointcloud(pointclouds_path,pointcloud)
+                if pointcloud_store is not None:
+                    writer.submit(save_pointcloud_container, pointcloud_store, pointcloud, pc_filter)
+                else:
+                    writer.submit(save_pointcloud, pointclouds_path, pointcloud, pc_filter)
 
                 frames_captured = frames_captured + 1 
 
+                #guardar calibracion
+                calib_writer.write(pointcloud.frame)
+
                 #crear archivo de label
                 label_file_name = './%s/%.6d.txt' % (labels_path, pointcloud.frame)
                 label_file = open(label_file_name,'w')
@@ -306,122 +375,52 @@ def main(arg):
                 # Posicion de la camara para transformar coordenadas
                 world_2_camera = np.array(camera.get_transform().get_inverse_matrix())
 
-                #Obtener todos los actores "vehiculos" y para cada uno
-                for npc in world.get_actors().filter('*vehicle*'):
-                    if npc.id != vehicle.id:
-                        
-                        #se determina si el npc se encuentra en frente del vehiculo
-                        npc_is_in_front = is_in_front(vehicle,npc)
-
-                        #se calcula la distancia entre los vehiculos
-                        dist = npc.get_transform().location.distance(vehicle.get_transform().location)
-
-                        #Solo se computan las bounding boxes de actores en frente y que esten a menos de una cierta distancia
-                        if npc_is_in_front and dist < 50:
-                            
-                            #se determina si el centro del vehiculo aparece dentro de los limites de la imagen
-                            npc_is_in_image = is_in_image(npc,K,world_2_camera,image_w,image_h)
-
-                            if(npc_is_in_image):
-                                
-                                #Se crea el label de este npc y se obtiene la informacion necesaria
-                                label = KittiLabel()
-
-                                #Type
-                                label.set_type('Car')
-
-                                #Location
-                                #Se obtiene la posicion del centro del vehiculo en coordenadas world3D
-                                npc_world_center_pos = get_center_world_pos(npc)
-                                #Se tranforma de world-3D a camara-2D
-                                location = w3D_to_cam3D(npc_world_center_pos,world_2_camera)
-                                label.set_location(location)
-
-                                #Dimensions
-                                #Se obtiene la bounding box del actor
-                                bb = npc.bounding_box
-                                #print(bb)
-                                #https://carla.readthedocs.io/en/0.9.5/measurements/
-                                length=bb.extent.x*2    #extent.x es la mitad del largo del bb
-                                width=bb.extent.y*2     #extent.y es la mitad del ancho del bb
-                                height=bb.extent.z*2    #extent.z es la mitad del alto del bb
-                                #print(length)
-                                #print(width)
-                                #print(height)
-                                dimensions = [height, width, length]
-                                label.set_dimensions(dimensions)
-
-                                #Bbox 2D
-
-                                #obtener vertices del bb en 2D
-                                verts = [v for v in bb.get_world_vertices(npc.get_transform())]
-                                verts_x = []
-                                verts_y = []
-                                for vert in verts:
-                                    vert_2D = w3D_to_cam2D(vert, K, world_2_camera)
-                                    verts_x.append(vert_2D[0])
-                                    verts_y.append(vert_2D[1])
-
-                                #Coordenada mas a la izquierda
-                                left_limit = min(verts_x)
-                                #Coordenada mas a la derecha
-                                rigth_limit = max(verts_x)
-                                #Coordenada mas arriba
-                                high_limit = min(verts_y)
-                                #Coordenada mas abajo
-                                low_limit = max(verts_y)
-                                
-                                #en los min y max, ya se tienen los vertices 2D
-                                bbox_2D = [left_limit, high_limit, rigth_limit, low_limit]
-
-                                #Chequear si los limites estan fuera de la imagen, en tal caso llevarlo al valor minimo o maximo segun corresponda
-                                safe_bbox_2D = bbox_in_image(bbox_2D,image_w,image_h)
-                                label.set_bbox(safe_bbox_2D)
-
-                                #rotation_y
-                                #https://blog.csdn.net/qq_16137569/article/details/118873033
-                                rot_npc= npc.get_transform().rotation.yaw
-                                rot_vehicle = vehicle.get_transform().rotation.yaw
-
-                                rot_y = (rot_vehicle - rot_npc + 90.0) 
-
-                                if(rot_y > 180.0):
-                                    rot_y -= 360.0
-
-                                if(rot_y < -180.0):
-                                    rot_y += 360.0
-
-                                rot_y_rad = math.radians(rot_y)#de grados a radianes
-                                
-                                label.set_rotation_y(rot_y_rad)
-
-                                #Alpha 
-                                #https://arxiv.org/abs/2112.04421
-                                #Se lo calcula a partir de la rot_y y location
-                                #location = [x,y,z]
-                                #alpha = rot_y - arctan(x/z)
-                                alpha = rot_y_rad - math.atan(location[0]/location[2])
-                                
-                                if(alpha > math.pi):
-                                    alpha -= 2*math.pi
-
-                                if(alpha < -math.pi):
-                                    alpha += 2*math.pi   
-
-                                label.set_alpha(alpha)
-
-                                #Truncated
-                                #TODO
-
-                                #Occluded
-                                #TODO
-
-                                str_label = label.get_label()
-                                label_file.write("{}\n".format(str_label))
-                
+                #Obtener todos los actores "vehiculos" (salvo el propio) y sus transforms en arrays
+                npcs = [npc for npc in world.get_actors().filter('*vehicle*') if npc.id != vehicle.id]
+                npc_locations, npc_rotations, npc_extents, npc_bb_locations = get_actors_arrays(npcs)
+
+                vehicle_transform = vehicle.get_transform()
+                vehicle_location = [vehicle_transform.location.x, vehicle_transform.location.y, vehicle_transform.location.z]
+                vehicle_rotation = [vehicle_transform.rotation.pitch, vehicle_transform.rotation.yaw, vehicle_transform.rotation.roll]
+
+                #Se calculan en lote los labels de los npcs en frente, a menos de 50m y dentro de la imagen
+                label_fields = compute_labels(vehicle_location, vehicle_rotation,
+                                              npc_locations, npc_rotations, npc_extents, npc_bb_locations,
+                                              K, world_2_camera, image_w, image_h)
+
+                #Truncated: se calcula en compute_labels a partir del bbox 2D recortado y sin recortar
+
+                #Occluded: a partir de los puntos del lidar del mismo frame que caen en cada objeto o delante de el
+                points = np.frombuffer(pointcloud.raw_data, dtype=np.dtype('f4')).reshape(-1, 4)
+                lidar_2_world = np.array(pointcloud.transform.get_matrix())
+                label_fields['occluded'] = compute_occlusion(label_fields, points, lidar_2_world,
+                                                             K, world_2_camera, image_w, image_h)
+
+                if actor_log is not None:
+                    actor_log.write(pointcloud.frame, vehicle_location, vehicle_rotation, world_2_camera, lidar_2_world,
+                                    [npc.id for npc in npcs], npc_locations, npc_rotations, npc_extents, npc_bb_locations)
+
+                labels = build_kitti_labels(label_fields, 'Car')
+                label_file.write(labels.to_text())
                 label_file.close()
 
+        print('\n Sincronizacion de sensores: %s' % synchronizer.stats())
+
+        #Esperar a que se escriba todo para medir el tiempo real de captura
+        writer.flush()
+        if arg.output is not None:
+            save_capture_stats(os.path.join(arg.output, STATS_FILE), frames_captured, ticks,
+                               time.time() - start_time, synchronizer)
+
     finally:
+        #Esperar a que se terminen de escribir los datos encolados
+        writer.close()
+        if pointcloud_store is not None:
+            pointcloud_store.close()
+        if actor_log is not None:
+            actor_log.close()
+            client.stop_recorder()
+
         world.apply_settings(original_settings)
         vehicle.destroy()
         lidar.destroy()
@@ -434,11 +433,53 @@ def main(arg):
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser(
         description=__doc__)
+    argparser.add_argument(
+        '--host',
+        default='localhost',
+        help='IP del servidor, default: localhost')
+    argparser.add_argument(
+        '-p', '--port',
+        default=2000,
+        type=int,
+        help='puerto TCP del servidor, default: 2000')
+    argparser.add_argument(
+        '--tm-port',
+        default=8000,
+        type=int,
+        help='puerto del traffic manager, default: 8000')
+    argparser.add_argument(
+        '-s', '--seed',
+        default=None,
+        type=int,
+        help='semilla para el spawn del trafico y el traffic manager')
+    argparser.add_argument(
+        '-t', '--town',
+        default=None,
+        help='mapa a cargar antes de capturar, default: el mapa actual')
+    argparser.add_argument(
+        '-o', '--output',
+        default=None,
+        help='directorio de salida, default: fecha y hora actual')
     argparser.add_argument(
         '-f', '--frames',
         default=10,
         type=int,
         help='cantidad de frames a capturar, default: 10')
+    argparser.add_argument(
+        '-w', '--writers',
+        default=4,
+        type=int,
+        help='cantidad de hilos que escriben los datos a disco, default: 4')
+    argparser.add_argument(
+        '--pc-format',
+        default='kitti',
+        choices=['kitti', 'container'],
+        help='formato de las nubes de puntos: un .bin por frame (kitti) o un contenedor con indice (container), default: kitti')
+    argparser.add_argument(
+        '--record',
+        action='store_true',
+        help='grabar el episodio con el recorder del simulador y los transforms de los actores por frame, para regenerar las labels con relabel.py')
+    add_filter_arguments(argparser, camera=True)
     args = argparser.parse_args()
 
     try:
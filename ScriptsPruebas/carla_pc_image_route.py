@@ -21,6 +21,8 @@ except IndexError:
 
 import carla
 
+from sensor_sync import SensorSynchronizer
+
 def sensor_callback(data,queue):
     queue.put(data)
 
@@ -104,6 +106,9 @@ def main(arg):
         #Al recibir un nuevo data, se almacena en la cola
         lidar.listen(lambda data: sensor_callback(data,lidar_queue))
         camera.listen(lambda data: sensor_callback(data,image_queue))
+
+        #Empareja los datos de la camara y el lidar por frame, el lidar entrega datos cada 2 ticks
+        synchronizer = SensorSynchronizer({'image': image_queue, 'lidar': lidar_queue}, periods={'lidar': 2})
         
         frames = arg.frames
         frames_captured = 0
@@ -112,19 +117,15 @@ def main(arg):
         #generar los ticks de simulacion necesarios hasta capturar los frames necesarios
         while frames_captured < frames:
 
-            world.tick()
+            frame = world.tick()
             ticks += 1
-            #time.sleep(0.005)
 
-            #tras cada tick, en caso de haber dato disponible, se lo obtiene
-            if not image_queue.empty():
-                image_data = image_queue.get()
-                
-            if not lidar_queue.empty():
-                lidar_data = lidar_queue.get()
-            
-            #cuando se tengan ambos datos (imagen y nube de puntos) de un mismo frame, se almacenan ambos
-            if ticks > 1 and (image_data.frame == lidar_data.frame):
+            #tras cada tick, se espera a tener ambos datos (imagen y nube de puntos) del mismo frame
+            data = synchronizer.get(frame)
+
+            #cuando se tengan ambos datos de un mismo frame, se almacenan ambos
+            if data is not None:
+                image_data, lidar_data = data['image'], data['lidar']
 
                 #guardar imagen
                 image_data.save_to_disk('./images/%6d.png' % image_data.frame)
@@ -139,7 +140,9 @@ def main(arg):
         
             sys.stdout.write("\r Capturados %d frames de %d en %d" % (frames_captured,frames,ticks) + ' ')
             sys.stdout.flush()
-        
+
+        print('\n Sincronizacion de sensores: %s' % synchronizer.stats())
+
     finally:
         world.apply_settings(original_settings)
         vehicle.destroy()
@@ -23,6 +23,8 @@ except IndexError:
 
 import carla
 
+from sensor_sync import SensorSynchronizer
+
 def sensor_callback(data,queue):
     queue.put(data)
 
@@ -125,6 +127,9 @@ def main(arg):
         #Al recibir un nuevo data, se almacena en la cola
         lidar.listen(lambda data: sensor_callback(data,lidar_queue))
         camera.listen(lambda data: sensor_callback(data,image_queue))
+
+        #Empareja los datos de la camara y el lidar por frame
+        synchronizer = SensorSynchronizer({'image': image_queue, 'lidar': lidar_queue})
         
         #spawnear trafico 
         list_of_vehicles = ['audi.tt','citroen.c3','mini.cooper_s','chevrolet.impala']
@@ -176,19 +181,15 @@ def main(arg):
         
         while frames_captured < frames:
 
-            world.tick()
+            frame = world.tick()
             ticks += 1
-            #time.sleep(0.005)
-
-            #tras cada tick, en caso de haber dato disponible, se lo obtiene
-            if not image_queue.empty():
-                image_data = image_queue.get()
-                
-            if not lidar_queue.empty():
-                lidar_data = lidar_queue.get()
-            
-            #cuando se tengan ambos datos (imagen y nube de puntos) de un mismo frame, se almacenan ambos
-            if ticks > 1 and (image_data.frame == lidar_data.frame):
+
+            #tras cada tick, se espera a tener ambos datos (imagen y nube de puntos) del mismo frame
+            data = synchronizer.get(frame)
+
+            #cuando se tengan ambos datos de un mismo frame, se almacenan ambos
+            if data is not None:
+                image_data, lidar_data = data['image'], data['lidar']
 
                 #guardar imagen
                 image_path =  './%s/%.6d.png' % (images_folder, image_data.frame)
@@ -206,7 +207,9 @@ def main(arg):
         
             sys.stdout.write("\r Capturados %d frames de %d en %d ticks" % (frames_captured,frames,ticks) + ' ')
             sys.stdout.flush()
-        
+
+        print('\n Sincronizacion de sensores: %s' % synchronizer.stats())
+
     finally:
         world.apply_settings(original_settings)
         vehicle.destroy()
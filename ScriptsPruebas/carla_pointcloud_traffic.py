@@ -28,6 +28,10 @@ import carla
 
 from camera_utils import build_projection_matrix, w3D_to_cam3D, w3D_to_cam2D, bbox_in_image
 from kitti_label import KittiLabel
+from async_writer import AsyncWriter
+from sensor_sync import SensorSynchronizer
+from pointcloud_store import PointCloudWriter
+from pointcloud_filters import PointCloudFilter, add_filter_arguments
 
 """ OUTPUT FOLDERS """
 OUTPUT_FOLDER = "training"
@@ -99,13 +103,22 @@ def spawn_vehicles(spawn_points,number_of_vehicles,vehicles_bp,traffic_manager,c
 
     return vehicles_list
 
-def save_pointcloud(pointclouds_path,pointcloud):
+def save_pointcloud(pointclouds_path,pointcloud,pc_filter=None):
     pc = np.copy(np.frombuffer(pointcloud.raw_data, dtype=np.dtype('f4')))
     pc = np.reshape(pc, (int(pc.shape[0] / 4), 4))
+    if pc_filter is not None:
+        pc = pc_filter.apply(pc)
     pointcloud_path = './%s/%.6d.bin' % (pointclouds_path, pointcloud.frame) 
     pc.tofile(pointcloud_path)
     #print('point cloud %.6d.bin guardada' % lidar_data.frame)
 
+def save_pointcloud_container(pointcloud_store,pointcloud,pc_filter=None):
+    #se agrega la nube de puntos al contenedor, sin generar un archivo por frame
+    pc = np.frombuffer(pointcloud.raw_data, dtype=np.dtype('f4')).reshape(-1, 4)
+    if pc_filter is not None:
+        pc = pc_filter.apply(pc)
+    pointcloud_store.append(pointcloud.frame, pc)
+
 
 def load_list_of_vehicles():
     file = open(LIST_VEHICLES_PATH)
@@ -130,6 +143,12 @@ def main(arg):
     #Crear directorios para guardar nubes de puntos
     pointclouds_path = create_output_folders()
 
+    #Pool de hilos que escribe imagenes y nubes de puntos sin bloquear el loop de simulacion
+    writer = AsyncWriter(num_workers=arg.writers)
+
+    #Con el formato container las nubes de puntos se agregan a un unico contenedor en lugar de un .bin por frame
+    pointcloud_store = PointCloudWriter(pointclouds_path) if arg.pc_format == 'container' else None
+
     try:
         #Setea modo sincrono en la simulacion con delta fijo
         original_settings = world.get_settings()
@@ -171,16 +190,23 @@ def main(arg):
         #x es el eje correspondiente a la direccion del auto, positivo seria hacia adelante
         #z es la altura
 
+        lidar_mount = carla.Transform(carla.Location(x=-0.27, z=1.73)) #posicion segun Kitti
         lidar = world.spawn_actor(
             blueprint=lidar_bp,
-            transform=carla.Transform(carla.Location(x=-0.27, z=1.73)), #posicion segun Kitti
+            transform=lidar_mount,
             attach_to=vehicle)
 
+        #Procesamiento opcional de las nubes de puntos antes de guardarlas (recorte, suelo y voxels)
+        pc_filter = PointCloudFilter.from_args(arg, lidar_height=lidar_mount.location.z)
+
         #Funciones de callback para almacenar nube de puntos
         lidar_queue= Queue()
 
         #Al recibir un nuevo data, se almacena en la cola
         lidar.listen(lambda data: sensor_callback(data,lidar_queue))
+
+        #Obtiene los datos del lidar por frame
+        synchronizer = SensorSynchronizer({'lidar': lidar_queue})
         
         #spawnear trafico 
         list_of_vehicles = load_list_of_vehicles() #cargar los vehiculos a spawnear
@@ -206,14 +232,19 @@ def main(arg):
 
         while True:
 
-            world.tick()
+            frame = world.tick()
             ticks += 1
-            time.sleep(0.1)
 
-            if not lidar_queue.empty():
-                pointcloud = lidar_queue.get()
+            #se espera la nube de puntos del frame, si no llega se descarta
+            data = synchronizer.get(frame)
+            if data is None:
+                continue
+            pointcloud = data['lidar']
 
-            save_pointcloud(pointclouds_path,pointcloud)
+            if pointcloud_store is not None:
+                writer.submit(save_pointcloud_container, pointcloud_store, pointcloud, pc_filter)
+            else:
+                writer.submit(save_pointcloud, pointclouds_path, pointcloud, pc_filter)
 
             frames_captured += 1
 
@@ -223,6 +254,11 @@ def main(arg):
 
 
     finally:
+        #Esperar a que se terminen de escribir los datos encolados
+        writer.close()
+        if pointcloud_store is not None:
+            pointcloud_store.close()
+
         world.apply_settings(original_settings)
         vehicle.destroy()
         lidar.destroy()
@@ -238,6 +274,17 @@ if __name__ == "__main__":
         default=10,
         type=int,
         help='cantidad de frames a capturar, default: 10')
+    argparser.add_argument(
+        '-w', '--writers',
+        default=4,
+        type=int,
+        help='cantidad de hilos que escriben los datos a disco, default: 4')
+    argparser.add_argument(
+        '--pc-format',
+        default='kitti',
+        choices=['kitti', 'container'],
+        help='formato de las nubes de puntos: un .bin por frame (kitti) o un contenedor con indice (container), default: kitti')
+    add_filter_arguments(argparser)
     args = argparser.parse_args()
 
     try:
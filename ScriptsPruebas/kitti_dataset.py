@@ -0,0 +1,200 @@
+""" Lectura de las capturas en formato KITTI generadas por los scripts de pruebas
+
+Se indexa una vez el directorio de la captura (training/ con image_2, velodyne, label_2 y calib)
+y se accede a cada frame por su id, o se recorren todos los frames en orden con prefetch en segundo plano.
+"""
+
+import os
+import threading
+from collections import namedtuple
+from queue import Queue, Full
+import numpy as np
+import cv2
+
+from pointcloud_store import INDEX_FILE, PointCloudReader
+from kitti_label import KittiLabelSet
+
+IMAGES_FOLDER = "image_2"
+POINTCLOUDS_FOLDER = "velodyne"
+LABELS_FOLDER = "label_2"
+CALIB_FOLDER = "calib"
+
+#Cantidad de frames a cargar por adelantado al recorrer la captura
+DEFAULT_PREFETCH = 4
+
+KittiSample = namedtuple('KittiSample', ['frame', 'image', 'pointcloud', 'labels', 'calib'])
+
+
+def parse_labels(text):
+    """ Parsea todo el contenido de un archivo de labels a un array estructurado (LABEL_DTYPE), una fila por objeto """
+
+    return KittiLabelSet.from_text(text).to_records()
+
+def parse_calib(text):
+    """ Parsea un archivo de calibracion de KITTI a un diccionario nombre -> matriz """
+
+    calib = {}
+    for line in text.splitlines():
+        if ':' not in line:
+            continue
+        key, values = line.split(':', 1)
+        calib[key.strip()] = np.array(values.split(), dtype=np.float64)
+
+    #P0..P3 y Tr_* son 3x4, R0_rect es 3x3
+    for key, matrix in calib.items():
+        if matrix.size == 12:
+            calib[key] = matrix.reshape(3, 4)
+        elif matrix.size == 9:
+            calib[key] = matrix.reshape(3, 3)
+
+    return calib
+
+def _index_folder(folder, extension):
+    #diccionario frame -> path de los archivos del directorio
+    files = {}
+    if not os.path.isdir(folder):
+        return files
+
+    for entry in os.scandir(folder):
+        name, ext = os.path.splitext(entry.name)
+        if ext == extension and name.isdigit():
+            files[int(name)] = entry.path
+
+    return files
+
+def _read_text(path):
+    with open(path) as file:
+        return file.read()
+
+
+class KittiDataset:
+    """ Lector de una captura en formato KITTI, con acceso aleatorio por frame y prefetch al recorrerla
+
+        Cada frame se devuelve como un KittiSample (frame, image, pointcloud, labels, calib), donde image
+        es el array BGR de cv2, pointcloud un array (N,4) float32, labels un array estructurado (LABEL_DTYPE)
+        y calib un diccionario de matrices. Los componentes que no existen para el frame son None.
+    """
+
+    def __init__(self, root, prefetch=DEFAULT_PREFETCH, load_images=True):
+        self._root = root
+        self._prefetch = prefetch
+        self._load_images = load_images
+
+        pointclouds_path = os.path.join(root, POINTCLOUDS_FOLDER)
+        self._images = _index_folder(os.path.join(root, IMAGES_FOLDER), '.png')
+        self._labels = _index_folder(os.path.join(root, LABELS_FOLDER), '.txt')
+        self._calibs = _index_folder(os.path.join(root, CALIB_FOLDER), '.txt')
+
+        #Las nubes de puntos pueden estar en archivos .bin o en un contenedor (pointcloud_store)
+        if os.path.exists(os.path.join(pointclouds_path, INDEX_FILE)):
+            self._pointcloud_store = PointCloudReader(pointclouds_path)
+            self._pointclouds = {}
+            pointcloud_frames = set(self._pointcloud_store.frames())
+        else:
+            self._pointcloud_store = None
+            self._pointclouds = _index_folder(pointclouds_path, '.bin')
+            pointcloud_frames = set(self._pointclouds)
+
+        self._frames = sorted(set(self._images) | pointcloud_frames | set(self._labels))
+
+    def frames(self):
+        """ Ids de frame de la captura, ordenados """
+
+        return list(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, frame):
+        if self._pointcloud_store is not None and frame in self._pointcloud_store:
+            return True
+        return frame in self._images or frame in self._pointclouds or frame in self._labels
+
+    def _pointcloud(self, frame):
+        if self._pointcloud_store is not None:
+            return self._pointcloud_store[frame] if frame in self._pointcloud_store else None
+
+        path = self._pointclouds.get(frame)
+        if path is None:
+            return None
+        return np.fromfile(path, dtype=np.float32).reshape(-1, 4)
+
+    def _image(self, frame):
+        path = self._images.get(frame)
+        if path is None or not self._load_images:
+            return None
+        return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+    def labels(self, frame):
+        """ Labels del frame como array estructurado, sin cargar imagen ni nube de puntos """
+
+        path = self._labels.get(frame)
+        if path is None:
+            return None
+        return parse_labels(_read_text(path))
+
+    def calib(self, frame):
+        """ Calibracion del frame """
+
+        path = self._calibs.get(frame)
+        if path is None:
+            return None
+        return parse_calib(_read_text(path))
+
+    def __getitem__(self, frame):
+        if frame not in self:
+            raise KeyError(frame)
+
+        return KittiSample(frame, self._image(frame), self._pointcloud(frame), self.labels(frame), self.calib(frame))
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self, frames=None):
+        """ Recorre los frames indicados (por defecto todos, en orden), cargando los proximos
+            prefetch frames en un hilo en segundo plano mientras se procesa el actual """
+
+        frames = self._frames if frames is None else list(frames)
+        if self._prefetch <= 0:
+            for frame in frames:
+                yield self[frame]
+            return
+
+        samples = Queue(maxsize=self._prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            #Se reintenta para poder terminar si el consumidor deja de iterar
+            while not stop.is_set():
+                try:
+                    samples.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def load_samples():
+            for frame in frames:
+                try:
+                    sample = self[frame]
+                except Exception as error:
+                    put(error)
+                    return
+                if not put(sample):
+                    return
+            put(None)
+
+        loader = threading.Thread(target=load_samples, daemon=True)
+        loader.start()
+
+        try:
+            while True:
+                sample = samples.get()
+                if sample is None:
+                    return
+                if isinstance(sample, Exception):
+                    raise sample
+                yield sample
+        finally:
+            stop.set()
+            loader.join()
@@ -20,6 +20,27 @@
 """
 
 from math import pi
+import numpy as np
+
+VALID_CLASSES = ['Car', 'Van', 'Truck',
+                 'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram',
+                 'Misc', 'DontCare']
+
+#Formato de una linea de label, igual al generado por KittiLabel.get_label()
+LABEL_LINE_FORMAT = "%s %.2f %d %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f %.2f\n"
+
+#Cantidad de valores por linea del archivo de labels (sin el campo score)
+LABEL_FIELDS = 15
+
+#Un registro por objeto, mismos campos que KittiLabel
+LABEL_DTYPE = np.dtype([('type', 'U16'),
+                        ('truncated', 'f4'),
+                        ('occluded', 'i4'),
+                        ('alpha', 'f4'),
+                        ('bbox', 'f4', (4,)),
+                        ('dimensions', 'f4', (3,)),
+                        ('location', 'f4', (3,)),
+                        ('rotation_y', 'f4')])
 
 #Clase responsable de almacenar los datos necesarios para genere el label en KITTI format
 class KittiLabel:
@@ -32,9 +53,7 @@ class KittiLabel:
         self.dimensions = dimensions
         self.location = location
         self.rotation_y = rotation_y
-        self._valid_classes = ['Car', 'Van', 'Truck',
-                               'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram',
-                               'Misc', 'DontCare']
+        self._valid_classes = VALID_CLASSES
 
     def set_type(self, obj_type: str):
         assert obj_type in self._valid_classes, "Campo type no valido, debe ser uno de: {}".format(
@@ -94,3 +113,95 @@ class KittiLabel:
             bbox_format = " ".join([str(x) for x in self.bbox])
 
         return "{} {} {} {} {} {} {} {}".format(self.type, self.truncated, self.occluded, self.alpha, bbox_format, self.dimensions, self.location, self.rotation_y)
+
+
+#Coleccion de labels de un frame almacenada por columnas, un array de numpy por campo de KITTI
+class KittiLabelSet:
+    def __init__(self, type, truncated=None, occluded=None, alpha=None, bbox=None, dimensions=None, location=None, rotation_y=None):
+        self.type = np.asarray(type, dtype='U16').reshape(-1)
+        n = self.type.shape[0]
+
+        #Mismos valores por defecto que KittiLabel
+        self.truncated = self._column(truncated, (n,), 0.0)
+        self.occluded = self._column(occluded, (n,), 3, dtype=np.int64)
+        self.alpha = self._column(alpha, (n,), 0.0)
+        self.bbox = self._column(bbox, (n, 4), 0.0)
+        self.dimensions = self._column(dimensions, (n, 3), 0.0)
+        self.location = self._column(location, (n, 3), 0.0)
+        self.rotation_y = self._column(rotation_y, (n,), 0.0)
+
+    @staticmethod
+    def _column(values, shape, default, dtype=np.float64):
+        if values is None:
+            return np.full(shape, default, dtype=dtype)
+        return np.asarray(values, dtype=dtype).reshape(shape)
+
+    @classmethod
+    def from_labels(cls, labels):
+        """ Crea la coleccion a partir de una lista de KittiLabel """
+
+        return cls([label.type for label in labels],
+                   [label.truncated for label in labels],
+                   [label.occluded for label in labels],
+                   [label.alpha for label in labels],
+                   [label.bbox for label in labels],
+                   [label.dimensions for label in labels],
+                   [label.location for label in labels],
+                   [label.rotation_y for label in labels])
+
+    @classmethod
+    def from_text(cls, text):
+        """ Parsea todo el contenido de un archivo de labels de una vez """
+
+        rows = [line.split() for line in text.splitlines() if line.strip()]
+        if not rows:
+            return cls([])
+
+        #Se ignora el campo score de los archivos de resultados
+        tokens = np.array([row[:LABEL_FIELDS] for row in rows])
+        assert tokens.shape[1] == LABEL_FIELDS, "Las lineas de labels deben tener {} campos".format(LABEL_FIELDS)
+
+        values = tokens[:, 1:].astype(np.float64)
+
+        return cls(tokens[:, 0], values[:, 0], values[:, 1], values[:, 2], values[:, 3:7],
+                   values[:, 7:10], values[:, 10:13], values[:, 13])
+
+    def validate(self):
+        """ Verifica todos los campos de todos los labels a la vez, mismas condiciones que los setters de KittiLabel """
+
+        assert np.all(np.isin(self.type, VALID_CLASSES)), "Campo type no valido, debe ser uno de: {}".format(VALID_CLASSES)
+        assert np.all((self.truncated >= 0) & (self.truncated <= 1)), """Campo truncated debe ser Float entre 0 y 1"""
+        assert np.all((self.occluded >= 0) & (self.occluded <= 3)), """Campo Occluded debe ser Integer (0,1,2,3)"""
+        assert np.all(np.abs(self.alpha) <= pi), "Alpha debe estar entre [-pi..pi]"
+        assert np.all(np.abs(self.rotation_y) <= pi), "Rotation y debe estar en rando [-pi..pi]"
+
+    def to_text(self):
+        """ Genera el contenido del archivo de labels (una linea por label, igual a get_label()) de una vez """
+
+        if len(self) == 0:
+            return ""
+
+        values = np.column_stack([self.truncated, self.occluded, self.alpha, self.bbox,
+                                  self.dimensions, self.location, self.rotation_y]).tolist()
+        rows = [value for row in zip(self.type.tolist(), values) for value in [row[0]] + row[1]]
+
+        return (LABEL_LINE_FORMAT * len(self)) % tuple(rows)
+
+    def to_records(self):
+        """ Array estructurado (LABEL_DTYPE) con una fila por label """
+
+        records = np.zeros(len(self), dtype=LABEL_DTYPE)
+        for field in LABEL_DTYPE.names:
+            records[field] = getattr(self, field)
+        return records
+
+    def __len__(self):
+        return self.type.shape[0]
+
+    def __getitem__(self, i):
+        return KittiLabel(self.type[i], self.truncated[i], int(self.occluded[i]), self.alpha[i], self.bbox[i].tolist(),
+                          self.dimensions[i].tolist(), self.location[i].tolist(), self.rotation_y[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
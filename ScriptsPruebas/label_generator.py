@@ -0,0 +1,155 @@
+import numpy as np
+
+from camera_utils import w3D_to_cam3D_array, cam3D_to_cam2D_array
+from kitti_label import KittiLabelSet
+from visibility import compute_truncation, project_clipped_boxes
+
+#Distancia maxima (en metros) a la que se generan labels de los npcs
+MAX_LABEL_DISTANCE = 50.0
+
+#Signos de los 8 vertices de una bounding box, en el mismo orden que carla.BoundingBox.get_local_vertices()
+BBOX_VERTICES_SIGNS = np.array([[-1.0, -1.0, -1.0],
+                                [-1.0, -1.0,  1.0],
+                                [-1.0,  1.0, -1.0],
+                                [-1.0,  1.0,  1.0],
+                                [ 1.0, -1.0, -1.0],
+                                [ 1.0, -1.0,  1.0],
+                                [ 1.0,  1.0, -1.0],
+                                [ 1.0,  1.0,  1.0]])
+
+
+def rotation_matrices(rotations):
+    """ Calcula las matrices de rotacion (N,3,3) de carla a partir de los angulos (pitch, yaw, roll) en grados, shape (N,3) """
+
+    rotations = np.radians(np.asarray(rotations, dtype=np.float64))
+    cp, cy, cr = np.cos(rotations[:, 0]), np.cos(rotations[:, 1]), np.cos(rotations[:, 2])
+    sp, sy, sr = np.sin(rotations[:, 0]), np.sin(rotations[:, 1]), np.sin(rotations[:, 2])
+
+    #Misma matriz que carla.Transform.get_matrix(), Rz(yaw) * Ry(pitch) * Rx(roll)
+    R = np.empty((rotations.shape[0], 3, 3))
+    R[:, 0, 0] = cp * cy
+    R[:, 0, 1] = cy * sp * sr - sy * cr
+    R[:, 0, 2] = -cy * sp * cr - sy * sr
+    R[:, 1, 0] = cp * sy
+    R[:, 1, 1] = sy * sp * sr + cy * cr
+    R[:, 1, 2] = -sy * sp * cr + cy * sr
+    R[:, 2, 0] = sp
+    R[:, 2, 1] = -cp * sr
+    R[:, 2, 2] = cp * cr
+
+    return R
+
+def forward_vectors(rotations):
+    """ Forward vector (N,3) de cada rotacion (pitch, yaw, roll), igual a carla.Rotation.get_forward_vector() """
+
+    rotations = np.radians(np.asarray(rotations, dtype=np.float64))
+    cp = np.cos(rotations[:, 0])
+
+    return np.stack([cp * np.cos(rotations[:, 1]), cp * np.sin(rotations[:, 1]), np.sin(rotations[:, 0])], axis=-1)
+
+def bbox_world_vertices(locations, rotations, extents, bb_locations=None):
+    """ Vertices en world-3D (N,8,3) de las bounding boxes de N actores, equivalente a bb.get_world_vertices(transform)
+
+        Se asume que la bounding box no esta rotada respecto al actor (caso de los vehiculos de carla)
+    """
+
+    extents = np.asarray(extents, dtype=np.float64)
+    local_vertices = BBOX_VERTICES_SIGNS[np.newaxis, :, :] * extents[:, np.newaxis, :]
+    if bb_locations is not None:
+        local_vertices += np.asarray(bb_locations, dtype=np.float64)[:, np.newaxis, :]
+
+    R = rotation_matrices(rotations)
+    world_vertices = np.einsum('nij,nkj->nki', R, local_vertices)
+    world_vertices += np.asarray(locations, dtype=np.float64)[:, np.newaxis, :]
+
+    return world_vertices
+
+def wrap_angle(angle, limit):
+    """ Lleva el angulo al rango [-limit..limit] sumando o restando una vuelta (2*limit) """
+
+    angle = np.where(angle > limit, angle - 2 * limit, angle)
+    angle = np.where(angle < -limit, angle + 2 * limit, angle)
+
+    return angle
+
+def compute_labels(ego_location, ego_rotation, npc_locations, npc_rotations, npc_extents, npc_bb_locations,
+                   K, w2c, image_w, image_h, max_distance=MAX_LABEL_DISTANCE):
+    """ Calcula en lote los campos de los labels KITTI de todos los npcs de un frame
+
+        Los transforms de los npcs se reciben como arrays (N,3): locations (x,y,z) y rotations (pitch,yaw,roll) en grados.
+        Devuelve un diccionario con los indices de los npcs seleccionados (en frente, a menos de max_distance
+        y con su centro dentro de la imagen) y los arrays con location, dimensions, bbox, rotation_y, alpha y truncated
+        de cada uno, junto con su bounding box 3D (box_centers, box_rotations, extents) y la profundidad y altura
+        de sus vertices, necesarios para calcular la oclusion con visibility.compute_occlusion.
+    """
+
+    ego_location = np.asarray(ego_location, dtype=np.float64)
+    ego_rotation = np.asarray(ego_rotation, dtype=np.float64)
+    npc_locations = np.asarray(npc_locations, dtype=np.float64).reshape(-1, 3)
+    npc_rotations = np.asarray(npc_rotations, dtype=np.float64).reshape(-1, 3)
+    npc_extents = np.asarray(npc_extents, dtype=np.float64).reshape(-1, 3)
+    if npc_bb_locations is not None:
+        npc_bb_locations = np.asarray(npc_bb_locations, dtype=np.float64).reshape(-1, 3)
+
+    #Actores en frente del vehiculo (prod punto con el forward vector mayor a 1) y a menos de max_distance
+    ego_forward = forward_vectors(ego_rotation.reshape(1, 3))[0]
+    rays = npc_locations - ego_location
+    is_in_front = rays @ ego_forward > 1
+    dist = np.linalg.norm(rays, axis=1)
+    candidates = np.flatnonzero(is_in_front & (dist < max_distance))
+
+    #Centro de los vehiculos en world-3D, y su proyeccion en la imagen
+    centers = npc_locations[candidates].copy()
+    centers[:, 2] += npc_extents[candidates, 2]
+    centers_camera = w3D_to_cam3D_array(centers, w2c)
+    centers_image = cam3D_to_cam2D_array(centers_camera, K)
+    is_in_image = (centers_image[:, 0] > 0.0) & (centers_image[:, 0] < image_w) & \
+                  (centers_image[:, 1] > 0.0) & (centers_image[:, 1] < image_h)
+
+    selected = candidates[is_in_image]
+    location = centers_camera[is_in_image]
+
+    #Dimensions: Kitti espera alto, ancho y largo (extent es la mitad de cada lado)
+    dimensions = 2.0 * npc_extents[selected][:, ::-1]
+
+    #Bbox 2D: se proyectan los 8 vertices y se toman los limites, recortados a la imagen
+    bb_locations = None if npc_bb_locations is None else npc_bb_locations[selected]
+    vertices = bbox_world_vertices(npc_locations[selected], npc_rotations[selected], npc_extents[selected], bb_locations)
+    #Las cajas se recortan contra el plano de la camara, los vertices detras de ella se proyectarian invertidos
+    vertices_camera = w3D_to_cam3D_array(vertices, w2c)
+    bbox_unclipped = project_clipped_boxes(vertices_camera, K)
+    bbox = bbox_unclipped.copy()
+    bbox[:, [0, 2]] = np.clip(bbox[:, [0, 2]], 0.0, image_w - 1.0)
+    bbox[:, [1, 3]] = np.clip(bbox[:, [1, 3]], 0.0, image_h - 1.0)
+
+    #Truncated: fraccion del bbox 2D que queda fuera de la imagen
+    truncated = compute_truncation(bbox_unclipped, bbox)
+
+    #Bounding box 3D orientada en world-3D, para calcular la oclusion
+    box_rotations = rotation_matrices(npc_rotations[selected])
+    box_centers = npc_locations[selected].copy()
+    if bb_locations is not None:
+        box_centers += np.einsum('nij,nj->ni', box_rotations, bb_locations)
+
+    #rotation_y a partir de la diferencia de yaw entre el vehiculo y el npc
+    rot_y = wrap_angle(ego_rotation[1] - npc_rotations[selected, 1] + 90.0, 180.0)
+    rotation_y = np.radians(rot_y)
+
+    #alpha = rot_y - arctan(x/z)
+    alpha = wrap_angle(rotation_y - np.arctan(location[:, 0] / location[:, 2]), np.pi)
+
+    return {'indices': selected, 'location': location, 'dimensions': dimensions, 'bbox': bbox,
+            'rotation_y': rotation_y, 'alpha': alpha, 'truncated': truncated,
+            'box_centers': box_centers, 'box_rotations': box_rotations, 'extents': npc_extents[selected],
+            'vertices_depth': vertices_camera[:, :, 2], 'vertices_z': vertices[:, :, 2]}
+
+def build_kitti_labels(fields, obj_type='Car'):
+    """ Genera el KittiLabelSet de un frame a partir de los campos calculados por compute_labels """
+
+    label_set = KittiLabelSet(np.full(len(fields['indices']), obj_type), truncated=fields.get('truncated'),
+                              occluded=fields.get('occluded'), alpha=fields['alpha'], bbox=fields['bbox'],
+                              dimensions=fields['dimensions'], location=fields['location'],
+                              rotation_y=fields['rotation_y'])
+    label_set.validate()
+
+    return label_set
@@ -0,0 +1,146 @@
+import numpy as np
+
+from camera_utils import cam3D_to_cam2D_array, depth_mask
+
+#Cada punto es x, y, z, intensidad en coordenadas del lidar (x adelante, y derecha, z arriba)
+
+
+def crop_range(points, max_range=None, min_range=None):
+    """ Conserva los puntos (N,4) cuya distancia al lidar esta entre min_range y max_range """
+
+    dist2 = np.einsum('ij,ij->i', points[:, :3], points[:, :3])
+    keep = np.ones(points.shape[0], dtype=bool)
+    if max_range is not None:
+        keep &= dist2 <= max_range * max_range
+    if min_range is not None:
+        keep &= dist2 >= min_range * min_range
+
+    return points[keep]
+
+def crop_frustum(points, lidar_to_camera, K, image_w, image_h):
+    """ Conserva los puntos (N,4) que se proyectan dentro de la imagen de la camara
+
+        lidar_to_camera es la matriz 3x4 que lleva los puntos a coordenadas de camara standard (Tr_velo_to_cam)
+    """
+
+    lidar_to_camera = np.asarray(lidar_to_camera, dtype=points.dtype)
+    points_camera = points[:, :3] @ lidar_to_camera[:3, :3].T + lidar_to_camera[:3, 3]
+    points_image = cam3D_to_cam2D_array(points_camera, K)
+    keep = depth_mask(points_camera) & \
+           (points_image[:, 0] >= 0) & (points_image[:, 0] < image_w) & \
+           (points_image[:, 1] >= 0) & (points_image[:, 1] < image_h)
+
+    return points[keep]
+
+def remove_ground(points, ground_height, margin=0.2):
+    """ Descarta los puntos del suelo: los que estan a menos de margin metros por encima de ground_height
+
+        ground_height es la altura del suelo en coordenadas del lidar (menos la altura de montaje del lidar)
+    """
+
+    return points[points[:, 2] > ground_height + margin]
+
+def voxel_downsample(points, voxel_size):
+    """ Reduce la nube de puntos (N,4) a un punto por voxel (el promedio de los puntos del voxel)
+
+        Los indices enteros de voxel de cada punto se combinan en una unica clave int64,
+        y los puntos se agrupan por clave con np.unique y se promedian con np.bincount.
+    """
+
+    if points.shape[0] == 0:
+        return points
+
+    voxels = np.floor(points[:, :3] / voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=0)
+    dims = voxels.max(axis=0) + 1
+    keys = (voxels[:, 0] * dims[1] + voxels[:, 1]) * dims[2] + voxels[:, 2]
+
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    downsampled = np.empty((counts.shape[0], points.shape[1]), dtype=points.dtype)
+    for column in range(points.shape[1]):
+        downsampled[:, column] = np.bincount(inverse, weights=points[:, column]) / counts
+
+    return downsampled
+
+
+class PointCloudFilter:
+    """ Etapa de procesamiento de las nubes de puntos antes de guardarlas: recorte por rango y por el
+        campo de vision de la camara, eliminacion del suelo y downsampling por voxels.
+        Cada paso se aplica solo si esta configurado.
+    """
+
+    def __init__(self, max_range=None, min_range=None, ground_height=None, voxel_size=None,
+                 lidar_to_camera=None, K=None, image_w=None, image_h=None):
+        self.max_range = max_range
+        self.min_range = min_range
+        self.ground_height = ground_height
+        self.voxel_size = voxel_size
+        self.lidar_to_camera = lidar_to_camera
+        self.K = K
+        self.image_w = image_w
+        self.image_h = image_h
+
+    @classmethod
+    def from_args(cls, arg, lidar_height=None):
+        """ Crea el filtro a partir de los argumentos de linea de comandos de los scripts de captura,
+            o devuelve None si no se configuro ningun paso """
+
+        ground_height = -lidar_height if arg.remove_ground and lidar_height is not None else None
+        crop_camera = getattr(arg, 'crop_camera', False)
+        if arg.max_range is None and arg.min_range is None and ground_height is None and arg.voxel_size is None \
+                and not crop_camera:
+            return None
+
+        return cls(max_range=arg.max_range, min_range=arg.min_range, ground_height=ground_height,
+                   voxel_size=arg.voxel_size)
+
+    def set_camera(self, lidar_to_camera, K, image_w, image_h):
+        """ Activa el recorte de los puntos fuera de la imagen de la camara """
+
+        self.lidar_to_camera = lidar_to_camera
+        self.K = K
+        self.image_w = image_w
+        self.image_h = image_h
+
+    def apply(self, points):
+        if self.max_range is not None or self.min_range is not None:
+            points = crop_range(points, self.max_range, self.min_range)
+        if self.lidar_to_camera is not None:
+            points = crop_frustum(points, self.lidar_to_camera, self.K, self.image_w, self.image_h)
+        if self.ground_height is not None:
+            points = remove_ground(points, self.ground_height)
+        if self.voxel_size is not None:
+            points = voxel_downsample(points, self.voxel_size)
+
+        return points
+
+
+def add_filter_arguments(argparser, camera=False):
+    """ Agrega los argumentos de configuracion del filtro a los scripts de captura,
+        con camera=True se agrega tambien el recorte por el campo de vision de la camara """
+
+    argparser.add_argument(
+        '--max-range',
+        default=None,
+        type=float,
+        help='descartar los puntos a mas de esta distancia (en metros) del lidar')
+    argparser.add_argument(
+        '--min-range',
+        default=None,
+        type=float,
+        help='descartar los puntos a menos de esta distancia (en metros) del lidar')
+    argparser.add_argument(
+        '--remove-ground',
+        action='store_true',
+        help='descartar los puntos del suelo')
+    argparser.add_argument(
+        '--voxel-size',
+        default=None,
+        type=float,
+        help='tamaño de voxel (en metros) para el downsampling, un punto por voxel')
+    if camera:
+        argparser.add_argument(
+            '--crop-camera',
+            action='store_true',
+            help='descartar los puntos que no se proyectan dentro de la imagen de la camara')
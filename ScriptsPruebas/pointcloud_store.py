@@ -0,0 +1,201 @@
+""" Contenedor de nubes de puntos: alternativa a un archivo %06d.bin por frame
+
+Las nubes de puntos se guardan de forma contigua (float32, N x 4: x, y, z, intensidad) en archivos
+chunk_XXXX.bin de tamaño acotado, y un indice (index.bin) con un registro por frame indica en que
+chunk, a partir de que punto y cuantos puntos tiene cada nube. Solo se agregan datos al final de los
+archivos (al reabrir el contenedor se descarta lo escrito despues del ultimo registro completo del indice),
+y la lectura se hace con numpy.memmap sin copiar los datos.
+"""
+
+import glob
+import os
+import argparse
+import threading
+import numpy as np
+
+INDEX_FILE = "index.bin"
+CHUNK_FILE = "chunk_{0:04}.bin"
+
+#Cada punto es x, y, z, intensidad en float32, igual que el formato de KITTI
+POINT_DTYPE = np.dtype('f4')
+POINT_FIELDS = 4
+POINT_SIZE = POINT_DTYPE.itemsize * POINT_FIELDS
+
+#Registro del indice por cada nube de puntos, offset y count en cantidad de puntos
+INDEX_DTYPE = np.dtype([('frame', '<i8'), ('chunk', '<u4'), ('offset', '<u8'), ('count', '<u8')])
+
+#Tamaño maximo por defecto de cada chunk (en bytes)
+DEFAULT_CHUNK_SIZE = 1 << 30
+
+
+class PointCloudWriter:
+    """ Agrega nubes de puntos al final del contenedor, creandolo si no existe
+
+        append() puede llamarse desde varios hilos (por ejemplo desde un AsyncWriter)
+    """
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._path = path
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        #Se continua en el ultimo chunk de un contenedor existente, despues de la ultima nube del indice
+        index = read_index(path)
+        self._chunk = int(index['chunk'].max()) if len(index) > 0 else 0
+        self._frames = set(index['frame'].tolist())
+        last_chunk = index[index['chunk'] == self._chunk]
+        chunk_end = int((last_chunk['offset'] + last_chunk['count']).max()) if len(last_chunk) > 0 else 0
+
+        #Se descarta un registro final incompleto, los registros agregados despues quedarian desalineados
+        self._index_file = open(os.path.join(path, INDEX_FILE), 'ab')
+        self._index_file.truncate(len(index) * INDEX_DTYPE.itemsize)
+        self._chunk_file = None
+        self._open_chunk(chunk_end)
+
+    def _open_chunk(self, offset=0):
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+        self._chunk_file = open(os.path.join(self._path, CHUNK_FILE.format(self._chunk)), 'ab')
+
+        #Se descartan los datos sin registro en el indice (escritura interrumpida), el chunk sigue en offset
+        self._chunk_file.truncate(offset * POINT_SIZE)
+        self._chunk_offset = offset
+
+    def append(self, frame, points):
+        """ Agrega la nube de puntos (N,4) del frame al contenedor """
+
+        points = np.ascontiguousarray(points, dtype=POINT_DTYPE).reshape(-1, POINT_FIELDS)
+
+        with self._lock:
+            assert frame not in self._frames, "El frame {} ya esta en el contenedor".format(frame)
+
+            #Si la nube no entra en el chunk actual, se empieza uno nuevo
+            if self._chunk_offset > 0 and (self._chunk_offset + points.shape[0]) * POINT_SIZE > self._chunk_size:
+                self._chunk += 1
+                self._open_chunk()
+
+            self._chunk_file.write(points.tobytes())
+            self._chunk_file.flush()
+
+            #El registro del indice se escribe despues de los datos, un indice nunca apunta a datos incompletos
+            record = np.array([(frame, self._chunk, self._chunk_offset, points.shape[0])], dtype=INDEX_DTYPE)
+            self._index_file.write(record.tobytes())
+            self._index_file.flush()
+
+            self._chunk_offset += points.shape[0]
+            self._frames.add(frame)
+
+    def close(self):
+        with self._lock:
+            self._chunk_file.close()
+            self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PointCloudReader:
+    """ Acceso aleatorio por frame a las nubes de puntos del contenedor, sin copiar los datos """
+
+    def __init__(self, path):
+        self._path = path
+        self._index = read_index(path)
+        self._frame_to_record = {int(frame): i for i, frame in enumerate(self._index['frame'])}
+        self._chunks = {}
+
+    def _get_chunk(self, chunk):
+        if chunk not in self._chunks:
+            chunk_path = os.path.join(self._path, CHUNK_FILE.format(chunk))
+            if os.path.getsize(chunk_path) == 0:
+                #numpy.memmap no puede mapear un archivo vacio, como el chunk de nubes de 0 puntos
+                self._chunks[chunk] = np.empty((0, POINT_FIELDS), dtype=POINT_DTYPE)
+            else:
+                self._chunks[chunk] = np.memmap(chunk_path, dtype=POINT_DTYPE, mode='r').reshape(-1, POINT_FIELDS)
+        return self._chunks[chunk]
+
+    def frames(self):
+        """ Frames del contenedor, en el orden en que se agregaron """
+
+        return self._index['frame'].tolist()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, frame):
+        return frame in self._frame_to_record
+
+    def __getitem__(self, frame):
+        """ Nube de puntos (N,4) del frame, como vista de solo lectura sobre el memmap del chunk """
+
+        record = self._index[self._frame_to_record[frame]]
+        offset, count = int(record['offset']), int(record['count'])
+        if count == 0:
+            return np.empty((0, POINT_FIELDS), dtype=POINT_DTYPE)
+
+        return self._get_chunk(int(record['chunk']))[offset:offset + count]
+
+    def __iter__(self):
+        for frame in self.frames():
+            yield frame, self[frame]
+
+
+def read_index(path):
+    """ Lee el indice del contenedor, un array estructurado con un registro por nube de puntos """
+
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+
+    #Se ignora un registro final incompleto (escritura interrumpida)
+    data = np.fromfile(index_path, dtype=np.uint8)
+    complete = (data.size // INDEX_DTYPE.itemsize) * INDEX_DTYPE.itemsize
+
+    return data[:complete].view(INDEX_DTYPE)
+
+def kitti_to_container(velodyne_path, container_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Convierte un directorio de KITTI con un %06d.bin por frame al contenedor """
+
+    files = sorted(glob.glob(os.path.join(velodyne_path, '*.bin')))
+    with PointCloudWriter(container_path, chunk_size) as writer:
+        for file in files:
+            frame = int(os.path.splitext(os.path.basename(file))[0])
+            writer.append(frame, np.fromfile(file, dtype=POINT_DTYPE))
+
+    return len(files)
+
+def container_to_kitti(container_path, velodyne_path):
+    """ Convierte el contenedor a un directorio de KITTI con un %06d.bin por frame """
+
+    os.makedirs(velodyne_path, exist_ok=True)
+    reader = PointCloudReader(container_path)
+    for frame, points in reader:
+        points.tofile(os.path.join(velodyne_path, '{0:06}.bin'.format(frame)))
+
+    return len(reader)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'mode',
+        choices=['to-container', 'to-kitti'],
+        help='to-container: velodyne de KITTI -> contenedor, to-kitti: contenedor -> velodyne de KITTI')
+    argparser.add_argument(
+        'src',
+        help='directorio de origen')
+    argparser.add_argument(
+        'dst',
+        help='directorio de destino')
+    args = argparser.parse_args()
+
+    if args.mode == 'to-container':
+        count = kitti_to_container(args.src, args.dst)
+    else:
+        count = container_to_kitti(args.src, args.dst)
+
+    print('%d nubes de puntos convertidas' % count)
@@ -0,0 +1,81 @@
+""" Regenera las labels en formato KITTI de una captura de carla_boxes_test.py sin el simulador
+
+Usa el log de actores (--record en carla_boxes_test.py), la calibracion y las nubes de puntos guardadas
+para volver a calcular las labels con el codigo actual de label_generator y visibility. Permite iterar
+sobre la generacion de labels sin volver a capturar. La matriz K se toma del log (meta.json), igual a la
+de la captura, y solo en logs sin K de P2 del archivo de calibracion (escrito con %.12e, las labels pueden
+diferir en el ultimo digito).
+Si las nubes de puntos se guardaron filtradas (pointcloud_filters) la oclusion se calcula con la nube filtrada.
+"""
+
+import os
+import argparse
+import numpy as np
+
+from label_generator import compute_labels, build_kitti_labels, MAX_LABEL_DISTANCE
+from visibility import compute_occlusion
+from kitti_dataset import KittiDataset
+from actor_log import ActorLogReader
+
+OUTPUT_FOLDER = "training"
+LABELS_FOLDER = "label_2"
+ACTOR_LOG_FOLDER = "actor_log"
+
+
+def relabel_frame(actors, K, points, image_w, image_h, max_distance=MAX_LABEL_DISTANCE, obj_type='Car'):
+    """ Calcula las labels (KittiLabelSet) de un frame del log de actores """
+
+    label_fields = compute_labels(actors['ego_location'], actors['ego_rotation'],
+                                  actors['locations'], actors['rotations'], actors['extents'], actors['bb_locations'],
+                                  K, actors['world_2_camera'], image_w, image_h, max_distance)
+    if points is not None:
+        label_fields['occluded'] = compute_occlusion(label_fields, points, actors['lidar_2_world'],
+                                                     K, actors['world_2_camera'], image_w, image_h)
+
+    return build_kitti_labels(label_fields, obj_type)
+
+def relabel(capture_directory, labels_folder=LABELS_FOLDER, max_distance=MAX_LABEL_DISTANCE):
+    """ Regenera las labels de todos los frames del log de actores, devuelve la cantidad de frames """
+
+    training = os.path.join(capture_directory, OUTPUT_FOLDER)
+    log = ActorLogReader(os.path.join(training, ACTOR_LOG_FOLDER))
+    dataset = KittiDataset(training, load_images=False)
+    image_w, image_h = log.meta['image_w'], log.meta['image_h']
+
+    labels_path = os.path.join(training, labels_folder)
+    os.makedirs(labels_path, exist_ok=True)
+
+    frames = [frame for frame in log.frames() if frame in dataset]
+    for sample in dataset.iterate(frames):
+        if log.meta.get('K') is not None:
+            K = np.array(log.meta['K'], dtype=np.float64)
+        else:
+            #La camara no esta rectificada, K es la parte 3x3 de P2
+            assert sample.calib is not None, "Falta la calibracion del frame {}".format(sample.frame)
+            K = sample.calib['P2'][:, :3]
+        labels = relabel_frame(log[sample.frame], K, sample.pointcloud, image_w, image_h, max_distance)
+        with open(os.path.join(labels_path, '%.6d.txt' % sample.frame), 'w') as file:
+            file.write(labels.to_text())
+
+    return len(frames)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'capture',
+        help='directorio de la captura (el que contiene training/)')
+    argparser.add_argument(
+        '-l', '--labels',
+        default=LABELS_FOLDER,
+        help='directorio dentro de training/ donde escribir las labels, default: label_2')
+    argparser.add_argument(
+        '-d', '--max-distance',
+        default=MAX_LABEL_DISTANCE,
+        type=float,
+        help='distancia maxima (en metros) de los objetos a etiquetar, default: %.0f' % MAX_LABEL_DISTANCE)
+    args = argparser.parse_args()
+
+    count = relabel(args.capture, args.labels, args.max_distance)
+    print('%d frames etiquetados' % count)
@@ -0,0 +1,102 @@
+from queue import Empty
+
+#Tiempo maximo (en segundos) a esperar el dato de un sensor tras un tick
+DEFAULT_TIMEOUT = 2.0
+
+
+class SensorSynchronizer:
+    """ Empareja los datos de varios sensores por el id de frame de la simulacion
+
+        Recibe un diccionario nombre -> Queue, donde cada sensor encola sus datos desde su callback.
+        Tras cada world.tick() se llama a get(frame), que bloquea sobre las colas (con timeout) hasta
+        obtener el dato de ese frame de todos los sensores. Los datos de frames anteriores se descartan
+        y los de frames posteriores se guardan hasta que se los pida.
+
+        Si un sensor no entrega datos en todos los frames (sensor_tick mayor a delta), se indica en periods
+        cada cuantos frames lo hace, para no esperarlo en los frames en que no va a entregar nada.
+    """
+
+    def __init__(self, sensor_queues, timeout=DEFAULT_TIMEOUT, periods=None):
+        self._queues = sensor_queues
+        self._timeout = timeout
+        self._periods = periods if periods is not None else {}
+        #Ultimo frame recibido de cada sensor con periodo, para saber en que frames entrega datos
+        self._last_frames = {}
+        #Datos que llegaron antes de ser pedidos, por sensor: {nombre: {frame: dato}}
+        self._pending = {name: {} for name in sensor_queues}
+
+        #Contadores
+        self.matched = 0
+        self.missed = 0
+        self.dropped = {name: 0 for name in sensor_queues}
+        self.timeouts = {name: 0 for name in sensor_queues}
+
+    def expects(self, frame):
+        """ Determina si se espera que todos los sensores entreguen datos en el frame """
+
+        for name, period in self._periods.items():
+            last_frame = self._last_frames.get(name)
+            if last_frame is not None and (frame - last_frame) % period != 0:
+                return False
+        return True
+
+    def get(self, frame):
+        """ Devuelve un diccionario nombre -> dato con los datos de todos los sensores del frame,
+            o None si algun sensor no entrego el dato de ese frame antes del timeout """
+
+        if not self.expects(frame):
+            return None
+
+        data = {}
+        for name in self._queues:
+            sensor_data = self._get_sensor_frame(name, frame)
+            if sensor_data is None:
+                self.missed += 1
+                #Los datos de este frame de los demas sensores ya no sirven
+                for other in self._pending:
+                    self._pending[other].pop(frame, None)
+                return None
+            data[name] = sensor_data
+
+        self.matched += 1
+        return data
+
+    def _get_sensor_frame(self, name, frame):
+        pending = self._pending[name]
+
+        #Descartar los datos guardados de frames anteriores, ya no se van a pedir
+        for old_frame in [f for f in pending if f < frame]:
+            del pending[old_frame]
+            self.dropped[name] += 1
+
+        if frame in pending:
+            return pending.pop(frame)
+
+        #Los sensores entregan sus datos en orden, si ya llego un frame posterior este no va a llegar
+        if any(f > frame for f in pending):
+            return None
+
+        while True:
+            try:
+                sensor_data = self._queues[name].get(True, self._timeout)
+            except Empty:
+                self.timeouts[name] += 1
+                return None
+
+            if name in self._periods:
+                self._last_frames[name] = sensor_data.frame
+
+            if sensor_data.frame == frame:
+                return sensor_data
+            elif sensor_data.frame > frame:
+                #Llego antes de tiempo, se guarda para el frame correspondiente
+                pending[sensor_data.frame] = sensor_data
+                return None
+            else:
+                self.dropped[name] += 1
+
+    def stats(self):
+        """ String con los contadores de frames emparejados y descartados """
+
+        return "emparejados: %d, perdidos: %d, descartados: %s, timeouts: %s" % (
+            self.matched, self.missed, self.dropped, self.timeouts)
@@ -0,0 +1,69 @@
+""" Script de captura falso para probar capture_orchestrator.py sin un servidor de CARLA
+
+Acepta los mismos argumentos que carla_boxes_test.py pasa el orquestador y escribe --frames frames KITTI falsos
+(imagen, nube de puntos, label y calibracion con symlinks) y el stats.json del worker. Los ids de frame
+empiezan en el mismo valor para todos los workers, como los frames del simulador en servidores distintos,
+y cada label guarda la semilla y el frame original del worker para poder verificar la union.
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from calibration import CalibWriter
+
+OUTPUT_FOLDER = "training"
+STATS_FILE = "stats.json"
+
+#Primer frame y separacion entre frames capturados (el simulador no captura en todos los ticks)
+FIRST_FRAME = 100
+FRAME_STEP = 3
+
+
+def create_folder(output_directory, folder):
+    path = os.path.join(output_directory, OUTPUT_FOLDER, folder)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def main(arg):
+    start_time = time.time()
+    rng = np.random.default_rng(arg.seed)
+
+    images_path = create_folder(arg.output, "image_2")
+    pointclouds_path = create_folder(arg.output, "velodyne")
+    labels_path = create_folder(arg.output, "label_2")
+    calib_writer = CalibWriter(create_folder(arg.output, "calib"))
+    calib_writer.set_rig(np.array([[400.0, 0.0, 400.0], [0.0, 400.0, 300.0], [0.0, 0.0, 1.0]]), np.eye(4), np.eye(4))
+
+    frames = [FIRST_FRAME + i * FRAME_STEP for i in range(arg.frames)]
+    for frame in frames:
+        with open(os.path.join(images_path, '%.6d.png' % frame), 'wb') as file:
+            file.write(b'stub')
+        rng.random((16, 4), dtype=np.float32).tofile(os.path.join(pointclouds_path, '%.6d.bin' % frame))
+        #La location (x, y) de la label es la semilla del worker y el frame original
+        with open(os.path.join(labels_path, '%.6d.txt' % frame), 'w') as file:
+            file.write('Car 0.00 0 0.00 0.00 0.00 10.00 10.00 1.50 1.60 4.00 %d.00 %d.00 10.00 0.00\n' % (
+                arg.seed, frame))
+        calib_writer.write(frame)
+
+    elapsed = time.time() - start_time
+    with open(os.path.join(arg.output, STATS_FILE), 'w') as file:
+        json.dump({'frames': len(frames), 'ticks': len(frames) * FRAME_STEP, 'elapsed': elapsed,
+                   'fps': len(frames) / elapsed if elapsed > 0 else 0.0, 'matched': len(frames), 'missed': 0}, file)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument('--host', default='localhost')
+    argparser.add_argument('-p', '--port', default=2000, type=int)
+    argparser.add_argument('--tm-port', default=8000, type=int)
+    argparser.add_argument('-s', '--seed', default=0, type=int)
+    argparser.add_argument('-t', '--town', default=None)
+    argparser.add_argument('-f', '--frames', default=10, type=int)
+    argparser.add_argument('-o', '--output', required=True)
+    args, _ = argparser.parse_known_args()
+
+    main(args)
@@ -0,0 +1,68 @@
+""" Prueba de capture_orchestrator.py con el script de captura falso stub_capture.py, sin servidores de CARLA
+
+Ejecutar con: python -m unittest test_capture_orchestrator (desde ScriptsPruebas)
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+import capture_orchestrator as orchestrator
+
+STUB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_capture.py')
+
+
+class TestCaptureOrchestrator(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_two_workers(self):
+        frames = 5
+        args = argparse.Namespace(workers=2, hosts='localhost', port=2000, port_step=2, tm_port=8000, seed=7,
+                                  towns=None, frames=frames, output=self.output)
+        configs = orchestrator.build_worker_configs(args)
+        worker_directories = [config['output'] for config in configs]
+
+        return_codes = orchestrator.run_workers(configs, STUB_SCRIPT)
+        self.assertEqual(return_codes, [0, 0])
+
+        frame_map = orchestrator.merge_outputs(worker_directories, self.output)
+        stats = orchestrator.collect_stats(worker_directories, 1.0)
+
+        #Los dos workers capturan los mismos ids de frame, en el dataset final son consecutivos y unicos
+        new_ids = [new_id for new_id, _, _ in frame_map]
+        self.assertEqual(new_ids, list(range(2 * frames)))
+        self.assertEqual(len(set((directory, frame) for _, directory, frame in frame_map)), 2 * frames)
+        self.assertEqual(stats['frames'], 2 * frames)
+        self.assertEqual([worker['frames'] for worker in stats['workers']], [frames, frames])
+
+        training = os.path.join(self.output, orchestrator.OUTPUT_FOLDER)
+        for folder, extension in orchestrator.DATASET_FOLDERS:
+            files = sorted(os.listdir(os.path.join(training, folder)))
+            self.assertEqual(files, ['%.6d%s' % (new_id, extension) for new_id in new_ids])
+
+        #Cada label es la del worker y frame original que indica frame_map, y las calib apuntan a un archivo existente
+        seeds = {config['output']: config['seed'] for config in configs}
+        for new_id, directory, frame in frame_map:
+            with open(os.path.join(training, orchestrator.LABELS_FOLDER, '%.6d.txt' % new_id)) as file:
+                fields = file.read().split()
+            self.assertEqual((float(fields[11]), float(fields[12])), (seeds[directory], frame))
+            self.assertTrue(os.path.isfile(os.path.join(training, orchestrator.CALIB_FOLDER, '%.6d.txt' % new_id)))
+
+        #Solo el primer frame de cada worker tiene el archivo de calibracion completo
+        calib = os.path.join(training, orchestrator.CALIB_FOLDER)
+        links = [name for name in os.listdir(calib) if os.path.islink(os.path.join(calib, name))]
+        self.assertEqual(len(links), 2 * (frames - 1))
+
+        with open(os.path.join(self.output, orchestrator.FRAME_MAP_FILE)) as file:
+            self.assertEqual(len(file.readlines()), 2 * frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
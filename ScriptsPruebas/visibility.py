@@ -0,0 +1,162 @@
+import numpy as np
+
+from camera_utils import w3D_to_cam3D_array, cam3D_to_cam2D_array, depth_mask
+
+#Umbrales de la fraccion ocluida de un objeto para los niveles de KITTI
+#0 = totalmente visible, 1 = parcialmente ocluido, 2 = mayormente ocluido, 3 = desconocido
+PARTLY_OCCLUDED_RATIO = 0.2
+LARGELY_OCCLUDED_RATIO = 0.5
+
+#Cantidad minima de puntos (del objeto o delante de el) para estimar la oclusion, con menos es desconocida
+MIN_OCCLUSION_POINTS = 5
+
+#Los puntos a menos de esta altura (en metros) sobre la base de la bounding box se consideran suelo, no oclusores
+GROUND_MARGIN = 0.3
+
+#Profundidad (en metros) del plano contra el que se recortan las cajas antes de proyectarlas
+NEAR_PLANE = 0.1
+
+#Aristas de una caja como pares de indices de sus 8 vertices, ordenados como carla.BoundingBox.get_local_vertices()
+#(el indice codifica los signos de x, y, z en sus bits 2, 1 y 0, cada arista une dos vertices que difieren en un bit)
+BOX_EDGES = np.array([[i, i | bit] for bit in (4, 2, 1) for i in range(8) if not i & bit])
+
+
+def lidar_to_world(points, lidar_2_world):
+    """ Transforma los puntos del lidar (N,3) o (N,4) a world-3D (N,3), conservando el dtype """
+
+    points = np.asarray(points)
+    lidar_2_world = np.asarray(lidar_2_world, dtype=points.dtype)
+
+    return points[:, :3] @ lidar_2_world[:3, :3].T + lidar_2_world[:3, 3]
+
+def points_in_boxes(points, centers, rotations, extents):
+    """ Determina que puntos (N,3) estan dentro de cada una de las M cajas orientadas
+
+        centers (M,3) y extents (M,3) son el centro y la mitad de los lados de cada caja,
+        rotations (M,3,3) sus matrices de rotacion. Devuelve una mascara (M,N).
+        Primero se descartan los pares punto-caja cuya distancia en el plano xy supera el radio de la caja,
+        y solo los pares restantes se transforman al sistema de coordenadas de la caja.
+    """
+
+    points = np.asarray(points)
+    centers = np.asarray(centers, dtype=points.dtype)
+    rotations = np.asarray(rotations, dtype=points.dtype)
+    extents = np.asarray(extents, dtype=points.dtype)
+
+    inside = np.zeros((centers.shape[0], points.shape[0]), dtype=bool)
+    if inside.size == 0:
+        return inside
+
+    #Prefiltro por radio en el plano xy, (M,N)
+    radius2 = np.sum(extents ** 2, axis=1)
+    x = np.ascontiguousarray(points[:, 0])
+    y = np.ascontiguousarray(points[:, 1])
+    near = (x[np.newaxis, :] - centers[:, 0, np.newaxis]) ** 2 + \
+           (y[np.newaxis, :] - centers[:, 1, np.newaxis]) ** 2 <= radius2[:, np.newaxis]
+    #flatnonzero sobre la mascara aplanada es mucho mas rapido que nonzero en 2D
+    box_idx, point_idx = np.divmod(np.flatnonzero(near), points.shape[0])
+
+    #Coordenadas locales de los pares candidatos: R^T * (p - c)
+    local = np.einsum('kij,ki->kj', rotations[box_idx], points[point_idx] - centers[box_idx])
+    is_inside = np.all(np.abs(local) <= extents[box_idx], axis=1)
+    inside[box_idx[is_inside], point_idx[is_inside]] = True
+
+    return inside
+
+def project_clipped_boxes(vertices_camera, K, near=NEAR_PLANE):
+    """ Bbox 2D (M,4) sin recortar a la imagen de la parte de cada caja (M,8,3 en camara-3D) delante de la camara
+
+        Las cajas se recortan contra el plano z = near antes de proyectarlas: se proyectan los vertices delante
+        del plano y las intersecciones con el plano de las aristas que lo cruzan. Las cajas que quedan enteras
+        detras del plano tienen un bbox de nan.
+    """
+
+    vertices_camera = np.asarray(vertices_camera, dtype=np.float64)
+
+    #Intersecciones de las 12 aristas con el plano (M,12,3), solo validas en las aristas que lo cruzan
+    start = vertices_camera[:, BOX_EDGES[:, 0]]
+    end = vertices_camera[:, BOX_EDGES[:, 1]]
+    start_depth, end_depth = start[:, :, 2], end[:, :, 2]
+    crosses = (start_depth - near) * (end_depth - near) < 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (near - start_depth) / (end_depth - start_depth)
+        intersections = start + t[:, :, np.newaxis] * (end - start)
+
+    points = np.concatenate([vertices_camera, intersections], axis=1)
+    valid = np.concatenate([vertices_camera[:, :, 2] >= near, crosses], axis=1)
+    points_2D = cam3D_to_cam2D_array(np.where(valid[:, :, np.newaxis], points, 1.0), K)
+
+    bbox = np.concatenate([np.where(valid[:, :, np.newaxis], points_2D, np.inf).min(axis=1),
+                           np.where(valid[:, :, np.newaxis], points_2D, -np.inf).max(axis=1)], axis=1)
+    bbox[~np.any(valid, axis=1)] = np.nan
+
+    return bbox
+
+def compute_truncation(bbox, bbox_clipped):
+    """ Fraccion del bbox 2D que queda fuera de la imagen: 1 - area(bbox recortado) / area(bbox sin recortar)
+
+        bbox debe ser el de la caja recortada contra el plano de la camara (project_clipped_boxes), asi los objetos
+        con vertices detras de la camara tienen la fraccion de su parte visible. Los que no tienen parte delante
+        de la camara (bbox de nan) se consideran totalmente truncados.
+    """
+
+    area = (bbox[:, 2] - bbox[:, 0]) * (bbox[:, 3] - bbox[:, 1])
+    area_clipped = (bbox_clipped[:, 2] - bbox_clipped[:, 0]) * (bbox_clipped[:, 3] - bbox_clipped[:, 1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        truncated = np.where(area > 0, 1.0 - area_clipped / area, 0.0)
+    truncated = np.where(np.isnan(area), 1.0, truncated)
+
+    return np.clip(truncated, 0.0, 1.0)
+
+def compute_occlusion(fields, points, lidar_2_world, K, w2c, image_w, image_h):
+    """ Nivel de oclusion de KITTI (0..3) de cada objeto a partir de la nube de puntos del mismo frame
+
+        Se proyectan los puntos del lidar en la imagen. Para cada objeto, los puntos que caen en su bbox 2D
+        y estan dentro de su bounding box 3D son impactos sobre el objeto, y los que estan mas cerca de la camara
+        que el objeto (y por encima del suelo) son oclusores. La fraccion ocluida es oclusores / (impactos + oclusores).
+    """
+
+    n = len(fields['indices'])
+    occluded = np.full(n, 3, dtype=np.int64)
+    if n == 0:
+        return occluded
+
+    #Puntos en world-3D, y solo los que estan delante de la camara y dentro de la imagen
+    points_world = lidar_to_world(points, lidar_2_world)
+    points_camera = w3D_to_cam3D_array(points_world, w2c)
+    visible = depth_mask(points_camera)
+    points_image = cam3D_to_cam2D_array(points_camera[visible], K)
+    in_image = (points_image[:, 0] >= 0) & (points_image[:, 0] < image_w) & \
+               (points_image[:, 1] >= 0) & (points_image[:, 1] < image_h)
+    points_world = points_world[visible][in_image]
+    points_depth = points_camera[visible][in_image][:, 2]
+    points_image = points_image[in_image]
+
+    #Impactos sobre cada objeto (M,N)
+    hits = points_in_boxes(points_world, fields['box_centers'], fields['box_rotations'], fields['extents'])
+
+    #Puntos dentro del bbox 2D de cada objeto (M,N)
+    bbox = fields['bbox']
+    in_bbox = (points_image[np.newaxis, :, 0] >= bbox[:, 0, np.newaxis]) & \
+              (points_image[np.newaxis, :, 0] <= bbox[:, 2, np.newaxis]) & \
+              (points_image[np.newaxis, :, 1] >= bbox[:, 1, np.newaxis]) & \
+              (points_image[np.newaxis, :, 1] <= bbox[:, 3, np.newaxis])
+
+    #Oclusores: delante del vertice mas cercano del objeto y por encima del suelo
+    near_depth = fields['vertices_depth'].min(axis=1)
+    ground_z = fields['vertices_z'].min(axis=1) + GROUND_MARGIN
+    occluders = in_bbox & ~hits & \
+                (points_depth[np.newaxis, :] < near_depth[:, np.newaxis]) & \
+                (points_world[np.newaxis, :, 2] > ground_z[:, np.newaxis])
+
+    num_hits = np.count_nonzero(hits & in_bbox, axis=1)
+    num_occluders = np.count_nonzero(occluders, axis=1)
+    total = num_hits + num_occluders
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = num_occluders / total
+    known = total >= MIN_OCCLUSION_POINTS
+    occluded[known] = np.digitize(ratio[known], [PARTLY_OCCLUDED_RATIO, LARGELY_OCCLUDED_RATIO])
+
+    return occluded